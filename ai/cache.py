@@ -0,0 +1,163 @@
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 提示词里的“当前时间”每次调用都不同，必须从缓存键中去掉
+_TIMESTAMP_LINE = re.compile(r'^[ \t]*当前时间[：:].*$', re.MULTILINE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _normalize(text):
+    text = _TIMESTAMP_LINE.sub('', text or '')
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def make_cache_key(model, temperature, system_content, user_content):
+    """
+    根据 (模型, 温度, 系统提示词, 用户输入) 计算内容寻址的缓存键
+    时间戳行会被剔除，空白字符会被归一化
+    """
+    payload = json.dumps(
+        [model, round(float(temperature), 3), _normalize(system_content), _normalize(user_content)],
+        ensure_ascii=False,
+    )
+    return 'llm:resp:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    两级LLM响应缓存
+    1. 进程内LRU，按条数限制大小，带TTL
+    2. 可选的Redis共享层（配置 LLM_CACHE_REDIS_URL 后启用），带TTL
+    """
+
+    def __init__(self, max_entries, ttl, redis_url=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._stats = {
+            'local_hits': 0,
+            'redis_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'redis_errors': 0,
+        }
+
+    def _incr(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _get_redis(self):
+        if not self.redis_url:
+            return None
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(
+                self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5
+            )
+        return self._redis
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _local_set(self, key, value):
+        with self._lock:
+            self._local[key] = (value, time.monotonic() + self.ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get(self, key):
+        value = self._local_get(key)
+        if value is not None:
+            self._incr('local_hits')
+            return value
+
+        try:
+            client = self._get_redis()
+            if client is not None:
+                raw = client.get(key)
+                if raw is not None:
+                    value = raw.decode('utf-8')
+                    self._local_set(key, value)
+                    self._incr('redis_hits')
+                    return value
+        except Exception as e:
+            self._incr('redis_errors')
+            logger.warning(f"读取Redis LLM缓存失败: {e}")
+
+        self._incr('misses')
+        return None
+
+    def set(self, key, value):
+        if not value:
+            return
+        self._local_set(key, value)
+        self._incr('sets')
+        try:
+            client = self._get_redis()
+            if client is not None:
+                client.set(key, value.encode('utf-8'), ex=int(self.ttl))
+        except Exception as e:
+            self._incr('redis_errors')
+            logger.warning(f"写入Redis LLM缓存失败: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_size'] = len(self._local)
+        lookups = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        hits = stats['local_hits'] + stats['redis_hits']
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """获取当前进程的LLM响应缓存，未启用时返回None"""
+    global _cache
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMResponseCache(
+                    max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+                    ttl=settings.LLM_CACHE_TTL,
+                    redis_url=settings.LLM_CACHE_REDIS_URL or None,
+                )
+    return _cache
+
+
+def get_cache_stats():
+    cache = get_llm_cache()
+    return cache.get_stats() if cache else {}
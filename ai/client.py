@@ -0,0 +1,179 @@
+import os
+import time
+import logging
+import threading
+
+import httpx
+from openai import OpenAI
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_clients = {}
+_owner_pid = None
+
+# 当前线程正在进行的LLM调用：HTTP请求次数（含SDK自动重试）和首字节时间
+_call_trace = threading.local()
+
+_stats = {
+    'clients_created': 0,
+    'client_reuses': 0,
+    'requests': 0,
+    'connections_opened': 0,
+    'tls_handshakes': 0,
+}
+
+
+def _incr(key, amount=1):
+    with _lock:
+        _stats[key] += amount
+
+
+def _trace(event_name, info):
+    """httpcore连接跟踪回调，统计新建连接和TLS握手次数"""
+    if event_name == 'connection.connect_tcp.complete':
+        _incr('connections_opened')
+    elif event_name == 'connection.start_tls.complete':
+        _incr('tls_handshakes')
+
+
+def _on_request(request):
+    request.extensions['trace'] = _trace
+    _incr('requests')
+    _call_trace.attempts = getattr(_call_trace, 'attempts', 0) + 1
+    _call_trace.sent_at = time.perf_counter()
+
+
+def _on_response(response):
+    # 响应钩子在收到响应头、读取响应体之前触发，以此作为首字节时间
+    sent_at = getattr(_call_trace, 'sent_at', None)
+    if sent_at is not None:
+        _call_trace.ttfb = time.perf_counter() - sent_at
+
+
+def _build_client(base_url, api_key):
+    timeout = httpx.Timeout(
+        settings.LLM_READ_TIMEOUT,
+        connect=settings.LLM_CONNECT_TIMEOUT,
+    )
+    limits = httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+    http_client = httpx.Client(
+        timeout=timeout,
+        limits=limits,
+        event_hooks={'request': [_on_request], 'response': [_on_response]},
+    )
+    return OpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        timeout=timeout,
+        http_client=http_client,
+    )
+
+
+def get_llm_client(base_url=None, api_key=None):
+    """
+    获取当前进程的长连接LLM客户端
+    同一进程内按 (base_url, api_key) 复用客户端及其连接池，
+    fork 后的子进程会丢弃父进程的客户端重新创建，避免共享socket
+    :param base_url: API地址，默认使用 settings.LLM_BASE_URL
+    :param api_key: API密钥，默认读取 AI_TOKEN
+    :return: OpenAI客户端
+    """
+    global _owner_pid
+
+    base_url = base_url or settings.LLM_BASE_URL
+    api_key = api_key or settings.LLM_API_KEY
+    key = (base_url, api_key)
+    pid = os.getpid()
+
+    with _lock:
+        if _owner_pid != pid:
+            # 父进程的连接不能在子进程中使用，直接丢弃引用
+            _clients.clear()
+            _owner_pid = pid
+
+        client = _clients.get(key)
+        if client is not None:
+            _stats['client_reuses'] += 1
+            return client
+
+        client = _build_client(base_url, api_key)
+        _clients[key] = client
+        _stats['clients_created'] += 1
+
+    logger.info(f"进程 {pid} 创建LLM客户端: {base_url}")
+    return client
+
+
+def reset_call_trace():
+    """在一次LLM调用开始前清空当前线程的调用跟踪"""
+    _call_trace.attempts = 0
+    _call_trace.sent_at = None
+    _call_trace.ttfb = None
+    _call_trace.total_tokens = None
+
+
+def set_call_usage(total_tokens):
+    """记录当前线程最近一次LLM调用的实际token用量"""
+    _call_trace.total_tokens = total_tokens
+
+
+def get_call_trace():
+    """
+    获取当前线程最近一次LLM调用的跟踪信息
+    :return: {'attempts': HTTP请求次数, 'ttfb': 最后一次请求的首字节时间（秒）,
+              'total_tokens': 实际token用量}
+    """
+    return {
+        'attempts': getattr(_call_trace, 'attempts', 0),
+        'ttfb': getattr(_call_trace, 'ttfb', None),
+        'total_tokens': getattr(_call_trace, 'total_tokens', None),
+    }
+
+
+def get_client_stats():
+    """
+    获取当前进程的连接池复用统计
+    connection_reuse_rate 为未新建连接就完成的请求占比，即节省的握手比例
+    """
+    with _lock:
+        stats = dict(_stats)
+    requests = stats['requests']
+    if requests:
+        reused = max(requests - stats['connections_opened'], 0)
+        stats['connection_reuse_rate'] = round(reused / requests, 4)
+    else:
+        stats['connection_reuse_rate'] = 0.0
+    stats['pid'] = os.getpid()
+    return stats
+
+
+def warm_up():
+    """
+    预热LLM客户端：创建客户端并提前建立一条TLS连接，
+    使第一次匹配任务不必承担握手延迟
+    """
+    try:
+        client = get_llm_client()
+        if settings.LLM_WARMUP_CONNECT:
+            client.models.list()
+        logger.info(f"LLM客户端预热完成: {get_client_stats()}")
+    except Exception as e:
+        logger.warning(f"LLM客户端预热失败: {e}")
+
+
+def close_clients():
+    """关闭当前进程的所有LLM客户端"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            logger.warning(f"关闭LLM客户端失败: {e}")
@@ -0,0 +1,267 @@
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from matchmaking import prompts
+
+TAG_POOL = [
+    "编程", "运动", "学习", "娱乐", "黑客松", "约饭",
+    "外向", "内向", "组织者", "参与者", "新手", "进阶", "专家",
+    "早起", "夜猫子", "周末", "工作日", "小团体", "大聚会", "一对一", "团队合作",
+]
+TRAIT_POOL = ["外向", "内向", "喜欢编程", "热爱运动", "擅长组织", "乐于分享", "注重效率"]
+REASON_POOL = ["兴趣高度契合", "时间安排一致", "同城便于见面", "性格互补", "技能互补", "活动目标相同"]
+
+
+def _seeded_random(text):
+    """同样的输入得到同样的输出"""
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return random.Random(int.from_bytes(digest[:8], 'big'))
+
+
+def _json_lines_after(user_content, header):
+    """解析提示词中某个标题下每行一个的紧凑JSON"""
+    if header not in user_content:
+        return []
+    items = []
+    for line in user_content.split(header, 1)[1].splitlines():
+        line = line.strip()
+        if not line:
+            if items:
+                break
+            continue
+        if not line.startswith('{'):
+            break
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError:
+            break
+    return items
+
+
+def _integrated_info(rng):
+    return {
+        "user_traits": rng.sample(TRAIT_POOL, 2),
+        "activity_info": "活动相关信息",
+        "matching_preferences": "希望找到兴趣相投、时间契合的搭子",
+        "key_points": rng.sample(REASON_POOL, 2),
+        "risk_level": "low",
+    }
+
+
+def _recommendations(rng, user_ids):
+    picked = rng.sample(user_ids, min(len(user_ids), 5))
+    return [{
+        "user_id": user_id,
+        "match_score": round(rng.uniform(5, 9.8), 1),
+        "reasons": rng.sample(REASON_POOL, 2),
+    } for user_id in picked]
+
+
+def build_stub_reply(system_content, user_content):
+    """
+    按提示词类型生成符合格式要求的确定性输出
+    :return: (prompt_type, content)
+    """
+    rng = _seeded_random(system_content + user_content)
+
+    if system_content == prompts.INTEGRATE_AND_TAG_SYSTEM_PROMPT:
+        data = dict(_integrated_info(rng), tags=rng.sample(TAG_POOL, rng.randint(5, 8)))
+        return 'integrate_and_tag', json.dumps(data, ensure_ascii=False)
+    if system_content == prompts.PROFILE_SUMMARY_SYSTEM_PROMPT:
+        data = {
+            "user_traits": rng.sample(TRAIT_POOL, 2),
+            "social_style": "喜欢小团体活动",
+            "profile_points": rng.sample(REASON_POOL, 2),
+        }
+        return 'profile_summary', json.dumps(data, ensure_ascii=False)
+    if system_content == prompts.PROFILE_SUMMARY_AND_TAG_SYSTEM_PROMPT:
+        data = {
+            "user_traits": rng.sample(TRAIT_POOL, 2),
+            "social_style": "喜欢小团体活动",
+            "profile_points": rng.sample(REASON_POOL, 2),
+            "tags": rng.sample(TAG_POOL, rng.randint(5, 8)),
+        }
+        return 'profile_summary_and_tag', json.dumps(data, ensure_ascii=False)
+    if system_content == prompts.INTEGRATE_SYSTEM_PROMPT:
+        return 'integrate', json.dumps(_integrated_info(rng), ensure_ascii=False)
+    if system_content == prompts.TAGS_SYSTEM_PROMPT:
+        return 'tags', json.dumps(rng.sample(TAG_POOL, rng.randint(5, 8)), ensure_ascii=False)
+    if system_content == prompts.RECOMMEND_SYSTEM_PROMPT:
+        candidates = _json_lines_after(user_content, '候选搭子列表（每行一个）：')
+        user_ids = [c['user_id'] for c in candidates if 'user_id' in c]
+        return 'recommend', json.dumps(_recommendations(rng, user_ids), ensure_ascii=False)
+    if system_content == prompts.BATCH_RECOMMEND_SYSTEM_PROMPT:
+        requesters = _json_lines_after(user_content, '发起者列表（每行一个）：')
+        data = {
+            str(r['request_id']): _recommendations(rng, r.get('candidate_user_ids', []))
+            for r in requesters if 'request_id' in r
+        }
+        return 'batch_recommend', json.dumps(data, ensure_ascii=False)
+    return 'unknown', json.dumps({"message": "stub"}, ensure_ascii=False)
+
+
+class LatencyProfile:
+    """可注入的延迟分布与错误率"""
+
+    def __init__(self, distribution, mean_ms, sigma, error_rate, error_statuses, seed):
+        self.distribution = distribution
+        self.mean = mean_ms / 1000
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_delay(self):
+        with self._lock:
+            if self.distribution == 'none' or self.mean <= 0:
+                return 0.0
+            if self.distribution == 'fixed':
+                return self.mean
+            if self.distribution == 'normal':
+                return max(self._rng.gauss(self.mean, self.mean * self.sigma), 0.0)
+            # lognormal：均值为 mean，长尾由 sigma 控制
+            mu = math.log(self.mean) - self.sigma ** 2 / 2
+            return self._rng.lognormvariate(mu, self.sigma)
+
+    def sample_error(self):
+        with self._lock:
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return self._rng.choice(self.error_statuses)
+        return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    profile = None
+    stats = None
+    quiet = False
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        messages = request.get('messages', [])
+        system_content = next((m['content'] for m in messages if m.get('role') == 'system'), '')
+        user_content = next((m['content'] for m in messages if m.get('role') == 'user'), '')
+
+        time.sleep(self.profile.sample_delay())
+        error_status = self.profile.sample_error()
+        if error_status:
+            self.stats.record('error')
+            self._send_json(error_status, {"error": {"message": f"stub injected error {error_status}", "type": "stub_error"}})
+            return
+
+        prompt_type, content = build_stub_reply(system_content, user_content)
+        self.stats.record(prompt_type)
+        prompt_tokens = prompts.estimate_tokens(system_content) + prompts.estimate_tokens(user_content)
+        completion_tokens = prompts.estimate_tokens(content)
+        self._send_json(200, {
+            "id": f"chatcmpl-stub-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'stub-model'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+class _Stats:
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+class Command(BaseCommand):
+    help = '启动本地OpenAI兼容的LLM模拟服务，用于匹配流程压测（设置 LLM_BASE_URL=http://<host>:<port>/v1/）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+        parser.add_argument('--port', type=int, default=8100, help='监听端口')
+        parser.add_argument(
+            '--latency',
+            type=str,
+            choices=['none', 'fixed', 'normal', 'lognormal'],
+            default='lognormal',
+            help='延迟分布'
+        )
+        parser.add_argument('--latency-ms', type=float, default=1500, help='平均延迟（毫秒）')
+        parser.add_argument('--sigma', type=float, default=0.5, help='延迟离散程度（normal为变异系数，lognormal为对数标准差）')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='注入错误的比例（0-1）')
+        parser.add_argument(
+            '--error-status',
+            type=str,
+            default='500,429',
+            help='注入错误时使用的HTTP状态码，逗号分隔'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='延迟与错误注入的随机种子')
+        parser.add_argument('--quiet', action='store_true', help='不输出每个请求的访问日志')
+
+    def handle(self, *args, **options):
+        StubHandler.profile = LatencyProfile(
+            distribution=options['latency'],
+            mean_ms=options['latency_ms'],
+            sigma=options['sigma'],
+            error_rate=options['error_rate'],
+            error_statuses=[int(code) for code in options['error_status'].split(',') if code.strip()],
+            seed=options['seed'],
+        )
+        StubHandler.stats = _Stats()
+        StubHandler.quiet = options['quiet']
+
+        server = ThreadingHTTPServer((options['host'], options['port']), StubHandler)
+        self.stdout.write(self.style.SUCCESS(
+            f"LLM模拟服务已启动: http://{options['host']}:{options['port']}/v1/ "
+            f"(延迟 {options['latency']} {options['latency_ms']:.0f}ms, 错误率 {options['error_rate']:.1%})"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'请求统计: {StubHandler.stats.counts}')
@@ -0,0 +1,224 @@
+"""
+LLM调用指标
+
+每次LLM调用记录耗时、首字节时间（TTFB）、token用量、重试次数、费用估算、
+所属匹配阶段以及JSON提取是否用到了兜底解析。
+- 任务级：process_buddy_request_matching 开始时创建收集器，结束时汇总写入任务结果
+- 进程级：累计各阶段指标，通过 get_llm_metrics() 读取；每次调用另输出一行
+  key=value 格式的日志（logger: ai.metrics），便于日志系统聚合
+对冲请求单独计入 hedged_calls（token和费用照常累计），不算作一次调用，也不计入耗时
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_task_metrics = ContextVar('llm_task_metrics', default=None)
+_current_stage = ContextVar('llm_stage', default='unknown')
+# JSON提取发生在 llm_stage 之外，按最近一次调用的阶段归类
+_last_call_stage = ContextVar('llm_last_call_stage', default='unknown')
+_hedged_call = ContextVar('llm_hedged_call', default=False)
+
+_lock = threading.Lock()
+_process_totals = {}
+
+# 汇总中保留的最耗token的候选人数量
+_TOP_CANDIDATES = 5
+
+
+def _empty_totals():
+    return {
+        'calls': 0,
+        'hedged_calls': 0,
+        'cache_hits': 0,
+        'errors': 0,
+        'retries': 0,
+        'json_fallbacks': 0,
+        'json_failures': 0,
+        'wall_ms': 0.0,
+        'ttfb_ms': 0.0,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'cost': 0.0,
+    }
+
+
+def _accumulate(totals, record):
+    if record['cached']:
+        totals['cache_hits'] += 1
+        return
+    totals['prompt_tokens'] += record['prompt_tokens']
+    totals['completion_tokens'] += record['completion_tokens']
+    totals['cost'] += record['cost']
+    if record['hedged']:
+        totals['hedged_calls'] += 1
+        return
+    totals['calls'] += 1
+    totals['errors'] += 1 if record['error'] else 0
+    totals['retries'] += max(record['attempts'] - 1, 0)
+    totals['wall_ms'] += record['wall_ms']
+    totals['ttfb_ms'] += record['ttfb_ms'] or 0.0
+
+
+def _rounded(totals):
+    result = dict(totals)
+    for key in ('wall_ms', 'ttfb_ms'):
+        result[key] = round(result[key], 1)
+    result['cost'] = round(result['cost'], 6)
+    return result
+
+
+def estimate_cost(prompt_tokens, completion_tokens):
+    """按 settings 中的每千token单价估算费用"""
+    return (
+        prompt_tokens * settings.LLM_PRICE_PROMPT_PER_1K
+        + completion_tokens * settings.LLM_PRICE_COMPLETION_PER_1K
+    ) / 1000
+
+
+class TaskLLMMetrics:
+    """单个匹配任务内所有LLM调用的记录"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.calls = []
+        self.candidate_tokens = {}
+
+    def add(self, record):
+        self.calls.append(record)
+
+    def mark_json_extraction(self, details):
+        # JSON提取总是紧跟在对应的LLM调用之后
+        if not self.calls:
+            return
+        record = self.calls[-1]
+        record['json_method'] = details.get('method')
+        record['json_fallback'] = details.get('method') != 'direct'
+
+    def summary(self):
+        totals = _empty_totals()
+        stages = {}
+        for record in self.calls:
+            _accumulate(totals, record)
+            stage = stages.setdefault(record['stage'], _empty_totals())
+            _accumulate(stage, record)
+            for bucket in (totals, stage):
+                if record.get('json_method') == 'failed':
+                    bucket['json_failures'] += 1
+                elif record.get('json_fallback'):
+                    bucket['json_fallbacks'] += 1
+
+        heaviest = sorted(self.candidate_tokens.items(), key=lambda item: item[1], reverse=True)
+        summary = _rounded(totals)
+        summary.update({
+            'task_ms': round((time.perf_counter() - self.started_at) * 1000, 1),
+            'stages': {name: _rounded(values) for name, values in stages.items()},
+            'slowest_stage': max(stages, key=lambda name: stages[name]['wall_ms']) if stages else None,
+            'heaviest_candidates': [
+                {'user_id': user_id, 'tokens': tokens}
+                for user_id, tokens in heaviest[:_TOP_CANDIDATES]
+            ],
+        })
+        return summary
+
+
+def begin_task_metrics():
+    """开始收集当前任务的LLM指标，返回 (收集器, 用于 end_task_metrics 的token)"""
+    metrics = TaskLLMMetrics()
+    return metrics, _task_metrics.set(metrics)
+
+
+def end_task_metrics(token):
+    _task_metrics.reset(token)
+
+
+@contextmanager
+def hedged_call():
+    """标记其中发生的LLM调用为对冲请求"""
+    token = _hedged_call.set(True)
+    try:
+        yield
+    finally:
+        _hedged_call.reset(token)
+
+
+@contextmanager
+def llm_stage(stage):
+    """标记其中发生的LLM调用所属的匹配阶段"""
+    if not stage:
+        yield
+        return
+    token = _current_stage.set(stage)
+    _last_call_stage.set(stage)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def record_llm_call(model, wall_ms, ttfb_ms=None, prompt_tokens=0, completion_tokens=0,
+                    attempts=1, cached=False, error=None):
+    """记录一次LLM调用（或一次缓存命中）"""
+    record = {
+        'stage': _current_stage.get(),
+        'model': model,
+        'cached': cached,
+        'hedged': _hedged_call.get(),
+        'wall_ms': wall_ms,
+        'ttfb_ms': ttfb_ms,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'attempts': attempts,
+        'cost': 0.0 if cached else estimate_cost(prompt_tokens, completion_tokens),
+        'error': error,
+    }
+
+    _last_call_stage.set(record['stage'])
+    metrics = _task_metrics.get()
+    if metrics is not None:
+        metrics.add(record)
+
+    with _lock:
+        _accumulate(_process_totals.setdefault(record['stage'], _empty_totals()), record)
+
+    logger.info(
+        "llm_call stage=%s model=%s cached=%s hedged=%s wall_ms=%.1f ttfb_ms=%s prompt_tokens=%d "
+        "completion_tokens=%d attempts=%d cost=%.6f error=%s",
+        record['stage'], model, cached, record['hedged'], wall_ms,
+        f'{ttfb_ms:.1f}' if ttfb_ms is not None else '-',
+        prompt_tokens, completion_tokens, attempts, record['cost'], error or '-',
+    )
+    return record
+
+
+def record_json_extraction(details):
+    """
+    记录上一次LLM调用的JSON提取方式
+    :param details: extract_json 填充的 details，method 为 direct/scan/repaired/truncated/failed
+    """
+    method = details.get('method')
+    metrics = _task_metrics.get()
+    if metrics is not None:
+        metrics.mark_json_extraction(details)
+    if method != 'direct':
+        with _lock:
+            totals = _process_totals.setdefault(_last_call_stage.get(), _empty_totals())
+            totals['json_failures' if method == 'failed' else 'json_fallbacks'] += 1
+
+
+def record_candidate_tokens(user_id, tokens):
+    """记录候选人信息在推荐提示词中占用的token数"""
+    metrics = _task_metrics.get()
+    if metrics is not None:
+        metrics.candidate_tokens[user_id] = max(tokens, metrics.candidate_tokens.get(user_id, 0))
+
+
+def get_llm_metrics():
+    """获取当前进程按阶段累计的LLM调用指标"""
+    with _lock:
+        return {stage: _rounded(values) for stage, values in _process_totals.items()}
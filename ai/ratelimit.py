@@ -0,0 +1,261 @@
+"""
+LLM调用的集群级令牌桶限流
+
+服务商按API key限制每秒请求数和每分钟token数，而每个Celery worker都独立调用LLM，
+突发流量会变成大量429和重试。这里用两个令牌桶同时限制：
+- requests：每秒请求数，允许 LLM_RATE_LIMIT_BURST 的突发
+- tokens：每分钟token数，按提示词估算值加预期输出预扣，调用结束后按实际用量补差
+
+默认使用Redis（Lua脚本原子地检查并扣减两个桶，所有worker共享额度），
+Redis不可用或配置为 local 时退回进程内令牌桶（额度仅在本进程内生效）。
+Redis调用使用较短的读超时；失败后 LLM_RATE_LIMIT_REDIS_BACKOFF 秒内直接使用进程内令牌桶，
+不再每次请求都去等一次超时。
+拿不到令牌时在 LLM_RATE_LIMIT_MAX_WAIT 内协作等待，仍拿不到则抛出 LLMRateLimited，
+由匹配任务稍后重新入队。
+"""
+import time
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+
+from utils.redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+# 两个桶一起检查，只有都足够时才扣减；返回两个桶的剩余令牌和需要等待的秒数
+_ACQUIRE_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local levels = {}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local cost = tonumber(ARGV[i * 3])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait == 0 then
+    for i = 1, 2 do
+        levels[i] = levels[i] - tonumber(ARGV[i * 3])
+    end
+end
+for i = 1, 2 do
+    redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i]), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], 3600)
+end
+return {tostring(levels[1]), tostring(levels[2]), tostring(wait)}
+"""
+
+
+class LLMRateLimited(Exception):
+    """在最长等待时间内没有拿到限流令牌"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Bucket:
+    """进程内令牌桶"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class LocalTokenBuckets:
+    """进程内的两桶限流，Redis不可用时使用"""
+
+    def __init__(self, limits):
+        self._buckets = [_Bucket(capacity, rate) for capacity, rate in limits]
+        self._lock = threading.Lock()
+
+    def try_acquire(self, costs):
+        """
+        :param costs: 两个桶各自的扣减量
+        :return: (两个桶的剩余令牌, 需要等待的秒数，0 表示已扣减)
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            for bucket, cost in zip(self._buckets, costs):
+                bucket.refill(now)
+                if bucket.tokens < cost:
+                    wait = max(wait, (cost - bucket.tokens) / bucket.rate)
+            if wait == 0:
+                for bucket, cost in zip(self._buckets, costs):
+                    bucket.tokens -= cost
+            return [bucket.tokens for bucket in self._buckets], wait
+
+    def adjust(self, index, amount):
+        with self._lock:
+            self._buckets[index].tokens += amount
+
+    def empty(self, index):
+        with self._lock:
+            self._buckets[index].tokens = min(self._buckets[index].tokens, 0)
+
+
+class RateLimiter:
+    """
+    LLM请求数与token数的联合限流
+    """
+
+    BUCKETS = ('requests', 'tokens')
+
+    def __init__(self, api_key):
+        burst = max(settings.LLM_RATE_LIMIT_BURST, 1)
+        tpm = settings.LLM_RATE_LIMIT_TPM
+        self.limits = [
+            (burst, settings.LLM_RATE_LIMIT_RPS),
+            (tpm, tpm / 60),
+        ]
+        key_hash = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]
+        self.keys = [f'llm:ratelimit:{key_hash}:{name}' for name in self.BUCKETS]
+        self.backend = settings.LLM_RATE_LIMIT_BACKEND
+        self._local = LocalTokenBuckets(self.limits)
+        self._script = None
+        self._levels = [capacity for capacity, _ in self.limits]
+        # Redis失败后在该时刻（monotonic）之前不再尝试
+        self._redis_retry_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            'acquired': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'rate_limited': 0,
+            'redis_errors': 0,
+        }
+
+    def _incr(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _use_redis(self):
+        return self.backend == 'redis' and time.monotonic() >= self._redis_retry_at
+
+    def _redis(self):
+        return get_redis(socket_timeout=settings.LLM_RATE_LIMIT_REDIS_TIMEOUT)
+
+    def _redis_failed(self, message, error):
+        self._incr('redis_errors')
+        self._redis_retry_at = time.monotonic() + settings.LLM_RATE_LIMIT_REDIS_BACKOFF
+        logger.warning(f"{message}，{settings.LLM_RATE_LIMIT_REDIS_BACKOFF:g}s 内使用进程内令牌桶: {error}")
+
+    def _try_acquire(self, costs):
+        if self._use_redis():
+            try:
+                if self._script is None:
+                    self._script = self._redis().register_script(_ACQUIRE_SCRIPT)
+                args = []
+                for (capacity, rate), cost in zip(self.limits, costs):
+                    args.extend([capacity, rate, cost])
+                requests_left, tokens_left, wait = self._script(keys=self.keys, args=args)
+                return [float(requests_left), float(tokens_left)], float(wait)
+            except Exception as e:
+                self._redis_failed("Redis限流不可用", e)
+        return self._local.try_acquire(costs)
+
+    def acquire(self, estimated_tokens, max_wait=None):
+        """
+        获取一次请求所需的令牌，不足时协作等待
+        :param estimated_tokens: 预扣的token数（提示词估算 + 预期输出）
+        :param max_wait: 最长等待秒数，默认 LLM_RATE_LIMIT_MAX_WAIT
+        :raises LLMRateLimited: 等待超时
+        """
+        max_wait = settings.LLM_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        # 单次预扣不能超过桶容量，否则永远拿不到
+        costs = [1, min(estimated_tokens, self.limits[1][0])]
+        started = time.monotonic()
+        waited = False
+
+        while True:
+            levels, wait = self._try_acquire(costs)
+            self._levels = levels
+            if wait == 0:
+                self._incr('acquired')
+                if waited:
+                    self._incr('waits')
+                    self._incr('wait_seconds', time.monotonic() - started)
+                return costs[1]
+
+            remaining = max_wait - (time.monotonic() - started)
+            if wait > remaining:
+                self._incr('rate_limited')
+                raise LLMRateLimited(f"LLM限流，需要等待 {wait:.1f}s", retry_after=wait)
+            time.sleep(wait)
+            waited = True
+
+    def settle(self, reserved_tokens, actual_tokens):
+        """调用结束后按实际token用量补差（可能为负，即退还）"""
+        delta = actual_tokens - reserved_tokens
+        if not delta:
+            return
+        if self._use_redis():
+            try:
+                self._redis().hincrbyfloat(self.keys[1], 'tokens', -delta)
+                return
+            except Exception as e:
+                self._redis_failed("Redis限流补差失败", e)
+        self._local.adjust(1, -delta)
+
+    def drain(self):
+        """收到服务商429时清空请求桶，让所有worker一起退避"""
+        if self._use_redis():
+            try:
+                self._redis().hset(self.keys[0], 'tokens', 0)
+                return
+            except Exception as e:
+                self._redis_failed("Redis限流清空失败", e)
+        self._local.empty(0)
+
+    def stats(self):
+        """桶的填充水平为最近一次获取令牌时的值"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        stats['backend'] = self.backend
+        for name, (capacity, _), level in zip(self.BUCKETS, self.limits, self._levels):
+            stats[f'{name}_available'] = round(level, 1)
+            stats[f'{name}_fill'] = round(max(level, 0) / capacity, 4) if capacity else 0.0
+        return stats
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """获取当前API key的限流器，未启用限流时返回 None"""
+    global _limiter
+    if not settings.LLM_RATE_LIMIT_ENABLED:
+        return None
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(settings.LLM_API_KEY)
+    return _limiter
+
+
+def get_rate_limit_stats():
+    """获取限流统计，包括两个令牌桶的填充水平"""
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return {'enabled': False}
+    return dict(limiter.stats(), enabled=True)
@@ -0,0 +1,315 @@
+"""
+LLM调用的熔断、阶段超时与对冲请求
+
+- 熔断器：连续失败（超时、连接错误、429、5xx，或耗时超过慢调用阈值）达到阈值后熔断，
+  熔断期间直接抛出 CircuitOpenError，调用方改用不依赖LLM的兜底逻辑；
+  冷却时间过后放行一个探测请求，成功则恢复
+- 阶段超时：每个匹配阶段有独立的总耗时上限，超时即放弃等待
+- 对冲请求：指定阶段在等待超过对冲延迟后再发一个相同请求，取先返回的结果，
+  用少量额外token换取尾延迟
+"""
+import os
+import time
+import itertools
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.conf import settings
+
+from .metrics import hedged_call
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """LLM熔断中，请求未发出"""
+
+
+class LLMDeadlineExceeded(Exception):
+    """LLM调用超过阶段超时时间"""
+
+
+class CircuitBreaker:
+    """
+    进程内熔断器
+    closed -> open：连续失败次数达到 failure_threshold
+    open -> half_open：经过 recovery_timeout 秒后放行一个探测请求
+    half_open -> closed / open：探测成功 / 失败
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, recovery_timeout, slow_call_threshold=None):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {
+            'opened': 0,
+            'rejected': 0,
+            'failures': 0,
+            'slow_calls': 0,
+        }
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        """是否放行请求；半开状态同一时间只放行一个探测请求"""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    self._stats['rejected'] += 1
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self._stats['rejected'] += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self, duration=None):
+        if self.slow_call_threshold and duration is not None and duration > self.slow_call_threshold:
+            with self._lock:
+                self._stats['slow_calls'] += 1
+            self.record_failure()
+            return
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("LLM熔断恢复")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._stats['opened'] += 1
+                logger.warning(f"LLM熔断开启，{self.recovery_timeout}秒后重试（连续失败 {self._failures} 次）")
+
+    def release(self):
+        """请求失败但与服务端无关（如参数错误），不改变熔断计数，只释放探测名额"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return dict(self._stats, state=state, consecutive_failures=self._failures)
+
+
+_lock = threading.Lock()
+_breaker = None
+_executor = None
+_owner_pid = None
+
+_hedge_stats = {
+    'hedges_fired': 0,
+    'hedge_wins': 0,
+    'deadline_exceeded': 0,
+}
+
+
+def _ensure_process():
+    """fork 后的子进程重新创建熔断器和线程池"""
+    global _breaker, _executor, _owner_pid
+
+    pid = os.getpid()
+    if _owner_pid == pid:
+        return
+    with _lock:
+        if _owner_pid == pid:
+            return
+        _breaker = CircuitBreaker(
+            failure_threshold=settings.LLM_BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=settings.LLM_BREAKER_RECOVERY_TIMEOUT,
+            slow_call_threshold=settings.LLM_BREAKER_SLOW_CALL_SECONDS,
+        )
+        # 父进程的线程不会被 fork 复制，直接丢弃旧线程池
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.LLM_MAX_CONNECTIONS, thread_name_prefix='llm-call'
+        )
+        _owner_pid = pid
+
+
+def get_breaker():
+    _ensure_process()
+    return _breaker
+
+
+def llm_available():
+    """LLM是否可用（熔断未开启），不占用半开状态的探测名额"""
+    return get_breaker().state != CircuitBreaker.OPEN
+
+
+def _is_provider_failure(exc):
+    """超时、连接错误、限流和服务端错误计入熔断，请求本身的错误（400/401等）不计入"""
+    import openai
+
+    if isinstance(exc, (LLMDeadlineExceeded, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return False
+
+
+def stage_timeout(stage):
+    """阶段超时时间（秒），未单独配置的阶段使用 LLM_READ_TIMEOUT"""
+    return settings.LLM_STAGE_TIMEOUTS.get(stage, settings.LLM_READ_TIMEOUT)
+
+
+def _submit(fn, *args):
+    # 线程池中的调用沿用当前上下文，LLM指标仍归入当前任务和阶段
+    context = contextvars.copy_context()
+    return _executor.submit(context.run, fn, *args)
+
+
+def _incr(key):
+    with _lock:
+        _hedge_stats[key] += 1
+
+
+def _call_with_deadline(fn, deadline, hedge_delay=None):
+    """
+    在 deadline 秒内获取 fn() 的结果
+    设置 hedge_delay 时，首个请求在该时间内未返回则再发一个相同请求，取先成功的结果
+    超时后不再等待，未完成的请求在后台结束，结果被丢弃
+    """
+    started = time.monotonic()
+    primary = _submit(fn)
+    futures = [primary]
+    hedged = False
+    last_error = None
+
+    while futures:
+        remaining = deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+        timeout = remaining
+        if hedge_delay is not None and not hedged:
+            timeout = min(remaining, max(hedge_delay - (time.monotonic() - started), 0))
+
+        done, pending = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if future is not primary:
+                _incr('hedge_wins')
+            return result
+        futures = [f for f in futures if f not in done]
+
+        if hedge_delay is not None and not hedged and time.monotonic() - started >= hedge_delay:
+            # 首个请求迟迟未返回，发出对冲请求；首个请求提前失败时已退出循环并直接抛出，由上层重试
+            hedged = True
+            _incr('hedges_fired')
+            logger.info(f"LLM请求 {hedge_delay:.1f}s 未返回，发出对冲请求")
+            futures.append(_submit(fn))
+
+    if futures:
+        _incr('deadline_exceeded')
+        raise LLMDeadlineExceeded(f"LLM调用超过 {deadline:g}s 阶段超时")
+    raise last_error
+
+
+def _call_and_settle(limiter, reserved, system_content, user_content, temperature, timeout):
+    """调用LLM，结束后按实际token用量对预扣的限流令牌补差"""
+    import openai
+    from .views import GetLLMOutput
+    from .client import get_call_trace
+
+    try:
+        return GetLLMOutput(system_content, user_content, temperature, timeout=timeout)
+    except openai.RateLimitError:
+        if limiter:
+            limiter.drain()
+        raise
+    finally:
+        if limiter:
+            # 没有返回用量（请求失败）时按未消耗token退还预扣
+            limiter.settle(reserved, get_call_trace()['total_tokens'] or 0)
+
+
+def call_llm(system_content, user_content, temperature, stage=None):
+    """
+    经过限流和熔断器调用LLM，应用阶段超时，并按配置对指定阶段发出对冲请求
+    :raises CircuitOpenError: 熔断中
+    :raises LLMRateLimited: 等待限流令牌超时
+    """
+    from matchmaking.prompts import estimate_tokens
+    from .ratelimit import get_rate_limiter
+
+    # 熔断中不必排队等待限流令牌
+    if not llm_available():
+        raise CircuitOpenError("LLM熔断中，跳过调用")
+
+    limiter = get_rate_limiter()
+    estimated_tokens = (
+        estimate_tokens(system_content) + estimate_tokens(user_content)
+        + settings.LLM_RATE_LIMIT_COMPLETION_TOKENS
+    )
+    # 先拿令牌再进入熔断器，避免排队时占用半开状态的探测名额
+    reserved = limiter.acquire(estimated_tokens) if limiter else 0
+
+    breaker = get_breaker()
+    if not breaker.allow_request():
+        if limiter:
+            limiter.settle(reserved, 0)
+        raise CircuitOpenError("LLM熔断中，跳过调用")
+
+    deadline = stage_timeout(stage)
+    hedge_delay = settings.LLM_HEDGE_DELAY if stage in settings.LLM_HEDGE_STAGES else None
+    order = itertools.count()
+
+    def attempt():
+        if not next(order):
+            return _call_and_settle(limiter, reserved, system_content, user_content, temperature, deadline)
+        # 对冲请求不等待令牌，拿不到就放弃对冲
+        hedge_reserved = limiter.acquire(estimated_tokens, max_wait=0) if limiter else 0
+        with hedged_call():
+            return _call_and_settle(
+                limiter, hedge_reserved, system_content, user_content, temperature, deadline
+            )
+
+    started = time.monotonic()
+    try:
+        response = _call_with_deadline(attempt, deadline, hedge_delay)
+    except Exception as e:
+        if _is_provider_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.release()
+        raise
+    breaker.record_success(time.monotonic() - started)
+    return response
+
+
+def get_resilience_stats():
+    """获取当前进程的熔断与对冲统计"""
+    with _lock:
+        stats = dict(_hedge_stats)
+    stats['breaker'] = get_breaker().stats()
+    return stats
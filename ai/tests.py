@@ -0,0 +1,318 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from . import client, resilience
+from .cache import LLMResponseCache, make_cache_key
+from .metrics import begin_task_metrics, end_task_metrics, hedged_call, llm_stage, record_llm_call
+from .ratelimit import LLMRateLimited, RateLimiter
+from .resilience import CircuitBreaker, CircuitOpenError, LLMDeadlineExceeded
+
+
+class FakeClock:
+    """可控的 time 模块替身：sleep 只推进时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@override_settings(LLM_RATE_LIMIT_BACKEND='local', LLM_RATE_LIMIT_RPS=2.0, LLM_RATE_LIMIT_BURST=3,
+                   LLM_RATE_LIMIT_TPM=6000, LLM_RATE_LIMIT_MAX_WAIT=5.0)
+class RateLimiterTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('ai.ratelimit.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_waits_at_the_request_rate(self):
+        limiter = RateLimiter('key')
+        for _ in range(3):
+            limiter.acquire(10)
+        self.assertEqual(self.clock.sleeps, [])
+        limiter.acquire(10)
+        self.assertEqual(self.clock.sleeps, [0.5])
+        stats = limiter.stats()
+        self.assertEqual((stats['acquired'], stats['waits']), (4, 1))
+
+    def test_token_bucket_limits_and_settles(self):
+        limiter = RateLimiter('key')
+        # 预扣超过桶容量时按容量计
+        self.assertEqual(limiter.acquire(10000), 6000)
+        # 实际只用了 1200，退还后下一次立即可用
+        limiter.settle(6000, 1200)
+        limiter.acquire(4800)
+        self.assertEqual(self.clock.sleeps, [])
+        # 桶已空，按每秒 100 token 补充，等待超过上限时放弃
+        with self.assertRaises(LLMRateLimited) as ctx:
+            limiter.acquire(1000)
+        self.assertAlmostEqual(ctx.exception.retry_after, 10.0)
+        self.assertEqual(limiter.stats()['rate_limited'], 1)
+
+    def test_drain_empties_the_request_bucket(self):
+        limiter = RateLimiter('key')
+        limiter.drain()
+        limiter.acquire(10)
+        self.assertEqual(self.clock.sleeps, [0.5])
+
+    @override_settings(LLM_RATE_LIMIT_BACKEND='redis')
+    def test_redis_unavailable_falls_back_to_local_buckets(self):
+        limiter = RateLimiter('key')
+        with mock.patch('ai.ratelimit.get_redis', side_effect=ConnectionError):
+            for _ in range(4):
+                limiter.acquire(10)
+        self.assertEqual(self.clock.sleeps, [0.5])
+        # 失败后退避期内不再访问Redis
+        self.assertEqual(limiter.stats()['redis_errors'], 1)
+
+    @override_settings(LLM_RATE_LIMIT_BACKEND='redis', LLM_RATE_LIMIT_REDIS_TIMEOUT=0.2,
+                       LLM_RATE_LIMIT_REDIS_BACKOFF=30.0)
+    def test_redis_is_retried_after_the_backoff(self):
+        limiter = RateLimiter('key')
+        with mock.patch('ai.ratelimit.get_redis', side_effect=ConnectionError) as get_redis:
+            limiter.acquire(10)
+            limiter.settle(10, 5)
+            self.assertEqual(get_redis.call_count, 1)
+            get_redis.assert_called_with(socket_timeout=0.2)
+            self.clock.now += 30
+            limiter.acquire(10)
+            self.assertEqual(get_redis.call_count, 2)
+
+
+@override_settings(LLM_BASE_URL='http://llm.test/v1', LLM_API_KEY='key')
+class LLMClientTest(SimpleTestCase):
+    def setUp(self):
+        client.close_clients()
+        self.addCleanup(client.close_clients)
+
+    def test_repeated_calls_reuse_the_client(self):
+        first = client.get_llm_client()
+        self.assertIs(client.get_llm_client(), first)
+        self.assertIs(client.get_llm_client('http://llm.test/v1', 'key'), first)
+
+    def test_different_base_url_gets_its_own_client(self):
+        first = client.get_llm_client()
+        other = client.get_llm_client(base_url='http://other.test/v1')
+        self.assertIsNot(other, first)
+        self.assertEqual(str(other.base_url), 'http://other.test/v1/')
+        self.assertIs(client.get_llm_client(base_url='http://other.test/v1'), other)
+
+    def test_forked_process_builds_a_new_client(self):
+        first = client.get_llm_client()
+        with mock.patch('ai.client.os.getpid', return_value=-1):
+            self.assertIsNot(client.get_llm_client(), first)
+
+
+class LLMCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('ai.cache.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit_and_ttl(self):
+        cache = LLMResponseCache(max_entries=4, ttl=60)
+        key = make_cache_key('model', 0.3, 'system', 'user')
+        self.assertIsNone(cache.get(key))
+        cache.set(key, '["编程"]')
+        self.assertEqual(cache.get(key), '["编程"]')
+        self.clock.now += 61
+        self.assertIsNone(cache.get(key))
+        stats = cache.get_stats()
+        self.assertEqual((stats['local_hits'], stats['misses']), (1, 2))
+
+    def test_timestamp_line_does_not_change_the_key(self):
+        first = make_cache_key('model', 0.3, 'system', '当前时间：2026-10-17 09:00\n找人一起组队')
+        later = make_cache_key('model', 0.3, 'system', '当前时间: 2026-10-18 21:30\n找人一起组队  ')
+        self.assertEqual(first, later)
+        self.assertNotEqual(first, make_cache_key('model', 0.3, 'system', '找人一起爬山'))
+        self.assertNotEqual(first, make_cache_key('model', 0.5, 'system', '找人一起组队'))
+
+    def test_lru_eviction_keeps_recently_used_entries(self):
+        cache = LLMResponseCache(max_entries=2, ttl=60)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ('1', '3'))
+        stats = cache.get_stats()
+        self.assertEqual((stats['local_size'], stats['evictions']), (2, 1))
+
+    @override_settings(LLM_CACHE_MAX_TEMPERATURE=0.7, LLM_MODEL='model')
+    def test_high_temperature_bypasses_the_cache(self):
+        from matchmaking.tasks import get_llm_response
+
+        cache = LLMResponseCache(max_entries=4, ttl=60)
+        with mock.patch('ai.cache.get_llm_cache', return_value=cache), \
+                mock.patch('ai.resilience.call_llm', return_value='{}') as call:
+            for temperature in (0.3, 0.3, 0.9, 0.9):
+                get_llm_response('system', 'user', temperature=temperature, stage='tags')
+        # 低温度第二次命中缓存，高温度每次都调用
+        self.assertEqual([c.args[2] for c in call.call_args_list], [0.3, 0.9, 0.9])
+        self.assertEqual(cache.get_stats()['sets'], 1)
+
+
+@override_settings(LLM_PRICE_PROMPT_PER_1K=1.0, LLM_PRICE_COMPLETION_PER_1K=2.0)
+class LLMMetricsTest(SimpleTestCase):
+    def setUp(self):
+        self.metrics, token = begin_task_metrics()
+        self.addCleanup(end_task_metrics, token)
+
+    def test_calls_are_aggregated_per_stage(self):
+        with llm_stage('tags'):
+            record_llm_call('model', wall_ms=100, prompt_tokens=100, completion_tokens=50)
+            record_llm_call('model', wall_ms=300, prompt_tokens=100, completion_tokens=50, attempts=2)
+        with llm_stage('recommend'):
+            record_llm_call('model', wall_ms=0, attempts=0, cached=True)
+            record_llm_call('model', wall_ms=50, error='APITimeoutError')
+
+        summary = self.metrics.summary()
+        self.assertEqual((summary['calls'], summary['cache_hits'], summary['errors'], summary['retries']),
+                         (3, 1, 1, 1))
+        tags = summary['stages']['tags']
+        self.assertEqual((tags['calls'], tags['wall_ms'], tags['prompt_tokens']), (2, 400.0, 200))
+        self.assertAlmostEqual(tags['cost'], 0.4)
+        self.assertEqual(summary['stages']['recommend']['cache_hits'], 1)
+        self.assertEqual(summary['slowest_stage'], 'tags')
+
+    def test_hedged_calls_are_counted_separately(self):
+        with llm_stage('recommend'):
+            record_llm_call('model', wall_ms=200, prompt_tokens=100, completion_tokens=50)
+            with hedged_call():
+                record_llm_call('model', wall_ms=150, prompt_tokens=100, completion_tokens=50)
+
+        recommend = self.metrics.summary()['stages']['recommend']
+        self.assertEqual((recommend['calls'], recommend['hedged_calls'], recommend['wall_ms']), (1, 1, 200.0))
+        # 对冲请求的token和费用照常计入
+        self.assertEqual(recommend['prompt_tokens'], 200)
+        self.assertAlmostEqual(recommend['cost'], 0.4)
+
+    def test_hedge_attempt_is_recorded_as_hedged(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        responses = iter(['slow', 'fast'])
+
+        def call(*args):
+            response = next(responses)
+            if response == 'slow':
+                release.wait(5)
+            record_llm_call('model', wall_ms=10)
+            return response
+
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        resilience._ensure_process()
+        with override_settings(LLM_HEDGE_STAGES=['recommend'], LLM_HEDGE_DELAY=0.05, LLM_RATE_LIMIT_ENABLED=False), \
+                mock.patch('ai.resilience.get_breaker', return_value=breaker), \
+                mock.patch('ai.resilience._call_and_settle', side_effect=call), llm_stage('recommend'):
+            self.assertEqual(resilience.call_llm('system', 'user', 0.3, stage='recommend'), 'fast')
+        self.assertEqual([record['hedged'] for record in self.metrics.calls], [True])
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('ai.resilience.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30, slow_call_threshold=10)
+
+    def _open(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures_and_rejects(self):
+        self.breaker.record_failure()
+        self.breaker.record_success(1)
+        self._open()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+
+    def test_half_open_allows_a_single_probe(self):
+        self._open()
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record_success(1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self._open()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.stats()['opened'], 2)
+
+    def test_slow_calls_count_as_failures_and_release_does_not(self):
+        for _ in range(2):
+            self.breaker.record_success(11)
+        self.breaker.release()
+        self.assertEqual(self.breaker.stats()['consecutive_failures'], 2)
+        self.breaker.record_success(11)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+
+@override_settings(LLM_RATE_LIMIT_ENABLED=False)
+class CallLLMTest(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        patcher = mock.patch('ai.resilience.get_breaker', return_value=self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _blocking_call(self, release, result):
+        def call():
+            release.wait(5)
+            return result
+        return call
+
+    def test_hedge_returns_the_faster_response(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = iter([self._blocking_call(release, 'slow'), lambda: 'fast'])
+        wins = resilience._hedge_stats['hedge_wins']
+        resilience._ensure_process()
+        result = resilience._call_with_deadline(lambda: next(calls)(), deadline=5, hedge_delay=0.05)
+        self.assertEqual(result, 'fast')
+        self.assertEqual(resilience._hedge_stats['hedge_wins'], wins + 1)
+
+    def test_deadline_gives_up_waiting(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        resilience._ensure_process()
+        with self.assertRaises(LLMDeadlineExceeded):
+            resilience._call_with_deadline(self._blocking_call(release, 'late'), deadline=0.05)
+
+    def test_early_failure_is_raised_without_hedging(self):
+        fired = resilience._hedge_stats['hedges_fired']
+        resilience._ensure_process()
+        with self.assertRaises(ValueError):
+            resilience._call_with_deadline(mock.Mock(side_effect=ValueError('bad')), deadline=5, hedge_delay=1)
+        self.assertEqual(resilience._hedge_stats['hedges_fired'], fired)
+
+    def test_provider_failure_opens_the_breaker(self):
+        with mock.patch('ai.resilience._call_and_settle', side_effect=LLMDeadlineExceeded('timeout')) as call:
+            with self.assertRaises(LLMDeadlineExceeded):
+                resilience.call_llm('system', 'user', 0.3, stage='tags')
+            with self.assertRaises(CircuitOpenError):
+                resilience.call_llm('system', 'user', 0.3, stage='tags')
+        self.assertEqual(call.call_count, 1)
+
+    def test_request_errors_do_not_count(self):
+        with mock.patch('ai.resilience._call_and_settle', side_effect=ValueError('bad request')):
+            with self.assertRaises(ValueError):
+                resilience.call_llm('system', 'user', 0.3, stage='tags')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
@@ -1,30 +1,56 @@
 import time
 from django.shortcuts import render
-from openai import OpenAI
-from decouple import config
+from django.conf import settings
+
+from .client import get_llm_client, reset_call_trace, get_call_trace, set_call_usage
+from .metrics import record_llm_call
 
 # Create your views here.
 
 
-def GetLLMOutput(system_content,user_content,temperature=1):
+def GetLLMOutput(system_content,user_content,temperature=1,timeout=None):
     """
     获取LLM输出
     :param system_content: 系统提示词
     :param user_content: 用户输入
     :param temperature: 温度
+    :param timeout: 本次调用的读取超时（秒），默认使用客户端配置
     :return: LLM输出
     """
-    client = OpenAI(
-        base_url="https://api.siliconflow.cn/v1/",
-        api_key=config("AI_TOKEN"),
-    )
-    result = client.chat.completions.create(
-        model="Pro/deepseek-ai/DeepSeek-V3",
-        messages=[
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": user_content},
-        ],
-        temperature=temperature,
+    client = get_llm_client()
+    reset_call_trace()
+    started = time.perf_counter()
+    try:
+        result = client.chat.completions.create(
+            model=settings.LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": user_content},
+            ],
+            temperature=temperature,
+            **({'timeout': timeout} if timeout else {}),
+        )
+    except Exception as e:
+        trace = get_call_trace()
+        record_llm_call(
+            model=settings.LLM_MODEL,
+            wall_ms=(time.perf_counter() - started) * 1000,
+            attempts=trace['attempts'],
+            error=type(e).__name__,
+        )
+        raise
+
+    trace = get_call_trace()
+    usage = result.usage
+    if usage:
+        set_call_usage(usage.total_tokens)
+    record_llm_call(
+        model=result.model or settings.LLM_MODEL,
+        wall_ms=(time.perf_counter() - started) * 1000,
+        ttfb_ms=trace['ttfb'] * 1000 if trace['ttfb'] is not None else None,
+        prompt_tokens=usage.prompt_tokens if usage else 0,
+        completion_tokens=usage.completion_tokens if usage else 0,
+        attempts=trace['attempts'],
     )
     return result.choices[0].message.content
 
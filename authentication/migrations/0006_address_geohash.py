@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-17 16:05
+
+from django.db import migrations, models
+
+from utils.geo import encode_geohash
+
+
+def fill_geohash(apps, schema_editor):
+    Address = apps.get_model('authentication', 'Address')
+    addresses = []
+    for address in Address.objects.filter(latitude__isnull=False, longitude__isnull=False).only(
+        'id', 'latitude', 'longitude'
+    ).iterator(chunk_size=2000):
+        address.geohash = encode_geohash(address.latitude, address.longitude)
+        addresses.append(address)
+        if len(addresses) >= 2000:
+            Address.objects.bulk_update(addresses, ['geohash'])
+            addresses = []
+    if addresses:
+        Address.objects.bulk_update(addresses, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0005_alter_address_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='经纬度的geohash（自动计算，用于附近查询）', max_length=12),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from utils.geo import encode_geohash, haversine_km, nearby
+
 User = get_user_model()
 
 class Address(models.Model):
@@ -13,6 +15,9 @@ class Address(models.Model):
 
     latitude = models.DecimalField(max_digits=10, decimal_places=7, blank=True, null=True, help_text='纬度')
     longitude = models.DecimalField(max_digits=10, decimal_places=7, blank=True, null=True, help_text='经度')
+    # 由经纬度自动计算；db_index 在 PostgreSQL 上同时创建支持前缀查询的 _like 索引
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True, editable=False,
+                               help_text='经纬度的geohash（自动计算，用于附近查询）')
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -44,6 +49,25 @@ class Address(models.Model):
             parts.append(self.district)
         return ' '.join(parts)
     
+    def has_coordinates(self):
+        return self.latitude is not None and self.longitude is not None
+    
+    def compute_geohash(self):
+        return encode_geohash(self.latitude, self.longitude) if self.has_coordinates() else ''
+    
+    def distance_to(self, other_address):
+        """与另一个地址的球面距离（km），任一方没有经纬度时返回 None"""
+        if not self.has_coordinates() or not other_address.has_coordinates():
+            return None
+        return haversine_km(self.latitude, self.longitude, other_address.latitude, other_address.longitude)
+    
+    def save(self, *args, **kwargs):
+        self.geohash = self.compute_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+    
     def is_same_city(self, other_address):
         return (self.province == other_address.province and 
                 self.city == other_address.city)
@@ -81,6 +105,14 @@ class Address(models.Model):
         
         return address, created
     
+    @classmethod
+    def get_nearby(cls, latitude, longitude, radius_km, queryset=None):
+        """
+        半径内的地址，按距离升序
+        :return: [(地址, 距离km)]
+        """
+        return nearby(cls.objects.all() if queryset is None else queryset, latitude, longitude, radius_km)
+    
     @classmethod
     def get_location_statistics(cls, country='中国', province=None, city=None):
         from django.db.models import Count
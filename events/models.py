@@ -38,7 +38,7 @@ class Event(models.Model):
         return self.buddy_requests.all()
     
     def get_open_buddy_requests(self):
-        return self.buddy_requests.filter(status='open')
+        return self.buddy_requests.filter(is_public=True)
     
 
     
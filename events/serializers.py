@@ -142,6 +142,19 @@ class EventListSerializer(serializers.ModelSerializer):
     def get_participant_count(self, obj):
         return obj.get_participant_count()
 
+class NearbyEventSerializer(EventListSerializer):
+    distance_km = serializers.FloatField(read_only=True, help_text='与查询位置的距离（km）')
+    
+    class Meta(EventListSerializer.Meta):
+        fields = EventListSerializer.Meta.fields + ['distance_km']
+
+class NearbyQuerySerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90, help_text='纬度')
+    lng = serializers.FloatField(min_value=-180, max_value=180, help_text='经度')
+    radius = serializers.FloatField(
+        min_value=0.1, max_value=500, default=10, help_text='半径（km），默认10，最大500'
+    )
+
 class EventCreateSerializer(serializers.ModelSerializer):
     location_data = AddressSerializer(required=False, help_text='新建地点信息（可选，如果提供则会创建新地点）')
     
@@ -1,3 +1,41 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from authentication.models import Address
+from utils import geo
+from .models import Event
+
+User = get_user_model()
+
+
+class NearbyEventsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        creator = User.objects.create_user(username='creator', email='creator@example.com', password='x')
+        start = timezone.now() + timedelta(days=1)
+        cls.events = {}
+        # 与查询点(39.9, 116.4)的距离依次增大
+        for name, lat, lng in [('近', 39.91, 116.40), ('中', 39.95, 116.45), ('远', 40.2, 116.8), ('很远', 41.5, 118.0)]:
+            address = Address.objects.create(province='北京市', city='北京市', latitude=lat, longitude=lng)
+            cls.events[name] = Event.objects.create(
+                name=name, start_time=start, end_time=start + timedelta(hours=2), location=address, creator=creator
+            )
+
+    @override_settings(EVENTS_NEARBY_MAX_RESULTS=2)
+    def test_nearby_is_capped_to_the_closest_events(self):
+        response = self.client.get(reverse('events:event-nearby'), {'lat': 39.9, 'lng': 116.4, 'radius': 500})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        results = data['results'] if isinstance(data, dict) else data
+        self.assertEqual([item['name'] for item in results], ['近', '中'])
+
+    def test_limit_across_antimeridian(self):
+        west = Address.objects.create(latitude=0, longitude=-179.9)
+        east = Address.objects.create(latitude=0, longitude=179.5)
+        Address.objects.create(latitude=0, longitude=178.0)
+        results = geo.nearby(Address.objects.all(), 0, 179.95, 500, limit=2)
+        self.assertEqual([address for address, _ in results], [west, east])
@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnl
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, OpenApiResponse
 from drf_spectacular.types import OpenApiTypes
+from django.conf import settings
 from django.db.models import Q
 from datetime import datetime
 
@@ -13,10 +14,13 @@ from .serializers import (
     EventSerializer, 
     EventListSerializer, 
     EventCreateSerializer,
-    BuddyRequestSimpleSerializer
+    BuddyRequestSimpleSerializer,
+    NearbyEventSerializer,
+    NearbyQuerySerializer
 )
 from matchmaking.models import BuddyRequest
 from .filters import EventFilter
+from utils import geo
 
 
 @extend_schema_view(
@@ -184,6 +188,8 @@ class EventViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == 'list':
             return EventListSerializer
+        elif self.action == 'nearby':
+            return NearbyEventSerializer
         elif self.action in ['create', 'update', 'partial_update']:
             return EventCreateSerializer
         return EventSerializer
@@ -239,3 +245,82 @@ class EventViewSet(viewsets.ModelViewSet):
         
         serializer = BuddyRequestSimpleSerializer(buddy_requests, many=True)
         return Response(serializer.data)
+    
+    @extend_schema(
+        summary="一键匹配活动下的所有搭子请求",
+        description="""对活动下所有公开的搭子请求做全局匹配，异步执行。
+        
+        **功能说明：**
+        - 计算所有请求两两之间的匹配得分，做带名额限制的全局分配
+        - 已有的匹配记录会保留并占用名额
+        - 返回异步任务ID
+        
+        **权限要求：** 仅活动创建者可操作
+        """,
+        request=None,
+        responses={
+            202: OpenApiResponse(description="匹配任务已提交"),
+            403: OpenApiResponse(description="无权限操作"),
+            404: OpenApiResponse(description="活动不存在")
+        },
+        tags=['活动管理']
+    )
+    @action(detail=True, methods=['post'], url_path='match-all', permission_classes=[IsAuthenticated])
+    def match_all(self, request, pk=None):
+        from matchmaking.tasks import process_buddy_matching
+        
+        event = self.get_object()
+        if event.creator != request.user:
+            self.permission_denied(request, message="只有活动创建者可以发起全局匹配")
+        
+        task = process_buddy_matching.delay(event.id)
+        return Response({'task_id': task.id, 'message': '全局匹配任务已提交'}, status=status.HTTP_202_ACCEPTED)
+    
+    @extend_schema(
+        summary="获取附近的活动",
+        description="""获取查询位置半径内的线下活动，按距离升序排列。
+        
+        **功能说明：**
+        - 先按活动地点的geohash单元格和经纬度范围走索引筛选，再按球面距离精确过滤
+        - 最多返回距离最近的 EVENTS_NEARBY_MAX_RESULTS 个活动（数据库中按近似距离截取）
+        - 只包含地点设置了经纬度的活动
+        - 支持与活动列表相同的过滤参数（如 date_from、date_to）
+        
+        **权限要求：** 无需登录
+        """,
+        parameters=[
+            OpenApiParameter(name='lat', type=OpenApiTypes.FLOAT, location=OpenApiParameter.QUERY,
+                             required=True, description='纬度'),
+            OpenApiParameter(name='lng', type=OpenApiTypes.FLOAT, location=OpenApiParameter.QUERY,
+                             required=True, description='经度'),
+            OpenApiParameter(name='radius', type=OpenApiTypes.FLOAT, location=OpenApiParameter.QUERY,
+                             description='半径（km），默认10，最大500'),
+        ],
+        responses={
+            200: OpenApiResponse(
+                response=NearbyEventSerializer(many=True),
+                description="成功返回附近的活动列表"
+            ),
+            400: OpenApiResponse(description="参数错误")
+        },
+        tags=['活动管理']
+    )
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def nearby(self, request):
+        params = NearbyQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        lat, lng, radius = params.validated_data['lat'], params.validated_data['lng'], params.validated_data['radius']
+        
+        queryset = self.filter_queryset(self.get_queryset()).filter(is_online=False).order_by()
+        events = []
+        for event, distance in geo.nearby(queryset, lat, lng, radius, prefix='location__',
+                                      limit=settings.EVENTS_NEARBY_MAX_RESULTS):
+            event.distance_km = round(distance, 3)
+            events.append(event)
+        
+        page = self.paginate_queryset(events)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(events, many=True)
+        return Response(serializer.data)
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 from django.conf import settings
 
 # 设置Django设置模块
@@ -17,4 +18,11 @@ app.autodiscover_tasks()
 # 可选：添加调试任务
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
+
+
+@worker_process_init.connect
+def warm_up_llm_client(**kwargs):
+    """worker子进程启动时预热LLM客户端连接池"""
+    from ai.client import warm_up
+    warm_up()
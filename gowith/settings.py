@@ -1,4 +1,4 @@
-from decouple import config
+from decouple import config, Csv
 
 """
 Django settings for gowith project.
@@ -289,3 +289,142 @@ SERVER_EMAIL = config('SERVER_EMAIL', default='root@localhost')
 
 # 邮件超时设置
 EMAIL_TIMEOUT = 30
+
+# LLM服务配置（OpenAI兼容接口，压测时可指向本地 llm_stub_server）
+LLM_BASE_URL = config('LLM_BASE_URL', default='https://api.siliconflow.cn/v1/')
+LLM_MODEL = config('LLM_MODEL', default='Pro/deepseek-ai/DeepSeek-V3')
+LLM_API_KEY = config('AI_TOKEN', default='')
+
+# LLM调用费用估算：每千token单价（元），用于匹配任务的LLM调用指标
+LLM_PRICE_PROMPT_PER_1K = config('LLM_PRICE_PROMPT_PER_1K', default=0.002, cast=float)
+LLM_PRICE_COMPLETION_PER_1K = config('LLM_PRICE_COMPLETION_PER_1K', default=0.008, cast=float)
+
+# LLM客户端配置（每个worker进程复用长连接）
+LLM_CONNECT_TIMEOUT = config('LLM_CONNECT_TIMEOUT', default=5.0, cast=float)
+LLM_READ_TIMEOUT = config('LLM_READ_TIMEOUT', default=120.0, cast=float)
+LLM_MAX_CONNECTIONS = config('LLM_MAX_CONNECTIONS', default=10, cast=int)
+LLM_MAX_KEEPALIVE_CONNECTIONS = config('LLM_MAX_KEEPALIVE_CONNECTIONS', default=5, cast=int)
+LLM_KEEPALIVE_EXPIRY = config('LLM_KEEPALIVE_EXPIRY', default=60.0, cast=float)
+# worker进程启动时是否预先建立一条连接
+LLM_WARMUP_CONNECT = config('LLM_WARMUP_CONNECT', default=True, cast=bool)
+
+# LLM熔断：连续失败（超时、连接错误、429、5xx或慢调用）达到阈值后熔断，冷却后放行探测请求
+LLM_BREAKER_FAILURE_THRESHOLD = config('LLM_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+LLM_BREAKER_RECOVERY_TIMEOUT = config('LLM_BREAKER_RECOVERY_TIMEOUT', default=30.0, cast=float)
+LLM_BREAKER_SLOW_CALL_SECONDS = config('LLM_BREAKER_SLOW_CALL_SECONDS', default=60.0, cast=float)
+# 各匹配阶段LLM调用的超时时间（秒），格式 阶段=秒数，逗号分隔
+LLM_STAGE_TIMEOUTS = {
+    stage.strip(): float(seconds)
+    for stage, seconds in (
+        item.split('=', 1) for item in config(
+            'LLM_STAGE_TIMEOUTS',
+            default='integrate=30,integrate_and_tag=40,profile_summary=30,profile_summary_and_tag=40,tags=20,recommend=45,batch_recommend=90',
+            cast=Csv(),
+        )
+    )
+}
+# 对冲请求：以下阶段的请求在 LLM_HEDGE_DELAY 秒内未返回时再发一个相同请求
+LLM_HEDGE_STAGES = config('LLM_HEDGE_STAGES', default='recommend', cast=Csv())
+LLM_HEDGE_DELAY = config('LLM_HEDGE_DELAY', default=12.0, cast=float)
+
+# LLM限流：所有worker共享的令牌桶（redis），Redis不可用时退回进程内令牌桶（local）
+LLM_RATE_LIMIT_ENABLED = config('LLM_RATE_LIMIT_ENABLED', default=True, cast=bool)
+LLM_RATE_LIMIT_BACKEND = config('LLM_RATE_LIMIT_BACKEND', default='redis')
+LLM_RATE_LIMIT_RPS = config('LLM_RATE_LIMIT_RPS', default=5.0, cast=float)
+LLM_RATE_LIMIT_BURST = config('LLM_RATE_LIMIT_BURST', default=10, cast=int)
+LLM_RATE_LIMIT_TPM = config('LLM_RATE_LIMIT_TPM', default=100000, cast=int)
+# 每次调用预扣的输出token数，调用结束后按实际用量补差
+LLM_RATE_LIMIT_COMPLETION_TOKENS = config('LLM_RATE_LIMIT_COMPLETION_TOKENS', default=600, cast=int)
+# 等待令牌的最长时间（秒），超过后匹配任务重新入队
+LLM_RATE_LIMIT_MAX_WAIT = config('LLM_RATE_LIMIT_MAX_WAIT', default=10.0, cast=float)
+LLM_RATE_LIMIT_REQUEUE_DELAY = config('LLM_RATE_LIMIT_REQUEUE_DELAY', default=5, cast=int)
+LLM_RATE_LIMIT_MAX_REQUEUES = config('LLM_RATE_LIMIT_MAX_REQUEUES', default=10, cast=int)
+# 限流Redis调用的读超时（秒），以及Redis失败后改用进程内令牌桶的时长（秒）
+LLM_RATE_LIMIT_REDIS_TIMEOUT = config('LLM_RATE_LIMIT_REDIS_TIMEOUT', default=0.2, cast=float)
+LLM_RATE_LIMIT_REDIS_BACKOFF = config('LLM_RATE_LIMIT_REDIS_BACKOFF', default=30.0, cast=float)
+
+# LLM响应缓存配置
+LLM_CACHE_ENABLED = config('LLM_CACHE_ENABLED', default=True, cast=bool)
+LLM_CACHE_MAX_ENTRIES = config('LLM_CACHE_MAX_ENTRIES', default=512, cast=int)
+LLM_CACHE_TTL = config('LLM_CACHE_TTL', default=6 * 3600, cast=int)
+# 留空则只使用进程内缓存，配置后多个worker共享缓存
+LLM_CACHE_REDIS_URL = config('LLM_CACHE_REDIS_URL', default='')
+# 高于该温度的调用结果随机性较大，不做缓存
+LLM_CACHE_MAX_TEMPERATURE = config('LLM_CACHE_MAX_TEMPERATURE', default=0.7, cast=float)
+
+# 匹配流程配置
+# 开启后信息整合与标签生成合并为一次LLM调用，关闭则按两次调用串行执行
+MATCHING_FUSED_INTEGRATE_TAGS = config('MATCHING_FUSED_INTEGRATE_TAGS', default=True, cast=bool)
+# 开启后档案摘要按档案版本缓存，请求时只合并活动和请求信息；摘要命中缓存时单独生成标签，
+# 未命中且开启上一项时摘要和标签由一次LLM调用生成
+MATCHING_PROFILE_SUMMARY_ENABLED = config('MATCHING_PROFILE_SUMMARY_ENABLED', default=True, cast=bool)
+
+# 共享Redis（匹配批处理、分布式锁等），默认与Celery broker相同
+REDIS_URL = config('REDIS_URL', default=CELERY_BROKER_URL)
+REDIS_CONNECT_TIMEOUT = config('REDIS_CONNECT_TIMEOUT', default=2.0, cast=float)
+
+# 匹配批处理：同一活动在时间窗口内的多个请求合并为一次LLM推荐
+MATCHING_BATCH_ENABLED = config('MATCHING_BATCH_ENABLED', default=False, cast=bool)
+MATCHING_BATCH_WINDOW_MS = config('MATCHING_BATCH_WINDOW_MS', default=1500, cast=int)
+MATCHING_BATCH_MAX_SIZE = config('MATCHING_BATCH_MAX_SIZE', default=10, cast=int)
+# 等待批处理结果的最长时间，超时后退回单独推荐
+MATCHING_BATCH_RESULT_TIMEOUT = config('MATCHING_BATCH_RESULT_TIMEOUT', default=180, cast=int)
+# leader 租约时长（秒），leader 处理期间自动续期；崩溃后等待中的任务在租约过期时接管
+MATCHING_BATCH_LEADER_LEASE = config('MATCHING_BATCH_LEADER_LEASE', default=15, cast=int)
+# leader 最多连续处理的批数，之后交给队首的请求接任
+MATCHING_BATCH_LEADER_MAX_BATCHES = config('MATCHING_BATCH_LEADER_MAX_BATCHES', default=3, cast=int)
+
+# 匹配推荐提示词：候选人召回上限与token预算
+MATCHING_MAX_CANDIDATES = config('MATCHING_MAX_CANDIDATES', default=20, cast=int)
+MATCHING_PROMPT_TOKEN_BUDGET = config('MATCHING_PROMPT_TOKEN_BUDGET', default=6000, cast=int)
+
+# 候选人预排序：从标签倒排索引召回 MATCHING_PRERANK_POOL 个候选人，向量化打分后
+# 取前 MATCHING_MAX_CANDIDATES 个交给LLM；关闭LLM推荐时直接使用预排序结果
+MATCHING_PRERANK_POOL = config('MATCHING_PRERANK_POOL', default=500, cast=int)
+MATCHING_LLM_RECOMMEND_ENABLED = config('MATCHING_LLM_RECOMMEND_ENABLED', default=True, cast=bool)
+# 预排序信号权重，格式 信号=权重，逗号分隔（tags/text/mbti/distance/rating）
+MATCHING_PRERANK_WEIGHTS = {
+    signal.strip(): float(weight)
+    for signal, weight in (
+        item.split('=', 1) for item in config(
+            'MATCHING_PRERANK_WEIGHTS',
+            default='tags=0.4,text=0.15,mbti=0.15,distance=0.15,rating=0.15',
+            cast=Csv(),
+        )
+    )
+}
+# 距离得分 exp(-距离/该值)，即相距该距离（公里）时得分约为 0.37
+MATCHING_DISTANCE_SCALE_KM = config('MATCHING_DISTANCE_SCALE_KM', default=20.0, cast=float)
+
+# 活动级全局匹配：每个请求最多的匹配数、每个请求保留的候选边数、边的最低得分
+MATCHING_GLOBAL_CAPACITY = config('MATCHING_GLOBAL_CAPACITY', default=3, cast=int)
+MATCHING_GLOBAL_TOP_K = config('MATCHING_GLOBAL_TOP_K', default=20, cast=int)
+MATCHING_GLOBAL_MIN_SCORE = config('MATCHING_GLOBAL_MIN_SCORE', default=0.3, cast=float)
+
+# 配对得分表：请求内容变化时与活动内其余请求打分一次并持久化，匹配时按得分读取 top-k
+# 作为标签和文本召回之外的补充召回来源；请求内容变化时需要扫描整个活动，默认关闭
+MATCHING_PAIR_SCORES_ENABLED = config('MATCHING_PAIR_SCORES_ENABLED', default=False, cast=bool)
+# 每个请求保存的配对数和配对的最低得分
+MATCHING_PAIR_TOP_K = config('MATCHING_PAIR_TOP_K', default=100, cast=int)
+MATCHING_PAIR_MIN_SCORE = config('MATCHING_PAIR_MIN_SCORE', default=0.2, cast=float)
+
+# 扫描整个活动（配对打分、倒排索引重建）时每块读取的请求数，PostgreSQL 上通过服务端游标流式读取
+MATCHING_STREAM_CHUNK_SIZE = config('MATCHING_STREAM_CHUNK_SIZE', default=2000, cast=int)
+
+# 匹配任务调度：触发后延迟执行的防抖窗口（秒），窗口内的重复触发只保留最新的任务
+MATCHING_DISPATCH_DEBOUNCE_SECONDS = config('MATCHING_DISPATCH_DEBOUNCE_SECONDS', default=5, cast=int)
+# 同一请求的匹配任务运行锁的过期时间（秒），应大于一次完整匹配的耗时
+MATCHING_DISPATCH_LOCK_TIMEOUT = config('MATCHING_DISPATCH_LOCK_TIMEOUT', default=600, cast=int)
+
+# 文本向量索引：按描述、档案简介和标签的字符n-gram TF-IDF相似度补充召回没有共同标签的候选人
+MATCHING_TEXT_INDEX_ENABLED = config('MATCHING_TEXT_INDEX_ENABLED', default=True, cast=bool)
+MATCHING_TEXT_RETRIEVAL_K = config('MATCHING_TEXT_RETRIEVAL_K', default=50, cast=int)
+# 检索时只使用查询向量中权重最高的维度数，相似度低于阈值的结果丢弃
+MATCHING_TEXT_QUERY_TERMS = config('MATCHING_TEXT_QUERY_TERMS', default=64, cast=int)
+MATCHING_TEXT_MIN_SCORE = config('MATCHING_TEXT_MIN_SCORE', default=0.05, cast=float)
+# 每篇文档写入倒排表的维度数，检索时每个维度读取的文档数（决定单次检索的读取量，与活动规模无关）
+MATCHING_TEXT_DOC_TERMS = config('MATCHING_TEXT_DOC_TERMS', default=64, cast=int)
+MATCHING_TEXT_POSTINGS_LIMIT = config('MATCHING_TEXT_POSTINGS_LIMIT', default=500, cast=int)
+
+# 附近活动查询最多返回的活动数，在数据库中按近似距离截取后再精确计算距离
+EVENTS_NEARBY_MAX_RESULTS = config('EVENTS_NEARBY_MAX_RESULTS', default=200, cast=int)
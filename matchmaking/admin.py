@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BuddyRequest, BuddyRequestTag, BuddyMatch, UserFeedback
+from .models import BuddyRequest, BuddyRequestTag, BuddyMatch, UserFeedback, UserReputation, MatchExclusion, Tag, TagAlias
 
 @admin.register(BuddyRequest)
 class BuddyRequestAdmin(admin.ModelAdmin):
@@ -26,9 +26,20 @@ class BuddyRequestAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'profile', 'event')
 
+class TagAliasInline(admin.TabularInline):
+    model = TagAlias
+    extra = 1
+
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'id', 'created_at')
+    search_fields = ('name', 'aliases__alias')
+    ordering = ('name',)
+    inlines = [TagAliasInline]
+
 @admin.register(BuddyRequestTag)
 class BuddyRequestTagAdmin(admin.ModelAdmin):
-    list_display = ('tag_name', 'request', 'request_user', 'request_event')
+    list_display = ('tag_name', 'tag', 'request', 'request_user', 'request_event')
     list_filter = ('tag_name', 'request__event__name')
     search_fields = ('tag_name', 'request__description', 'request__user__username')
     ordering = ('tag_name',)
@@ -42,7 +53,7 @@ class BuddyRequestTagAdmin(admin.ModelAdmin):
     request_event.short_description = '活动名称'
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('request__user', 'request__event')
+        return super().get_queryset(request).select_related('tag', 'request__user', 'request__event')
 
 @admin.register(BuddyMatch)
 class BuddyMatchAdmin(admin.ModelAdmin):
@@ -90,3 +101,21 @@ class UserFeedbackAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('from_user', 'to_user')
+
+@admin.register(UserReputation)
+class UserReputationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'average_rating', 'rating_count', 'updated_at')
+    search_fields = ('user__username',)
+    readonly_fields = (
+        'user', 'rating_sum', 'rating_count',
+        'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5', 'updated_at',
+    )
+    ordering = ('-rating_count',)
+
+@admin.register(MatchExclusion)
+class MatchExclusionAdmin(admin.ModelAdmin):
+    list_display = ('user_a', 'user_b', 'reason', 'created_at')
+    list_filter = ('reason',)
+    search_fields = ('user_a__username', 'user_b__username')
+    readonly_fields = ('created_at',)
+    ordering = ('-created_at',)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MatchmakingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'matchmaking'
+
+    def ready(self):
+        # 注册标签缓存失效、倒排索引增量更新、文本索引失效、配对得分、用户信誉和匹配排除更新的信号处理
+        from . import tagging, tag_index, text_index, pair_table, reputation, exclusions  # noqa: F401
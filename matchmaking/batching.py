@@ -0,0 +1,327 @@
+"""
+搭子匹配微批处理
+
+报名高峰期同一活动会在几秒内产生大量匹配任务，每个任务各自调用一次LLM
+对高度重叠的候选人排序。这里按活动收集时间窗口内的待推荐请求，
+由第一个到达的任务作为 leader 等待窗口结束（或凑满批次），
+用一次LLM调用为整批请求排序，再把结果拆分给各自的任务写入 BuddyMatch。
+
+Redis 键：
+- match:batch:{event_id}:queue   待处理请求（list）
+- match:batch:{event_id}:leader  leader 租约，leader 处理期间定期续期；
+  leader 崩溃后租约很快过期，等待中的任务接管队列，而不是一直等到结果超时
+- match:batch:result:{request_id} 单个请求的推荐结果（list，用于 BLPOP 等待）
+
+leader 最多连续处理 MATCHING_BATCH_LEADER_MAX_BATCHES 批，之后释放租约并通知队首的请求接任，
+持续有请求到达时不会一直占用同一个 worker，leader 自己的结果也能及时返回。
+"""
+import json
+import time
+import uuid
+import logging
+import threading
+
+from django.conf import settings
+
+from utils.redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 0.05
+# 写入队首请求结果列表的接任通知，收到后尝试成为 leader
+_HANDOFF = '"__lead__"'
+
+# 仅当租约仍属于自己时续期/释放，避免误操作接管者的租约
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _queue_key(event_id):
+    return f'match:batch:{event_id}:queue'
+
+
+def _leader_key(event_id):
+    return f'match:batch:{event_id}:leader'
+
+
+def _result_key(request_id):
+    return f'match:batch:result:{request_id}'
+
+
+def recommend_with_batching(buddy_request, integrated_info, tags):
+    """
+    通过批处理获取推荐结果
+    Redis 不可用、批处理失败或等待超时时退回单独推荐，LLM熔断期间直接单独处理
+    :return: (推荐列表, 候选用户ID集合)，与 _find_and_recommend_matches 相同
+    """
+    from ai.resilience import llm_available
+    from .tasks import _find_and_recommend_matches
+
+    if not settings.MATCHING_LLM_RECOMMEND_ENABLED or not llm_available():
+        # 不使用LLM推荐或熔断期间不再排队等待，直接走预排序推荐
+        return _find_and_recommend_matches(buddy_request, integrated_info, tags)
+
+    try:
+        recommendations = _submit_and_wait(buddy_request, integrated_info, tags)
+    except Exception as e:
+        logger.warning(f"请求 {buddy_request.id} 批处理推荐失败，退回单独推荐: {e}")
+        recommendations = None
+
+    if recommendations is None:
+        return _find_and_recommend_matches(buddy_request, integrated_info, tags)
+    return recommendations['recommendations'], frozenset(recommendations['allowed'])
+
+
+def _submit_and_wait(buddy_request, integrated_info, tags):
+    r = get_redis()
+    event_id = buddy_request.event_id
+    window = settings.MATCHING_BATCH_WINDOW_MS / 1000
+    result_timeout = settings.MATCHING_BATCH_RESULT_TIMEOUT
+    expire = int(window) + result_timeout + 60
+
+    entry = json.dumps({
+        'request_id': buddy_request.id,
+        'integrated_info': integrated_info,
+        'tags': list(tags),
+    }, ensure_ascii=False)
+
+    queue_key = _queue_key(event_id)
+    pipe = r.pipeline()
+    pipe.rpush(queue_key, entry)
+    pipe.expire(queue_key, expire)
+    pipe.execute()
+
+    leader_key = _leader_key(event_id)
+    result_key = _result_key(buddy_request.id)
+    lease = settings.MATCHING_BATCH_LEADER_LEASE
+    token = f'{buddy_request.id}:{uuid.uuid4().hex}'
+
+    if r.set(leader_key, token, nx=True, ex=lease):
+        _lead_batches(r, event_id, window, token)
+
+    deadline = time.monotonic() + result_timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"请求 {buddy_request.id} 等待批处理结果超时")
+            return None
+        payload = r.blpop(result_key, timeout=max(1, int(min(lease, remaining))))
+        handoff = payload is not None and _decode(payload[1]) == _HANDOFF
+        if payload is not None and not handoff:
+            return json.loads(payload[1])
+        if not r.set(leader_key, token, nx=True, ex=lease):
+            continue
+        if handoff:
+            logger.info(f"活动 {event_id} 的批处理由请求 {buddy_request.id} 接任 leader")
+        else:
+            # leader 租约已过期（leader 崩溃），接管并处理队列中剩余的请求
+            logger.warning(f"活动 {event_id} 的批处理 leader 租约过期，由请求 {buddy_request.id} 接管")
+        _lead_batches(r, event_id, 0, token)
+        payload = r.lpop(result_key)
+        if payload is None:
+            # 本请求已被崩溃的 leader 取出，结果不会再写入
+            return None
+        return json.loads(payload)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _drain(r, queue_key, size):
+    pipe = r.pipeline()
+    pipe.lrange(queue_key, 0, size - 1)
+    pipe.ltrim(queue_key, size, -1)
+    entries, _ = pipe.execute()
+    return [json.loads(entry) for entry in entries]
+
+
+def _heartbeat(r, leader_key, token, stop):
+    """leader 处理期间定期续期租约，进程崩溃后续期随之停止"""
+    lease = settings.MATCHING_BATCH_LEADER_LEASE
+    interval = max(lease / 3, _POLL_INTERVAL)
+    while not stop.wait(interval):
+        try:
+            if not r.eval(_RENEW_SCRIPT, 1, leader_key, token, lease):
+                return
+        except Exception as e:
+            logger.warning(f"续期批处理 leader 租约失败: {e}")
+
+
+def _lead_batches(r, event_id, window, token):
+    """leader：等待窗口结束或凑满批次，然后分批处理队列中的全部请求"""
+    leader_key = _leader_key(event_id)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(r, leader_key, token, stop), daemon=True)
+    heartbeat.start()
+    try:
+        _drain_batches(r, event_id, window, token)
+    finally:
+        stop.set()
+        heartbeat.join()
+        r.eval(_RELEASE_SCRIPT, 1, leader_key, token)
+
+
+def _drain_batches(r, event_id, window, token):
+    queue_key = _queue_key(event_id)
+    leader_key = _leader_key(event_id)
+    max_size = settings.MATCHING_BATCH_MAX_SIZE
+
+    deadline = time.monotonic() + window
+    while time.monotonic() < deadline and r.llen(queue_key) < max_size:
+        time.sleep(_POLL_INTERVAL)
+
+    batches = 0
+    while True:
+        if batches >= settings.MATCHING_BATCH_LEADER_MAX_BATCHES:
+            _hand_off(r, event_id, token)
+            break
+        batches += 1
+        entries = _drain(r, queue_key, max_size)
+        if not entries:
+            # 先释放租约再检查一次队列，避免释放前入队的请求无人处理
+            r.eval(_RELEASE_SCRIPT, 1, leader_key, token)
+            if r.llen(queue_key) and r.set(leader_key, token, nx=True, ex=settings.MATCHING_BATCH_LEADER_LEASE):
+                continue
+            break
+        _process_batch(r, event_id, entries)
+
+
+def _hand_off(r, event_id, token):
+    """释放租约，通知队首的请求接任 leader；队列为空时只释放租约"""
+    r.eval(_RELEASE_SCRIPT, 1, _leader_key(event_id), token)
+    first = r.lindex(_queue_key(event_id), 0)
+    if first is None:
+        return
+    result_key = _result_key(json.loads(first)['request_id'])
+    pipe = r.pipeline()
+    pipe.rpush(result_key, _HANDOFF)
+    pipe.expire(result_key, settings.MATCHING_BATCH_RESULT_TIMEOUT)
+    pipe.execute()
+
+
+def _process_batch(r, event_id, entries):
+    try:
+        results = run_batch(entries)
+    except Exception as e:
+        logger.error(f"活动 {event_id} 批处理推荐失败: {e}")
+        results = {}
+
+    pipe = r.pipeline()
+    for entry in entries:
+        request_id = entry['request_id']
+        # 没有结果的请求写入 null，对应任务会立即退回单独推荐
+        pipe.rpush(_result_key(request_id), json.dumps(results.get(request_id), ensure_ascii=False))
+        pipe.expire(_result_key(request_id), settings.MATCHING_BATCH_RESULT_TIMEOUT)
+    pipe.execute()
+
+
+def run_batch(entries):
+    """
+    为一批请求生成推荐
+    :param entries: [{'request_id', 'integrated_info', 'tags'}]
+    :return: {request_id: {'recommendations': [...], 'allowed': [候选用户ID]}}
+    """
+    from .models import BuddyRequest
+    from .tasks import _find_candidate_requests, _llm_recommend_matches
+
+    requests = BuddyRequest.objects.select_related('user', 'event').in_bulk(
+        [entry['request_id'] for entry in entries]
+    )
+
+    results = {}
+    groups = []
+    for entry in entries:
+        buddy_request = requests.get(entry['request_id'])
+        if buddy_request is None:
+            results[entry['request_id']] = {'recommendations': [], 'allowed': []}
+            continue
+        candidates = _find_candidate_requests(buddy_request, entry['tags'])
+        if not candidates:
+            results[buddy_request.id] = {'recommendations': [], 'allowed': []}
+            continue
+        groups.append((buddy_request, entry['integrated_info'], candidates))
+
+    if len(groups) == 1:
+        buddy_request, integrated_info, candidates = groups[0]
+        recommendations = {buddy_request.id: _llm_recommend_matches(buddy_request, integrated_info, candidates)}
+    elif groups:
+        recommendations = _llm_recommend_batch(groups)
+    for buddy_request, _, candidates in groups:
+        results[buddy_request.id] = {
+            'recommendations': recommendations[buddy_request.id],
+            'allowed': sorted({req.user_id for req in candidates}),
+        }
+
+    logger.info(f"批处理 {len(entries)} 个请求，LLM推荐调用 {1 if groups else 0} 次")
+    return results
+
+
+def _llm_recommend_batch(groups):
+    """用一次LLM调用为多个发起者推荐搭子，候选人去重后只出现一次"""
+    from .tasks import (
+        get_llm_response, _extract_json_from_response,
+        _build_candidate_info, _fallback_recommendations,
+    )
+    from .prompts import build_batch_recommend_prompt
+
+    candidates_info = {}
+    requesters = []
+    allowed = {}
+    for buddy_request, integrated_info, candidates in groups:
+        for req in candidates:
+            if req.user_id not in candidates_info:
+                candidates_info[req.user_id] = _build_candidate_info(req)
+        allowed[buddy_request.id] = {req.user_id for req in candidates}
+        requesters.append({
+            "request_id": buddy_request.id,
+            "info": integrated_info,
+            "candidate_user_ids": sorted(allowed[buddy_request.id]),
+        })
+
+    system_prompt, user_content, included = build_batch_recommend_prompt(
+        requesters, list(candidates_info.values())
+    )
+    for request_id in allowed:
+        allowed[request_id] &= included
+
+    response = get_llm_response(system_prompt, user_content, temperature=0.3, stage='batch_recommend')
+    logger.info(f"批量推荐LLM响应: {response}")
+
+    try:
+        data = _extract_json_from_response(response, expected_type=dict)
+        if not isinstance(data, dict):
+            raise ValueError("批量推荐结果不是JSON对象")
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.warning(f"批量推荐解析失败: {e}")
+        data = {}
+
+    results = {}
+    for buddy_request, _, candidates in groups:
+        recommendations = data.get(str(buddy_request.id))
+        if not isinstance(recommendations, list):
+            results[buddy_request.id] = _fallback_recommendations(candidates)
+            continue
+        # 丢弃不在该发起者候选范围内的推荐
+        valid = []
+        for rec in recommendations:
+            if not isinstance(rec, dict):
+                continue
+            try:
+                user_id = int(rec.get('user_id'))
+            except (TypeError, ValueError):
+                continue
+            if user_id in allowed[buddy_request.id]:
+                valid.append(dict(rec, user_id=user_id))
+        results[buddy_request.id] = valid[:5]
+    return results
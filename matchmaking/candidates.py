@@ -0,0 +1,170 @@
+"""
+候选人数据加载
+
+推荐阶段需要每个候选人的请求描述、标签、主档案和地址。逐个访问模型关联
+（req.user、req.event、req.tags、主档案、档案地址）会让查询数随候选人数线性增长，
+这里用固定的三次查询一次性加载所有候选人，结果为只读的紧凑记录。
+
+需要扫描整个活动时（配对得分、倒排索引重建）用 iter_event_request_chunks /
+iter_candidate_chunks 分块读取：请求ID通过服务端游标流式读取，每块再批量加载，
+内存占用只与块大小有关，与活动的请求数无关。
+"""
+from collections import defaultdict
+
+from django.conf import settings
+
+
+class CandidateRecord:
+    """推荐阶段使用的候选人信息"""
+
+    __slots__ = (
+        'request_id', 'user_id', 'username', 'event_name', 'event_start', 'event_end', 'description',
+        'tags', 'profile_name', 'mbti', 'bio', 'location', 'latitude', 'longitude',
+        'similarity', 'score',
+    )
+
+    def __init__(self, request_id, user_id, username, event_name, event_start, event_end, description,
+                 tags=(), profile_name=None, mbti=None, bio=None, location=None,
+                 latitude=None, longitude=None):
+        self.request_id = request_id
+        self.user_id = user_id
+        self.username = username
+        self.event_name = event_name
+        self.event_start = event_start
+        self.event_end = event_end
+        self.description = description
+        # ((tag_id, tag_name), ...)，按保存顺序
+        self.tags = tags
+        self.profile_name = profile_name
+        self.mbti = mbti
+        self.bio = bio
+        self.location = location
+        self.latitude = latitude
+        self.longitude = longitude
+        # 文本索引检索得到的相似度，未被文本检索召回时为 0
+        self.similarity = 0.0
+        # 预排序得分（0-1），未经过预排序时为 None
+        self.score = None
+
+    def __repr__(self):
+        return f"<CandidateRecord request={self.request_id} user={self.user_id}>"
+
+    @property
+    def has_profile(self):
+        return self.profile_name is not None
+
+    @property
+    def tag_names(self):
+        return [tag_name for _, tag_name in self.tags]
+
+    @property
+    def tag_ids(self):
+        return {tag_id for tag_id, _ in self.tags if tag_id is not None}
+
+
+def _location_display(country, province, city, district):
+    # 与 Address.get_location_display 保持一致
+    if province is None:
+        return '未设置地址'
+    parts = [country, province, city]
+    if district:
+        parts.append(district)
+    return ' '.join(parts)
+
+
+def iter_event_request_chunks(event_id, exclude_request_id=None, exclude_user_id=None, chunk_size=None):
+    """
+    分块流式读取活动下的公开请求（PostgreSQL 上使用服务端游标）
+    :param chunk_size: 每块的请求数，默认 MATCHING_STREAM_CHUNK_SIZE
+    :return: 生成器，每次产出 [(request_id, user_id)]，按请求ID升序
+    """
+    from .models import BuddyRequest
+
+    chunk_size = chunk_size or settings.MATCHING_STREAM_CHUNK_SIZE
+    requests = BuddyRequest.objects.filter(event_id=event_id, is_public=True)
+    if exclude_request_id is not None:
+        requests = requests.exclude(id=exclude_request_id)
+    if exclude_user_id is not None:
+        requests = requests.exclude(user_id=exclude_user_id)
+
+    chunk = []
+    for row in requests.order_by('id').values_list('id', 'user_id').iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_candidate_chunks(event_id, exclude_request_id=None, exclude_user_id=None, chunk_size=None):
+    """
+    分块流式加载活动下的公开请求，每块三次查询
+    :return: 生成器，每次产出 [CandidateRecord]
+    """
+    for chunk in iter_event_request_chunks(event_id, exclude_request_id, exclude_user_id, chunk_size):
+        candidates = load_candidates([request_id for request_id, _ in chunk], event_id=event_id)
+        if candidates:
+            yield candidates
+
+
+def load_candidates(request_ids, event_id=None):
+    """
+    批量加载候选请求，查询数与候选人数无关（请求、标签、主档案各一次）
+    :param request_ids: 按优先级排序的候选请求ID
+    :param event_id: 指定时只返回该活动下的请求
+    :return: [CandidateRecord]，保持 request_ids 的顺序，只包含仍然公开的请求
+    """
+    from profiles.models import UserProfile
+    from .models import BuddyRequest, BuddyRequestTag
+
+    request_ids = list(request_ids)
+    if not request_ids:
+        return []
+
+    requests = BuddyRequest.objects.filter(id__in=request_ids, is_public=True)
+    if event_id is not None:
+        requests = requests.filter(event_id=event_id)
+    rows = {
+        row[0]: row
+        for row in requests.values_list(
+            'id', 'user_id', 'user__username', 'event__name', 'event__start_time', 'event__end_time', 'description'
+        )
+    }
+    if not rows:
+        return []
+
+    tags = defaultdict(list)
+    for request_id, tag_id, tag_name in BuddyRequestTag.objects.filter(
+        request_id__in=rows.keys()
+    ).order_by('id').values_list('request_id', 'tag_id', 'tag_name'):
+        tags[request_id].append((tag_id, tag_name))
+
+    profiles = {}
+    for user_id, *profile in UserProfile.objects.filter(
+        user_id__in={row[1] for row in rows.values()}, is_primary=True
+    ).values_list(
+        'user_id', 'name', 'mbti', 'bio',
+        'address__country', 'address__province', 'address__city', 'address__district',
+        'address__latitude', 'address__longitude',
+    ):
+        name, mbti, bio, *address, latitude, longitude = profile
+        profiles[user_id] = {
+            'profile_name': name,
+            'mbti': mbti,
+            'bio': bio,
+            'location': _location_display(*address),
+            'latitude': latitude,
+            'longitude': longitude,
+        }
+
+    return [
+        CandidateRecord(
+            request_id, user_id, username, event_name, event_start, event_end, description,
+            tags=tuple(tags.get(request_id, ())),
+            **profiles.get(user_id, {})
+        )
+        for request_id, user_id, username, event_name, event_start, event_end, description in (
+            rows[request_id] for request_id in request_ids if request_id in rows
+        )
+    ]
@@ -0,0 +1,181 @@
+"""
+搭子请求匹配任务的调度
+
+创建和每次更新请求都会触发匹配，短时间内的连续修改原本会各自启动一条完整的LLM流程，
+相互竞争写入标签和匹配记录。这里在触发和任务两侧做以下处理：
+- 内容未变化：请求内容摘要（描述、活动、档案及主档案版本）与上次完成匹配时一致则不启动
+- 防抖：任务延迟 MATCHING_DISPATCH_DEBOUNCE_SECONDS 秒执行，窗口内同样内容的重复触发复用同一个任务，
+  内容变化时启动新任务并撤销（revoke）尚未执行的旧任务
+- 只运行最新版本：Redis 中记录每个请求最新的任务ID，旧任务开始时和各阶段之间发现已被取代即退出；
+  同一请求同时只有一个任务在运行（请求级锁），新任务等旧任务退出后再开始
+
+Redis 键：
+- match:dispatch:{request_id}:latest   最新任务 "task_id|内容摘要"
+- match:dispatch:{request_id}:running  正在运行的任务ID（请求级锁）
+- match:dispatch:{request_id}:lock     调度时的互斥锁
+
+Redis 不可用时退回直接启动任务，不做防抖和去重。
+"""
+import uuid
+import hashlib
+import logging
+
+from django.conf import settings
+
+from utils.redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+_STATE_TTL = 24 * 3600
+
+# 只删除自己持有的锁
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class MatchingSuperseded(Exception):
+    """请求有了更新的匹配任务，当前任务应当退出"""
+
+
+def _latest_key(request_id):
+    return f'match:dispatch:{request_id}:latest'
+
+
+def _running_key(request_id):
+    return f'match:dispatch:{request_id}:running'
+
+
+def _lock_key(request_id):
+    return f'match:dispatch:{request_id}:lock'
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def matching_signature(buddy_request, profile=None):
+    """
+    影响匹配结果的请求内容摘要
+    :param profile: 用户主档案（已加载时传入以免再次查询）
+    """
+    if profile is None:
+        from profiles.models import UserProfile
+
+        profile = UserProfile.objects.select_related('address').filter(
+            user_id=buddy_request.user_id, is_primary=True
+        ).first()
+    parts = [
+        buddy_request.description or '',
+        str(buddy_request.event_id),
+        str(buddy_request.profile_id or ''),
+        # 是否公开决定候选范围和配对表召回
+        str(buddy_request.is_public),
+        profile.get_summary_version() if profile else '',
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _latest(r, request_id):
+    """最新任务：(task_id, 内容摘要)，没有记录时返回 None"""
+    value = _decode(r.get(_latest_key(request_id)))
+    if not value:
+        return None
+    task_id, _, signature = value.partition('|')
+    return task_id, signature
+
+
+def _revoke(task_id):
+    from celery import current_app
+
+    try:
+        current_app.control.revoke(task_id)
+    except Exception as e:
+        logger.warning(f"撤销匹配任务 {task_id} 失败: {e}")
+
+
+def dispatch_matching(buddy_request, force=False):
+    """
+    为请求启动匹配任务（防抖、去重）
+    :param force: 忽略内容摘要，强制重新匹配
+    :return: 任务ID；内容未变化时返回 None
+    """
+    from celery.result import AsyncResult
+    from .models import BuddyRequest
+    from .tasks import process_buddy_request_matching
+
+    signature = matching_signature(buddy_request)
+    if not force and signature == buddy_request.matching_signature:
+        logger.info(f"搭子请求 {buddy_request.id} 内容未变化，跳过匹配")
+        return None
+
+    task_id = str(uuid.uuid4())
+    superseded = None
+    try:
+        r = get_redis()
+        with r.lock(_lock_key(buddy_request.id), timeout=10, blocking_timeout=5):
+            latest = _latest(r, buddy_request.id)
+            if latest and not force and latest[1] == signature and not AsyncResult(latest[0]).ready():
+                logger.info(f"搭子请求 {buddy_request.id} 已有相同内容的匹配任务 {latest[0]}")
+                return latest[0]
+            r.set(_latest_key(buddy_request.id), f'{task_id}|{signature}', ex=_STATE_TTL)
+            superseded = latest[0] if latest else None
+    except Exception as e:
+        logger.warning(f"匹配任务调度状态不可用，直接启动任务: {e}")
+
+    if superseded:
+        # 尚未执行的旧任务直接丢弃；已在运行的旧任务会在下一个阶段检查时退出
+        _revoke(superseded)
+        logger.info(f"搭子请求 {buddy_request.id} 的匹配任务 {superseded} 已被 {task_id} 取代")
+
+    process_buddy_request_matching.apply_async(
+        args=[buddy_request.id], kwargs={'force': force},
+        task_id=task_id, countdown=settings.MATCHING_DISPATCH_DEBOUNCE_SECONDS,
+    )
+    BuddyRequest.objects.filter(pk=buddy_request.pk).update(celery_task_id=task_id)
+    buddy_request.celery_task_id = task_id
+    return task_id
+
+
+def is_latest(request_id, task_id):
+    """任务是否为请求最新的匹配任务；直接调用（没有任务ID）或状态不可用时视为最新"""
+    if task_id is None:
+        return True
+    try:
+        latest = _latest(get_redis(), request_id)
+    except Exception as e:
+        logger.warning(f"读取匹配任务调度状态失败: {e}")
+        return True
+    return latest is None or latest[0] == task_id
+
+
+def check_latest(request_id, task_id):
+    """在匹配阶段之间调用，已被取代时抛出 MatchingSuperseded"""
+    if not is_latest(request_id, task_id):
+        raise MatchingSuperseded(f"搭子请求 {request_id} 的匹配任务 {task_id} 已被取代")
+
+
+def acquire_run(request_id, task_id):
+    """获取请求级运行锁，其他任务正在运行时返回 False"""
+    if task_id is None:
+        return True
+    try:
+        r = get_redis()
+        if r.set(_running_key(request_id), task_id, nx=True, ex=settings.MATCHING_DISPATCH_LOCK_TIMEOUT):
+            return True
+        return _decode(r.get(_running_key(request_id))) == task_id
+    except Exception as e:
+        logger.warning(f"获取匹配运行锁失败: {e}")
+        return True
+
+
+def release_run(request_id, task_id):
+    if task_id is None:
+        return
+    try:
+        get_redis().eval(_RELEASE_SCRIPT, 1, _running_key(request_id), task_id)
+    except Exception as e:
+        logger.warning(f"释放匹配运行锁失败: {e}")
@@ -0,0 +1,155 @@
+"""
+匹配排除：不再推荐给发起者的用户
+
+两类排除在候选召回阶段（加载候选人详情和构建提示词之前）生效：
+- 按请求：该请求已经有匹配记录（待确认、已接受或已拒绝）的用户，从 BuddyMatch 读取
+- 按用户对：一方拒绝过匹配的两个用户，任何请求中都不再互相推荐，保存在 MatchExclusion
+
+绝大多数用户没有任何用户对排除。每个进程缓存一个 Bloom 过滤器，记录出现在 MatchExclusion 中的用户，
+过滤器判定不存在时不查询数据库；新增排除时递增 Redis 中的版本号，各进程在下次查询时重建过滤器。
+Bloom 过滤器没有假阴性，误判只会多一次数据库查询；Redis 不可用时总是查询数据库。
+"""
+import hashlib
+import logging
+import math
+import threading
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from utils.redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+_VERSION_KEY = 'match:exclusions:version'
+# Bloom 过滤器的目标误判率和最小容量
+_FALSE_POSITIVE_RATE = 0.01
+_MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    """整数键的 Bloom 过滤器（位数组 + 双重哈希）"""
+
+    def __init__(self, capacity, false_positive_rate=_FALSE_POSITIVE_RATE):
+        capacity = max(capacity, _MIN_CAPACITY)
+        self.size = int(math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def pair_key(user_id, other_user_id):
+    """用户对按 (较小ID, 较大ID) 保存"""
+    return (user_id, other_user_id) if user_id < other_user_id else (other_user_id, user_id)
+
+
+def _build_filter():
+    from .models import MatchExclusion
+
+    user_ids = set()
+    for user_a, user_b in MatchExclusion.objects.values_list('user_a_id', 'user_b_id').iterator(chunk_size=5000):
+        user_ids.add(user_a)
+        user_ids.add(user_b)
+    bloom = BloomFilter(len(user_ids) * 2)
+    for user_id in user_ids:
+        bloom.add(user_id)
+    logger.info(f"匹配排除过滤器已构建，涉及用户 {len(user_ids)} 个")
+    return bloom
+
+
+_cached = None  # (version, BloomFilter)
+_lock = threading.Lock()
+
+
+def _get_filter():
+    """当前版本的 Bloom 过滤器，Redis 不可用时返回 None"""
+    global _cached
+    try:
+        version = int(get_redis().get(_VERSION_KEY) or 0)
+    except Exception as e:
+        logger.warning(f"读取匹配排除版本失败: {e}")
+        return None
+    with _lock:
+        if _cached is not None and _cached[0] == version:
+            return _cached[1]
+    bloom = _build_filter()
+    with _lock:
+        _cached = (version, bloom)
+    return bloom
+
+
+def _invalidate():
+    try:
+        get_redis().incr(_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"更新匹配排除版本失败: {e}")
+
+
+def paired_exclusions(user_id):
+    """与用户互相排除的用户ID集合"""
+    from .models import MatchExclusion
+
+    bloom = _get_filter()
+    if bloom is not None and user_id not in bloom:
+        return set()
+    excluded = set()
+    for user_a, user_b in MatchExclusion.objects.filter(
+        Q(user_a_id=user_id) | Q(user_b_id=user_id)
+    ).values_list('user_a_id', 'user_b_id'):
+        excluded.add(user_b if user_a == user_id else user_a)
+    return excluded
+
+
+def excluded_user_ids(buddy_request):
+    """
+    不再推荐给该请求的用户ID（不含发起者本人）
+    :return: frozenset
+    """
+    from .models import BuddyMatch
+
+    matched = BuddyMatch.objects.filter(request_id=buddy_request.id).values_list('matched_user_id', flat=True)
+    return frozenset(matched) | frozenset(paired_exclusions(buddy_request.user_id))
+
+
+def exclude_pairs(pairs, reason='rejected'):
+    """
+    记录互相排除的用户对
+    :param pairs: [(user_id, other_user_id)]
+    """
+    from .models import MatchExclusion
+
+    exclusions = [
+        MatchExclusion(user_a_id=a, user_b_id=b, reason=reason)
+        for a, b in {pair_key(*pair) for pair in pairs if pair[0] != pair[1]}
+    ]
+    if not exclusions:
+        return
+    MatchExclusion.objects.bulk_create(exclusions, ignore_conflicts=True)
+    # 提交后再通知其他进程，否则它们可能在提交前按新版本重建而漏掉这些用户
+    transaction.on_commit(_invalidate)
+
+
+@receiver(post_save, sender='matchmaking.BuddyMatch')
+def _on_match_saved(sender, instance, update_fields=None, **kwargs):
+    if instance.status != 'rejected' or (update_fields and 'status' not in update_fields):
+        return
+    from .models import BuddyRequest
+
+    requester_id = BuddyRequest.objects.filter(pk=instance.request_id).values_list('user_id', flat=True).first()
+    if requester_id is not None:
+        exclude_pairs([(requester_id, instance.matched_user_id)])
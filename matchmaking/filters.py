@@ -71,9 +71,13 @@ class BuddyRequestFilter(django_filters.FilterSet):
     def filter_by_tags(self, queryset, name, value):
         """按标签过滤"""
         if value:
-            tag_names = [tag.strip() for tag in value.split(',')]
+            from .tagging import tag_ids
+            # 同义词折叠为规范标签ID后按整数关联过滤
+            ids = tag_ids(value.split(','))
+            if not ids:
+                return queryset.none()
             return queryset.filter(
-                tags__name__in=tag_names
+                tags__tag_id__in=ids
             ).distinct()
         return queryset
     
@@ -0,0 +1,198 @@
+"""
+活动级全局匹配
+
+主办方触发"一键匹配"时，对活动下所有公开请求一次性计算两两得分并做全局分配，
+而不是逐个请求调用LLM：
+1. 分块计算对称得分矩阵，每行只保留得分最高的 MATCHING_GLOBAL_TOP_K 条边
+2. 贪心最大权匹配（带容量）：按得分从高到低接受边，两端请求都还有剩余名额且尚未匹配过时成交
+3. 每条成交的边为双方各写一条 BuddyMatch（附匹配分数和理由），所有记录一次批量插入，
+   事务提交后为每个获得新匹配的请求发起者发送一封汇总通知
+
+请求分块流式读取（iter_candidate_chunks），得分矩阵按 _BLOCK_SIZE 行分块计算，
+不会一次性把全部请求ID放进一条查询，也不会构造完整的 n × n 矩阵。
+
+每个请求的名额为 MATCHING_GLOBAL_CAPACITY，已有的匹配记录占用名额；互相排除的用户对不会被分配。
+同一用户的请求之间不配对，一个请求与同一用户最多配对一次（BuddyMatch 按请求和被匹配用户唯一）。
+"""
+import time
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .candidates import iter_candidate_chunks
+from .pair_table import pair_reasons
+from .ranking import CandidateColumns, display_score, feedback_ratings, pair_scores
+
+logger = logging.getLogger(__name__)
+
+# 分块计算得分矩阵时每块的行数，控制内存占用（块大小 × 请求数）
+_BLOCK_SIZE = 512
+
+
+def candidate_edges(columns, top_k, min_score):
+    """
+    分块计算两两得分，每行保留得分最高的 top_k 条边
+    :return: 去重后的 [(得分, i, j)]，i < j
+    """
+    n = len(columns)
+    ratings = feedback_ratings(columns.user_ids.tolist())
+    edges = {}
+    k = min(top_k, n - 1)
+    if k <= 0:
+        return []
+    for start in range(0, n, _BLOCK_SIZE):
+        rows = np.arange(start, min(start + _BLOCK_SIZE, n))
+        scores = pair_scores(columns, rows, ratings)
+        # 自身和同一用户的其他请求不连边
+        scores[columns.user_ids[rows][:, None] == columns.user_ids[None, :]] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for offset, i in enumerate(rows.tolist()):
+            for j in top[offset].tolist():
+                score = float(scores[offset, j])
+                if score < min_score:
+                    continue
+                edges[(min(i, j), max(i, j))] = score
+    return [(score, i, j) for (i, j), score in edges.items()]
+
+
+def greedy_assignment(edges, capacity, matched_pairs=frozenset(), owners=None):
+    """
+    贪心最大权匹配（带容量），结果的总权重不低于最优解的一半
+    :param edges: [(得分, i, j)]
+    :param capacity: 每个节点剩余名额的数组
+    :param matched_pairs: 已经匹配过的 (i, j) 对（i < j），不再重复匹配
+    :param owners: 每个节点所属的用户；给出时同一用户的节点不配对，一个节点与同一用户的节点最多配对一次
+    :return: [(i, j, 得分)]
+    """
+    remaining = list(capacity)
+    linked = set()
+    accepted = []
+    for score, i, j in sorted(edges, key=lambda edge: (-edge[0], edge[1], edge[2])):
+        if remaining[i] <= 0 or remaining[j] <= 0 or (i, j) in matched_pairs:
+            continue
+        if owners is not None:
+            if owners[i] == owners[j] or (i, owners[j]) in linked or (j, owners[i]) in linked:
+                continue
+            linked.add((i, owners[j]))
+            linked.add((j, owners[i]))
+        remaining[i] -= 1
+        remaining[j] -= 1
+        accepted.append((i, j, score))
+    return accepted
+
+
+def match_event(event_id, capacity=None, min_score=None, dry_run=False):
+    """
+    为活动下所有公开请求做全局匹配
+    :param capacity: 每个请求最多的匹配数，默认 MATCHING_GLOBAL_CAPACITY
+    :param min_score: 边的最低得分，默认 MATCHING_GLOBAL_MIN_SCORE
+    :param dry_run: 只计算不写入
+    :return: 统计信息
+    """
+    from .models import BuddyMatch, MatchExclusion
+
+    capacity = settings.MATCHING_GLOBAL_CAPACITY if capacity is None else capacity
+    min_score = settings.MATCHING_GLOBAL_MIN_SCORE if min_score is None else min_score
+    started = time.perf_counter()
+
+    candidates = [candidate for chunk in iter_candidate_chunks(event_id) for candidate in chunk]
+    stats = {'event_id': event_id, 'requests': len(candidates), 'pairs': 0, 'matches_created': 0, 'notifications': 0}
+    if len(candidates) < 2:
+        return stats
+
+    position = {c.request_id: i for i, c in enumerate(candidates)}
+    user_position = {}
+    for i, c in enumerate(candidates):
+        user_position.setdefault(c.user_id, []).append(i)
+
+    # 已有的匹配记录占用名额，已匹配过的请求对不再分配
+    remaining = [capacity] * len(candidates)
+    matched_pairs = set()
+    for request_id, matched_user_id in BuddyMatch.objects.filter(
+        request__event_id=event_id
+    ).values_list('request_id', 'matched_user_id'):
+        i = position.get(request_id)
+        if i is None:
+            continue
+        remaining[i] -= 1
+        for j in user_position.get(matched_user_id, ()):
+            matched_pairs.add((min(i, j), max(i, j)))
+    
+    # 互相排除的用户对同样不再分配
+    for user_a, user_b in MatchExclusion.objects.filter(
+        user_a_id__in=user_position.keys(), user_b_id__in=user_position.keys()
+    ).values_list('user_a_id', 'user_b_id'):
+        for i in user_position[user_a]:
+            for j in user_position[user_b]:
+                matched_pairs.add((min(i, j), max(i, j)))
+
+    columns = CandidateColumns(candidates)
+    edges = candidate_edges(columns, settings.MATCHING_GLOBAL_TOP_K, min_score)
+    pairs = greedy_assignment(edges, remaining, matched_pairs, owners=[c.user_id for c in candidates])
+    stats['edges'] = len(edges)
+    stats['pairs'] = len(pairs)
+
+    matches = []
+    for i, j, score in pairs:
+        a, b = candidates[i], candidates[j]
+        match_score, reasons = display_score(score), pair_reasons(a, b)
+        matches.append(BuddyMatch(
+            request_id=a.request_id, matched_user_id=b.user_id, status='pending',
+            match_score=match_score, reasons=reasons,
+        ))
+        matches.append(BuddyMatch(
+            request_id=b.request_id, matched_user_id=a.user_id, status='pending',
+            match_score=match_score, reasons=reasons,
+        ))
+
+    if not dry_run and matches:
+        with transaction.atomic():
+            # ignore_conflicts 时返回值包含被忽略的对象，插入前去掉（并发写入的）已有记录，只统计实际写入的
+            existing = set(BuddyMatch.objects.filter(
+                request_id__in={match.request_id for match in matches}
+            ).values_list('request_id', 'matched_user_id'))
+            matches = [match for match in matches if (match.request_id, match.matched_user_id) not in existing]
+            BuddyMatch.objects.bulk_create(matches, batch_size=1000, ignore_conflicts=True)
+            notifications = _match_notifications(candidates, position, matches)
+            transaction.on_commit(lambda: _send_notifications(notifications))
+        stats['matches_created'] = len(matches)
+        stats['notifications'] = len(notifications)
+
+    stats['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"活动 {event_id} 全局匹配完成: {stats}")
+    return stats
+
+
+def _match_notifications(candidates, position, matches):
+    """
+    按请求汇总本次插入的匹配记录，每个请求的发起者一封通知（发起者邮箱一次查询）
+    :return: [(邮箱, 通知内容)]
+    """
+    from django.contrib.auth import get_user_model
+
+    usernames = {c.user_id: c.username for c in candidates}
+    matched = {}
+    for match in matches:
+        matched.setdefault(match.request_id, []).append(usernames[match.matched_user_id])
+    owners = {request_id: candidates[position[request_id]] for request_id in matched}
+    emails = dict(get_user_model().objects.filter(
+        id__in={owner.user_id for owner in owners.values()}
+    ).exclude(email='').values_list('id', 'email'))
+
+    notifications = []
+    for request_id, names in matched.items():
+        owner = owners[request_id]
+        email = emails.get(owner.user_id)
+        if email:
+            details = f"我们为您找到了 {len(names)} 位搭子：{'、'.join(names)}，活动：{owner.event_name}"
+            notifications.append((email, details))
+    return notifications
+
+
+def _send_notifications(notifications):
+    from .tasks import send_buddy_match_notification
+
+    for email, details in notifications:
+        send_buddy_match_notification.delay(email, details)
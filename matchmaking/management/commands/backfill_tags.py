@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from matchmaking.models import BuddyRequestTag
+from matchmaking.tagging import resolve_tags, canonical_name
+
+
+class Command(BaseCommand):
+    help = '将已有的搭子请求标签迁移到规范标签（同义词折叠，同一请求内重复的标签合并）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的搭子请求数量')
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='重新规范化所有标签（新增同义词后使用），默认只处理尚未关联规范标签的记录'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='只统计不写入')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        pending = BuddyRequestTag.objects.all()
+        if not options['all']:
+            pending = pending.filter(tag__isnull=True)
+        request_ids = sorted(set(pending.values_list('request_id', flat=True)))
+        self.stdout.write(f'待处理搭子请求: {len(request_ids)}')
+
+        totals = {'updated': 0, 'merged': 0, 'unchanged': 0}
+        for start in range(0, len(request_ids), batch_size):
+            batch = request_ids[start:start + batch_size]
+            counts = self._backfill_batch(batch, dry_run)
+            for key, value in counts.items():
+                totals[key] += value
+            self.stdout.write(
+                f'  {start + len(batch)}/{len(request_ids)} 更新 {counts["updated"]}，'
+                f'合并重复 {counts["merged"]}'
+            )
+
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}完成：更新 {totals["updated"]} 条，合并重复 {totals["merged"]} 条，'
+            f'无需修改 {totals["unchanged"]} 条'
+        ))
+
+    def _backfill_batch(self, request_ids, dry_run):
+        rows = list(
+            BuddyRequestTag.objects.filter(request_id__in=request_ids).order_by('request_id', 'id')
+        )
+        canonical = {}
+        for name in {row.tag_name for row in rows}:
+            resolved = resolve_tags([name], create=not dry_run)
+            if resolved:
+                canonical[name] = resolved[0]
+            elif canonical_name(name):
+                # dry-run 不创建标签，用规范名称代替统计
+                canonical[name] = (None, canonical_name(name))
+            else:
+                canonical[name] = None
+
+        # 同一请求内折叠到同一规范标签的记录只保留一条，优先保留名称已规范的记录
+        rows.sort(key=lambda row: (
+            row.request_id,
+            canonical[row.tag_name] is None or row.tag_name != canonical[row.tag_name][1],
+            row.id,
+        ))
+        kept = set()
+        to_update = []
+        to_delete = []
+        unchanged = 0
+        for row in rows:
+            target = canonical[row.tag_name]
+            if target is None:
+                # 归一化后为空的标签直接删除
+                to_delete.append(row.id)
+                continue
+            tag_id, tag_name = target
+            if (row.request_id, tag_name) in kept:
+                to_delete.append(row.id)
+                continue
+            kept.add((row.request_id, tag_name))
+            if row.tag_id == tag_id and row.tag_name == tag_name:
+                unchanged += 1
+                continue
+            row.tag_id = tag_id
+            row.tag_name = tag_name
+            to_update.append(row)
+
+        if not dry_run:
+            with transaction.atomic():
+                # 先删除重复记录，避免更新名称时违反 (request, tag_name) 唯一约束
+                BuddyRequestTag.objects.filter(id__in=to_delete).delete()
+                BuddyRequestTag.objects.bulk_update(to_update, ['tag', 'tag_name'])
+
+        return {'updated': len(to_update), 'merged': len(to_delete), 'unchanged': unchanged}
@@ -0,0 +1,197 @@
+import re
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from utils.json_utils import extract_json
+
+CORPUS_PATH = Path(__file__).resolve().parents[2] / 'benchmarks' / 'llm_response_corpus.json'
+EXPECTED_TYPES = {'dict': dict, 'list': list}
+
+
+def legacy_extract_json(response):
+    """
+    旧版JSON提取函数（正则级联），仅用于基准对比
+    从LLM响应中提取JSON数据
+    支持多种格式：
+    1. 纯JSON
+    2. ```json 包装的JSON
+    3. ``` 包装的JSON
+    4. 混合文本中的JSON
+    5. 多个JSON对象（返回第一个有效的）
+    """
+    if not response or not isinstance(response, str):
+        raise ValueError("响应为空或不是字符串")
+    
+    # 清理响应文本
+    cleaned_response = response.strip()
+    
+    # 方法1: 尝试去除markdown代码块标记
+    patterns_to_remove = [
+        r'^```json\s*',  # 开头的```json
+        r'^```\s*',     # 开头的```
+        r'\s*```$',     # 结尾的```
+        r'^json\s*',    # 开头的json
+    ]
+    
+    for pattern in patterns_to_remove:
+        cleaned_response = re.sub(pattern, '', cleaned_response, flags=re.MULTILINE)
+    
+    cleaned_response = cleaned_response.strip()
+    
+    # 方法2: 直接尝试解析清理后的响应
+    try:
+        return json.loads(cleaned_response)
+    except json.JSONDecodeError:
+        pass
+    
+    # 方法3: 使用正则表达式查找JSON对象或数组
+    json_patterns = [
+        r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}',  # 匹配对象（支持嵌套）
+        r'\[[^\[\]]*(?:\[[^\[\]]*\][^\[\]]*)*\]',  # 匹配数组（支持嵌套）
+        r'\{.*?\}',  # 简单对象匹配
+        r'\[.*?\]',  # 简单数组匹配
+    ]
+    
+    for pattern in json_patterns:
+        matches = re.findall(pattern, cleaned_response, re.DOTALL)
+        for match in matches:
+            try:
+                # 清理匹配的JSON字符串
+                json_str = match.strip()
+                # 移除控制字符
+                json_str = re.sub(r'[\x00-\x1F\x7F]', '', json_str)
+                # 修复常见的引号问题
+                json_str = re.sub(r'(?<!\\)"', '"', json_str)
+                return json.loads(json_str)
+            except json.JSONDecodeError:
+                continue
+    
+    # 方法4: 尝试查找第一个 { 到最后一个 } 或第一个 [ 到最后一个 ]
+    start_chars = ['{', '[']
+    end_chars = ['}', ']']
+    
+    for start_char, end_char in zip(start_chars, end_chars):
+        start_idx = cleaned_response.find(start_char)
+        end_idx = cleaned_response.rfind(end_char)
+        
+        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
+            json_candidate = cleaned_response[start_idx:end_idx + 1]
+            try:
+                # 清理和修复JSON字符串
+                json_candidate = re.sub(r'[\x00-\x1F\x7F]', '', json_candidate)
+                json_candidate = re.sub(r'(?<!\\)"', '"', json_candidate)
+                return json.loads(json_candidate)
+            except json.JSONDecodeError:
+                continue
+    
+    # 方法5: 尝试逐行解析，寻找有效的JSON行
+    lines = cleaned_response.split('\n')
+    for line in lines:
+        line = line.strip()
+        if line and (line.startswith('{') or line.startswith('[')):
+            try:
+                return json.loads(line)
+            except json.JSONDecodeError:
+                continue
+    
+    # 方法6: 最后尝试 - 移除所有非JSON字符后解析
+    # 保留JSON相关字符：{}[]"':,0-9a-zA-Z空格中文等
+    json_chars_only = re.sub(r'[^{}\[\]"\':,\s\w\u4e00-\u9fff.-]', '', cleaned_response)
+    if json_chars_only.strip():
+        try:
+            return json.loads(json_chars_only)
+        except json.JSONDecodeError:
+            pass
+    
+    # 如果所有方法都失败，抛出异常
+    raise json.JSONDecodeError(f"无法从响应中提取有效JSON: {response[:200]}...", response, 0)
+
+
+def _synthetic_cases(scale):
+    """构造长文本用例，用于观察旧版正则在长输出上的回溯开销"""
+    rec = [{"user_id": i, "match_score": 7.5, "reasons": ["兴趣相同", "时间契合"]} for i in range(5)]
+    rec_txt = json.dumps(rec, ensure_ascii=False)
+    return [
+        {
+            'name': f'长说明文字+JSON（{scale}段）',
+            'expected_type': 'list',
+            'response': '下面是详细的分析过程。' * scale + '\n' + rec_txt,
+            'expected': rec,
+        },
+        {
+            'name': f'大量未闭合括号（{scale}个）',
+            'expected_type': 'list',
+            'response': '格式说明 { 字段 ' * scale + '\n' + rec_txt,
+            'expected': rec,
+        },
+    ]
+
+
+class Command(BaseCommand):
+    help = '对比新旧JSON提取函数在LLM响应语料上的正确率和吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='每个用例重复执行的次数'
+        )
+        parser.add_argument(
+            '--scale',
+            type=int,
+            default=2000,
+            help='合成长文本用例的规模'
+        )
+        parser.add_argument(
+            '--verbose-cases',
+            action='store_true',
+            help='逐条输出每个用例的结果'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        with open(CORPUS_PATH, encoding='utf-8') as f:
+            cases = json.load(f)
+        synthetic = _synthetic_cases(options['scale'])
+
+        self.stdout.write(f'语料用例 {len(cases)} 个，合成长文本用例 {len(synthetic)} 个，每个用例执行 {iterations} 次')
+
+        for label, func in [
+            ('旧版（正则级联）', lambda case: legacy_extract_json(case['response'])),
+            ('新版（单遍扫描）', lambda case: extract_json(
+                case['response'], expected_type=EXPECTED_TYPES.get(case.get('expected_type'))
+            )),
+        ]:
+            correct, elapsed = self._run(func, cases, iterations, options['verbose_cases'])
+            throughput = len(cases) * iterations / elapsed if elapsed else 0
+            self.stdout.write(self.style.SUCCESS(
+                f'{label}: 正确 {correct}/{len(cases)}，耗时 {elapsed * 1000:.1f}ms，吞吐 {throughput:.0f} 次/秒'
+            ))
+            for case in synthetic:
+                ok, case_elapsed = self._run(func, [case], max(iterations // 20, 1), False)
+                self.stdout.write(
+                    f'  {case["name"]}: {"正确" if ok else "错误"}，'
+                    f'单次 {case_elapsed * 1000 / max(iterations // 20, 1):.2f}ms'
+                )
+
+    def _run(self, func, cases, iterations, verbose):
+        correct = 0
+        elapsed = 0.0
+        for case in cases:
+            ok = False
+            start = time.perf_counter()
+            for _ in range(iterations):
+                try:
+                    result = func(case)
+                    ok = not case.get('expected_error') and result == case['expected']
+                except (json.JSONDecodeError, ValueError):
+                    ok = bool(case.get('expected_error'))
+            elapsed += time.perf_counter() - start
+            correct += ok
+            if verbose:
+                self.stdout.write(f'    [{"✓" if ok else "✗"}] {case["name"]}')
+        return correct, elapsed
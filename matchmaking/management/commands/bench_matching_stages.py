@@ -0,0 +1,114 @@
+import json
+import time
+import random
+import statistics
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from events.models import Event
+from profiles.models import UserProfile
+from matchmaking.models import BuddyRequest
+from matchmaking import tasks
+
+User = get_user_model()
+
+INTEGRATED_INFO = {
+    "user_traits": ["外向", "喜欢编程"],
+    "activity_info": "黑客松",
+    "matching_preferences": "希望找到能一起熬夜写代码的队友",
+    "key_points": ["后端开发", "周末有空"],
+    "risk_level": "low"
+}
+TAGS = ["编程", "黑客松", "夜猫子", "团队合作", "进阶"]
+
+
+class Command(BaseCommand):
+    help = '对比信息整合+标签生成阶段在融合模式与两次调用模式下的耗时（使用模拟LLM）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=800,
+            help='模拟LLM单次调用的平均延迟（毫秒）'
+        )
+        parser.add_argument(
+            '--jitter',
+            type=float,
+            default=0.1,
+            help='延迟的随机抖动比例'
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=5,
+            help='每种模式的运行次数'
+        )
+
+    def handle(self, *args, **options):
+        self.latency = options['latency'] / 1000
+        self.jitter = options['jitter']
+        runs = options['runs']
+        self.calls = 0
+
+        buddy_request, user_profile = self._build_request()
+
+        with mock.patch.object(tasks, 'get_llm_response', side_effect=self._stub_llm):
+            two_call = self._measure(runs, lambda: tasks._generate_smart_tags(
+                tasks._integrate_user_info(buddy_request, user_profile), buddy_request
+            ))
+            two_call_calls, self.calls = self.calls, 0
+            fused = self._measure(runs, lambda: tasks._integrate_and_tag(buddy_request, user_profile))
+            fused_calls = self.calls
+
+        self.stdout.write(f'模拟LLM延迟: {options["latency"]:.0f}ms ±{self.jitter:.0%}，每种模式 {runs} 次')
+        self._report('两次调用', two_call, two_call_calls / runs)
+        self._report('融合调用', fused, fused_calls / runs)
+        speedup = statistics.mean(two_call) / statistics.mean(fused)
+        self.stdout.write(self.style.SUCCESS(f'融合模式加速比: {speedup:.2f}x'))
+
+    def _build_request(self):
+        """构造不落库的请求对象，基准测试不需要数据库"""
+        user = User(id=1, username='bench_user')
+        now = timezone.now()
+        event = Event(
+            id=1, name='AdventureX 黑客松', creator=user,
+            start_time=now + timedelta(days=7), end_time=now + timedelta(days=9)
+        )
+        user_profile = UserProfile(
+            user=user, name='测试档案', mbti='ENTP',
+            bio='全栈开发者，喜欢熬夜写代码，也喜欢周末徒步。'
+        )
+        buddy_request = BuddyRequest(
+            id=1, user=user, event=event, profile=user_profile,
+            description='想找两位擅长前端和设计的队友一起参加黑客松，最好能通宵。'
+        )
+        return buddy_request, user_profile
+
+    def _stub_llm(self, system_content, user_content, temperature=0.7, stage=None):
+        self.calls += 1
+        time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        if '"tags"' in system_content:
+            return json.dumps(dict(INTEGRATED_INFO, tags=TAGS), ensure_ascii=False)
+        if '标签生成助手' in system_content:
+            return json.dumps(TAGS, ensure_ascii=False)
+        return json.dumps(INTEGRATED_INFO, ensure_ascii=False)
+
+    def _measure(self, runs, func):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def _report(self, label, timings, calls_per_run):
+        self.stdout.write(
+            f'{label}: 平均 {statistics.mean(timings):.1f}ms, '
+            f'中位数 {statistics.median(timings):.1f}ms, '
+            f'最大 {max(timings):.1f}ms, LLM调用 {calls_per_run:.0f} 次/轮'
+        )
@@ -0,0 +1,56 @@
+import time
+import random
+import statistics
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from matchmaking.candidates import CandidateRecord
+from matchmaking.ranking import MBTI_TYPES, RequesterFeatures, prerank
+
+
+class Command(BaseCommand):
+    help = '测试候选人预排序的耗时（随机生成候选人，不需要数据库）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=10000, help='候选人数量')
+        parser.add_argument('--tags', type=int, default=300, help='标签种类数')
+        parser.add_argument('--limit', type=int, default=20, help='返回的候选人数量')
+        parser.add_argument('--runs', type=int, default=5, help='运行次数')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        candidates = [self._candidate(rng, i, now, options['tags']) for i in range(options['size'])]
+        ratings = {c.user_id: rng.uniform(1, 5) for c in candidates if rng.random() < 0.5}
+        requester = RequesterFeatures(
+            user_id=0, tag_ids=rng.sample(range(1, options['tags'] + 1), 5), mbti='ENTP',
+            latitude=39.99, longitude=116.31
+        )
+
+        timings = []
+        for _ in range(options['runs']):
+            start = time.perf_counter()
+            ranked = prerank(requester, candidates, limit=options['limit'], ratings=ratings)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        self.stdout.write(
+            f'候选人 {len(candidates)} 个：平均 {statistics.mean(timings):.1f}ms, '
+            f'中位数 {statistics.median(timings):.1f}ms, 最大 {max(timings):.1f}ms'
+        )
+        for candidate in ranked[:5]:
+            self.stdout.write(f'  用户 {candidate.user_id}: {candidate.score:.3f}')
+
+    def _candidate(self, rng, i, now, tag_count):
+        start = now + timedelta(hours=rng.randint(-6, 6))
+        has_address = rng.random() < 0.8
+        return CandidateRecord(
+            request_id=i + 1, user_id=i + 1, username=f'user{i + 1}', event_name='黑客松',
+            event_start=start, event_end=start + timedelta(hours=rng.randint(1, 12)), description='',
+            tags=tuple((tag_id, str(tag_id)) for tag_id in rng.sample(range(1, tag_count + 1), rng.randint(0, 8))),
+            profile_name=f'user{i + 1}', mbti=rng.choice(MBTI_TYPES + [None]),
+            latitude=39.9 + rng.uniform(-0.5, 0.5) if has_address else None,
+            longitude=116.4 + rng.uniform(-0.5, 0.5) if has_address else None,
+        )
@@ -0,0 +1,88 @@
+import time
+import random
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from matchmaking.candidates import CandidateRecord
+from matchmaking.ranking import MBTI_TYPES, RequesterFeatures, prerank, stream_prerank
+
+
+class _SyntheticRatings:
+    """按用户ID确定的评分（一半用户有评价），不随候选人数量占用内存"""
+
+    def get(self, user_id, default=None):
+        return 1 + user_id % 5 if user_id % 2 else default
+
+
+class Command(BaseCommand):
+    help = '对比流式 top-k 与全量预排序打分的峰值内存和耗时（随机生成候选人，不需要数据库；不包含数据库读取和标签、文本召回）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='50,5000,50000,500000', help='候选人数量，逗号分隔')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='每块的候选人数')
+        parser.add_argument('--limit', type=int, default=20, help='返回的候选人数量')
+        parser.add_argument('--tags', type=int, default=300, help='标签种类数')
+        parser.add_argument('--full-max', type=int, default=50000, help='全量预排序的最大候选人数（更大时只测流式）')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        requester = RequesterFeatures(
+            user_id=0, tag_ids=random.Random(options['seed']).sample(range(1, options['tags'] + 1), 5),
+            mbti='ENTP', latitude=39.99, longitude=116.31
+        )
+        self.stdout.write(f"{'候选人':>10} {'方式':>6} {'峰值内存':>12} {'耗时':>10}")
+        for size in [int(size) for size in options['sizes'].split(',') if size.strip()]:
+            ratings = _SyntheticRatings()
+
+            def chunks():
+                rng = random.Random(options['seed'])
+                for start in range(0, size, options['chunk_size']):
+                    yield [
+                        self._candidate(rng, i, now, options['tags'])
+                        for i in range(start, min(start + options['chunk_size'], size))
+                    ]
+
+            streamed, peak, elapsed = self._measure(
+                lambda: stream_prerank(requester, chunks(), options['limit'], ratings=ratings)
+            )
+            self._report(size, '流式', peak, elapsed)
+
+            if size <= options['full_max']:
+                full, peak, elapsed = self._measure(
+                    lambda: prerank(
+                        requester, [c for chunk in chunks() for c in chunk], limit=options['limit'], ratings=ratings
+                    )
+                )
+                self._report(size, '全量', peak, elapsed)
+                if [c.request_id for c in full] != [c.request_id for c in streamed]:
+                    self.stdout.write(self.style.ERROR(f'{size} 个候选人时流式结果与全量预排序不一致'))
+
+    def _measure(self, func):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            result = func()
+            elapsed = (time.perf_counter() - start) * 1000
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, peak, elapsed
+
+    def _report(self, size, mode, peak, elapsed):
+        self.stdout.write(f'{size:>13} {mode:>8} {peak / 1024 / 1024:>11.1f}MB {elapsed:>8.0f}ms')
+
+    def _candidate(self, rng, i, now, tag_count):
+        start = now + timedelta(hours=rng.randint(-6, 6))
+        has_address = rng.random() < 0.8
+        return CandidateRecord(
+            request_id=i + 1, user_id=i + 1, username=f'user{i + 1}', event_name='黑客松',
+            event_start=start, event_end=start + timedelta(hours=rng.randint(1, 12)), description='',
+            tags=tuple((tag_id, str(tag_id)) for tag_id in rng.sample(range(1, tag_count + 1), rng.randint(0, 8))),
+            profile_name=f'user{i + 1}', mbti=rng.choice(MBTI_TYPES + [None]),
+            latitude=39.9 + rng.uniform(-0.5, 0.5) if has_address else None,
+            longitude=116.4 + rng.uniform(-0.5, 0.5) if has_address else None,
+        )
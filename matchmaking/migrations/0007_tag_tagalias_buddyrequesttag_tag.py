@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-17 09:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchmaking', '0006_remove_buddyrequest_matchmaking_status_5b1b5b_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='规范标签名称', max_length=50, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': '标签',
+                'verbose_name_plural': '标签',
+            },
+        ),
+        migrations.CreateModel(
+            name='TagAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(help_text='同义词（归一化后）', max_length=50, unique=True)),
+                ('tag', models.ForeignKey(help_text='对应的规范标签', on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='matchmaking.tag')),
+            ],
+            options={
+                'verbose_name': '标签同义词',
+                'verbose_name_plural': '标签同义词',
+            },
+        ),
+        migrations.AddField(
+            model_name='buddyrequesttag',
+            name='tag',
+            field=models.ForeignKey(blank=True, help_text='规范标签', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='request_tags', to='matchmaking.tag'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-17 14:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0005_remove_event_is_public'),
+        ('matchmaking', '0007_tag_tagalias_buddyrequesttag_tag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='buddyrequest',
+            name='pair_signature',
+            field=models.CharField(blank=True, default='', editable=False, help_text='配对得分对应的内容摘要', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='RequestPairScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(help_text='配对得分（0-1）')),
+                ('reasons', models.JSONField(blank=True, default=list, help_text='得分理由')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pair_scores', to='events.event')),
+                ('request_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='matchmaking.buddyrequest')),
+                ('request_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='matchmaking.buddyrequest')),
+            ],
+            options={
+                'verbose_name': '请求配对得分',
+                'verbose_name_plural': '请求配对得分',
+                'indexes': [models.Index(fields=['request_a', '-score'], name='matchmaking_request_b1d162_idx'), models.Index(fields=['request_b', '-score'], name='matchmaking_request_934a43_idx'), models.Index(fields=['event'], name='matchmaking_event_i_9a1c3b_idx')],
+                'unique_together': {('request_a', 'request_b')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchmaking', '0008_buddyrequest_pair_signature_requestpairscore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='buddymatch',
+            name='match_score',
+            field=models.FloatField(default=0.0, help_text='匹配分数（0-10）'),
+        ),
+        migrations.AddField(
+            model_name='buddymatch',
+            name='reasons',
+            field=models.JSONField(blank=True, default=list, help_text='匹配理由'),
+        ),
+        migrations.AddIndex(
+            model_name='buddymatch',
+            index=models.Index(fields=['request', '-match_score', '-id'], name='matchmaking_request_cbdb74_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.4 on 2026-10-17 16:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_reputation(apps, schema_editor):
+    UserFeedback = apps.get_model('matchmaking', 'UserFeedback')
+    UserReputation = apps.get_model('matchmaking', 'UserReputation')
+    rows = UserFeedback.objects.values('to_user_id').annotate(
+        rating_sum=Sum('rating'),
+        rating_count=Count('id'),
+        **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in range(1, 6)},
+    )
+    UserReputation.objects.bulk_create([
+        UserReputation(
+            user_id=row['to_user_id'], rating_sum=row['rating_sum'], rating_count=row['rating_count'],
+            **{f'rating_{rating}': row[f'rating_{rating}'] for rating in range(1, 6)},
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchmaking', '0009_buddymatch_match_score_reasons'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserReputation',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reputation', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating_sum', models.PositiveIntegerField(default=0, help_text='评分总和')),
+                ('rating_count', models.PositiveIntegerField(default=0, help_text='评价数')),
+                ('rating_1', models.PositiveIntegerField(default=0, help_text='1星评价数')),
+                ('rating_2', models.PositiveIntegerField(default=0, help_text='2星评价数')),
+                ('rating_3', models.PositiveIntegerField(default=0, help_text='3星评价数')),
+                ('rating_4', models.PositiveIntegerField(default=0, help_text='4星评价数')),
+                ('rating_5', models.PositiveIntegerField(default=0, help_text='5星评价数')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '用户信誉',
+                'verbose_name_plural': '用户信誉',
+            },
+        ),
+        migrations.RunPython(fill_reputation, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchmaking', '0010_userreputation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='buddyrequest',
+            name='matching_signature',
+            field=models.CharField(blank=True, default='', editable=False, help_text='最近一次匹配对应的内容摘要', max_length=64),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_exclusions(apps, schema_editor):
+    BuddyMatch = apps.get_model('matchmaking', 'BuddyMatch')
+    MatchExclusion = apps.get_model('matchmaking', 'MatchExclusion')
+    pairs = set()
+    for requester_id, matched_user_id in BuddyMatch.objects.filter(status='rejected').values_list(
+        'request__user_id', 'matched_user_id'
+    ).iterator(chunk_size=2000):
+        if requester_id != matched_user_id:
+            pairs.add((min(requester_id, matched_user_id), max(requester_id, matched_user_id)))
+    MatchExclusion.objects.bulk_create(
+        [MatchExclusion(user_a_id=a, user_b_id=b, reason='rejected') for a, b in pairs],
+        batch_size=1000, ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchmaking', '0011_buddyrequest_matching_signature'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchExclusion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(choices=[('rejected', '已拒绝')], default='rejected', help_text='排除原因', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '匹配排除',
+                'verbose_name_plural': '匹配排除',
+                'indexes': [models.Index(fields=['user_b'], name='matchmaking_user_b__f76aa8_idx')],
+                'unique_together': {('user_a', 'user_b')},
+            },
+        ),
+        migrations.RunPython(fill_exclusions, migrations.RunPython.noop),
+    ]
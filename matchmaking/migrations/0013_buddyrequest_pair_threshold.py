@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchmaking', '0012_matchexclusion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='buddyrequest',
+            name='pair_threshold',
+            field=models.FloatField(default=0.0, editable=False, help_text='已保存配对中第 k 高的得分（下界），不足 k 个时为 0'),
+        ),
+    ]
@@ -13,6 +13,11 @@ class BuddyRequest(models.Model):
 
     is_public = models.BooleanField(default=False, help_text='是否允许别人找搭子')
     celery_task_id = models.CharField(max_length=255, blank=True, null=True, help_text='Celery任务ID')
+    # 计算配对得分时请求内容（描述、标签、档案）的摘要，未变化时不重新打分
+    pair_signature = models.CharField(max_length=64, blank=True, default='', editable=False, help_text='配对得分对应的内容摘要')
+    pair_threshold = models.FloatField(default=0.0, editable=False, help_text='已保存配对中第 k 高的得分（下界），不足 k 个时为 0')
+    # 最近一次完成匹配时的请求内容摘要，内容未变化时不重新启动匹配（见 dispatch 模块）
+    matching_signature = models.CharField(max_length=64, blank=True, default='', editable=False, help_text='最近一次匹配对应的内容摘要')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -49,8 +54,38 @@ class BuddyRequest(models.Model):
             raise ValueError("档案必须属于当前用户")
         super().save(*args, **kwargs)
 
+class Tag(models.Model):
+    """规范标签，同义词通过 TagAlias 归并到同一个标签"""
+    name = models.CharField(max_length=50, unique=True, help_text='规范标签名称')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = '标签'
+        verbose_name_plural = '标签'
+    
+    def __str__(self):
+        return self.name
+
+class TagAlias(models.Model):
+    """标签同义词（如：熬夜 -> 夜猫子），alias 为归一化后的写法"""
+    alias = models.CharField(max_length=50, unique=True, help_text='同义词（归一化后）')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='aliases', help_text='对应的规范标签')
+    
+    class Meta:
+        verbose_name = '标签同义词'
+        verbose_name_plural = '标签同义词'
+    
+    def __str__(self):
+        return f"{self.alias} -> {self.tag.name}"
+    
+    def save(self, *args, **kwargs):
+        from .tagging import normalize_tag
+        self.alias = normalize_tag(self.alias)
+        super().save(*args, **kwargs)
+
 class BuddyRequestTag(models.Model):
     request = models.ForeignKey(BuddyRequest, on_delete=models.CASCADE, related_name='tags')
+    tag = models.ForeignKey(Tag, on_delete=models.PROTECT, related_name='request_tags', null=True, blank=True, help_text='规范标签')
     tag_name = models.CharField(max_length=50, help_text='标签名称（如：编程、组队）')
     
     class Meta:
@@ -76,6 +111,8 @@ class BuddyMatch(models.Model):
     matched_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='buddy_matches')
     matched_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', help_text='匹配状态')
+    match_score = models.FloatField(default=0.0, help_text='匹配分数（0-10）')
+    reasons = models.JSONField(default=list, blank=True, help_text='匹配理由')
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
@@ -84,6 +121,8 @@ class BuddyMatch(models.Model):
         unique_together = [('request', 'matched_user')]
         indexes = [
             models.Index(fields=['request']),
+            # 匹配列表按分数降序的索引扫描与游标分页
+            models.Index(fields=['request', '-match_score', '-id']),
             models.Index(fields=['matched_user']),
             models.Index(fields=['status']),
             models.Index(fields=['matched_at']),
@@ -92,6 +131,53 @@ class BuddyMatch(models.Model):
     def __str__(self):
         return f"{self.matched_user.username} -> {self.request.event.name} ({self.status})"
 
+class RequestPairScore(models.Model):
+    """
+    同一活动下两个公开请求之间的配对得分（对称，request_a.id < request_b.id）
+    请求内容变化时只重新计算与该请求相关的行，匹配时按得分读取 top-k
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='pair_scores')
+    request_a = models.ForeignKey(BuddyRequest, on_delete=models.CASCADE, related_name='+')
+    request_b = models.ForeignKey(BuddyRequest, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(help_text='配对得分（0-1）')
+    reasons = models.JSONField(default=list, blank=True, help_text='得分理由')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = '请求配对得分'
+        verbose_name_plural = '请求配对得分'
+        unique_together = [('request_a', 'request_b')]
+        indexes = [
+            models.Index(fields=['request_a', '-score']),
+            models.Index(fields=['request_b', '-score']),
+            models.Index(fields=['event']),
+        ]
+    
+    def __str__(self):
+        return f"{self.request_a_id} <-> {self.request_b_id} ({self.score:.3f})"
+
+class MatchExclusion(models.Model):
+    """不再互相推荐的用户对（user_a.id < user_b.id），候选召回时排除"""
+    REASON_CHOICES = [
+        ('rejected', '已拒绝'),
+    ]
+    
+    user_a = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_b = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    reason = models.CharField(max_length=10, choices=REASON_CHOICES, default='rejected', help_text='排除原因')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = '匹配排除'
+        verbose_name_plural = '匹配排除'
+        unique_together = [('user_a', 'user_b')]
+        indexes = [
+            models.Index(fields=['user_b']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_a_id} x {self.user_b_id} ({self.reason})"
+
 class UserFeedback(models.Model):
     from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='given_feedbacks')
     to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_feedbacks')
@@ -121,10 +207,56 @@ class UserFeedback(models.Model):
     
     @classmethod
     def get_user_average_rating(cls, user):
-        from django.db.models import Avg
-        result = cls.objects.filter(to_user=user).aggregate(avg_rating=Avg('rating'))
-        return result['avg_rating'] or 0
+        reputation = UserReputation.objects.filter(user=user).first()
+        return (reputation.average_rating or 0) if reputation else 0
     
     @classmethod
     def get_user_feedback_count(cls, user):
-        return cls.objects.filter(to_user=user).count()
+        reputation = UserReputation.objects.filter(user=user).first()
+        return reputation.rating_count if reputation else 0
+
+class UserReputation(models.Model):
+    """
+    用户收到评价的汇总，评价新增、修改或删除时用 F() 原子更新（见 reputation 模块）
+    排序和展示时直接读取，不再逐个用户聚合 UserFeedback
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='reputation')
+    rating_sum = models.PositiveIntegerField(default=0, help_text='评分总和')
+    rating_count = models.PositiveIntegerField(default=0, help_text='评价数')
+    rating_1 = models.PositiveIntegerField(default=0, help_text='1星评价数')
+    rating_2 = models.PositiveIntegerField(default=0, help_text='2星评价数')
+    rating_3 = models.PositiveIntegerField(default=0, help_text='3星评价数')
+    rating_4 = models.PositiveIntegerField(default=0, help_text='4星评价数')
+    rating_5 = models.PositiveIntegerField(default=0, help_text='5星评价数')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = '用户信誉'
+        verbose_name_plural = '用户信誉'
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.average_rating} ({self.rating_count})"
+    
+    @property
+    def average_rating(self):
+        """平均评分，没有评价时为 None"""
+        return round(self.rating_sum / self.rating_count, 2) if self.rating_count else None
+    
+    @property
+    def histogram(self):
+        return {rating: getattr(self, f'rating_{rating}') for rating in range(1, 6)}
+    
+    @classmethod
+    def get_bulk(cls, user_ids):
+        """批量读取（一次查询）：{user_id: UserReputation}，没有记录的用户不在结果中"""
+        return cls.objects.in_bulk(set(user_ids))
+    
+    @classmethod
+    def get_average_ratings(cls, user_ids):
+        """批量读取平均评分（一次查询）：{user_id: 平均评分}，没有评价的用户不在结果中"""
+        return {
+            user_id: rating_sum / rating_count
+            for user_id, rating_sum, rating_count in cls.objects.filter(
+                user_id__in=set(user_ids), rating_count__gt=0
+            ).values_list('user_id', 'rating_sum', 'rating_count')
+        }
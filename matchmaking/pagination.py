@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+
+class MatchCursorPagination(CursorPagination):
+    """
+    匹配列表按分数降序的游标分页
+    游标记录上一页末尾的 match_score 及其同分条数，翻页时按 match_score 定位后再跳过同分的已读行；
+    只在分数上定位，不是 (match_score, id) 的复合 keyset，同分的行很多时翻页仍要扫过这些行
+    """
+    ordering = ('-match_score', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # 固定按分数排序，不使用视图上 OrderingFilter 的排序（那是请求列表的字段）
+        return self.ordering
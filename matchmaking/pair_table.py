@@ -0,0 +1,256 @@
+"""
+请求配对得分表
+
+每个新请求原本都要把活动下全部请求重新打分一遍，(A,B) 与 (B,A) 的得分也从不复用。
+这里把同一活动下公开请求两两之间的对称得分持久化到 RequestPairScore：
+- 请求内容（描述、标签、主档案）变化时，只将该请求与活动内其余请求打分一次，替换与它相关的行
+- 内容摘要未变化时跳过（BuddyRequest.pair_signature）
+- 匹配时按得分读取 top-k，作为标签倒排索引和文本索引之外的补充召回来源，与其他候选一起预排序
+  （MATCHING_PAIR_SCORES_ENABLED，默认关闭）
+
+每个请求保存得分最高的 MATCHING_PAIR_TOP_K 个配对（且不低于 MATCHING_PAIR_MIN_SCORE），
+某一对只要进入任一方的 top-k 就会保留：重新打分时除了本请求的 top-k，
+得分超过对方第 k 名得分的配对、原本在对方 top-k 中的配对也会写入，对方不需要重新打分。
+对方第 k 名的得分保存在 BuddyRequest.pair_threshold，它是实际值的下界（对方重新打分时精确计算，
+对方失去 top-k 中的配对时降低），因此不会漏掉应当保留的配对，只可能暂时多保留一些。
+打分时分块流式读取活动内的请求，只在堆中保留 top-k，内存占用取决于块大小、k 和保存的配对数，与活动规模无关；
+文本相似度只取文本检索的前若干个结果，检索的读取量有上限（见 text_index）。
+"""
+import hashlib
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from .candidates import iter_candidate_chunks, load_candidates
+from .ranking import (
+    SIGNALS, CandidateColumns, feedback_ratings, get_weights, haversine_km, pair_scores, stream_top_k,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def request_signature(candidate):
+    """影响配对得分的请求内容摘要"""
+    parts = [
+        candidate.description or '',
+        ','.join(str(tag_id) for tag_id in sorted(candidate.tag_ids)),
+        candidate.mbti or '',
+        candidate.bio or '',
+        f'{candidate.latitude},{candidate.longitude}',
+        f'{candidate.event_start},{candidate.event_end}',
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def pair_reasons(a, b):
+    """配对得分的简短理由"""
+    reasons = []
+    shared = sorted(set(a.tag_names) & set(b.tag_names))
+    if shared:
+        reasons.append(f"共同标签: {'、'.join(shared[:5])}")
+    if None not in (a.latitude, a.longitude, b.latitude, b.longitude):
+        distance = float(haversine_km(float(a.latitude), float(a.longitude), float(b.latitude), float(b.longitude)))
+        reasons.append(f"相距约 {distance:.1f}km")
+    if a.mbti and b.mbti:
+        reasons.append(f"MBTI: {a.mbti} / {b.mbti}")
+    return reasons
+
+
+def _delete_pairs(request_id):
+    from .models import RequestPairScore
+
+    RequestPairScore.objects.filter(request_a_id=request_id).delete()
+    RequestPairScore.objects.filter(request_b_id=request_id).delete()
+
+
+def delete_request_pairs(request_id):
+    """删除与请求相关的所有配对"""
+    from .models import BuddyRequest, RequestPairScore
+
+    # 配对在对方的 top-k 中时，对方第 k 名的得分会下降，阈值置 0，等对方重新打分时再精确计算
+    partners = [
+        *RequestPairScore.objects.filter(
+            request_a_id=request_id, score__gte=F('request_b__pair_threshold')
+        ).values_list('request_b_id', flat=True),
+        *RequestPairScore.objects.filter(
+            request_b_id=request_id, score__gte=F('request_a__pair_threshold')
+        ).values_list('request_a_id', flat=True),
+    ]
+    with transaction.atomic():
+        if partners:
+            BuddyRequest.objects.filter(id__in=partners).update(pair_threshold=0.0)
+        _delete_pairs(request_id)
+
+
+def _stored_scores(request_id):
+    """请求已保存的配对：{对方请求ID: 得分}"""
+    from .models import RequestPairScore
+
+    return {
+        **dict(RequestPairScore.objects.filter(request_a_id=request_id).values_list('request_b_id', 'score')),
+        **dict(RequestPairScore.objects.filter(request_b_id=request_id).values_list('request_a_id', 'score')),
+    }
+
+
+def _kth_score(scores, k):
+    """第 k 高的得分，不足 k 个时为 0"""
+    scores = sorted(scores, reverse=True)
+    return scores[k - 1] if k > 0 and len(scores) >= k else 0.0
+
+
+def _text_similarities(event_id, candidate, k):
+    from . import text_index
+
+    if not settings.MATCHING_TEXT_INDEX_ENABLED or k <= 0:
+        return {}
+    query = text_index.document_text(candidate.description, candidate.bio, candidate.tag_names)
+    return dict(text_index.search(event_id, query, k, exclude_user_id=candidate.user_id, min_score=0.0))
+
+
+def rescore_request(buddy_request, force=False):
+    """
+    将请求与活动内其余公开请求重新打分，替换与它相关的配对
+    请求不公开时删除其配对；内容摘要未变化时跳过（force=True 时强制重算）
+    :return: 写入的配对数，跳过时返回 None
+    """
+    from .models import BuddyRequest, RequestPairScore
+
+    own = load_candidates([buddy_request.id], event_id=buddy_request.event_id)
+    if not own:
+        delete_request_pairs(buddy_request.id)
+        BuddyRequest.objects.filter(pk=buddy_request.pk).update(pair_signature='', pair_threshold=0.0)
+        return 0
+    own = own[0]
+
+    signature = request_signature(own)
+    if not force:
+        current = BuddyRequest.objects.filter(pk=buddy_request.pk).values_list('pair_signature', flat=True).first()
+        if current == signature:
+            return None
+
+    # 文本相似度不对称，以本请求为查询近似代替；只取文本检索的前若干个，其余记为 0
+    text_weight = dict(zip(SIGNALS, get_weights()))['text']
+    similarities = {}
+    if text_weight:
+        similarities = _text_similarities(
+            buddy_request.event_id, own, max(settings.MATCHING_PAIR_TOP_K, settings.MATCHING_TEXT_RETRIEVAL_K)
+        )
+
+    previous = _stored_scores(buddy_request.id)
+    # 因进入对方 top-k 而保留的配对：{对方请求ID: (得分, 理由)}
+    kept = {}
+    # 需要降低的对方阈值：{对方请求ID: 新阈值}
+    lowered = {}
+
+    def score_chunk(chunk):
+        columns = CandidateColumns([own] + chunk)
+        ratings = feedback_ratings(columns.user_ids.tolist())
+        scores = pair_scores(columns, np.array([0]), ratings)[0, 1:]
+        if text_weight:
+            text = np.array([similarities.get(c.request_id, 0.0) for c in chunk])
+            scores = (1 - text_weight) * scores + text_weight * np.clip(text, 0.0, 1.0)
+
+        thresholds = dict(BuddyRequest.objects.filter(
+            id__in=[c.request_id for c in chunk]
+        ).values_list('id', 'pair_threshold'))
+        for other, score in zip(chunk, scores.tolist()):
+            threshold = thresholds.get(other.request_id, 0.0)
+            old = previous.pop(other.request_id, None)
+            # 原有配对在对方的 top-k 中（阈值是下界，得分不低于阈值即可能在其中）
+            in_other_top = old is not None and old >= threshold
+            if score < settings.MATCHING_PAIR_MIN_SCORE:
+                if in_other_top:
+                    lowered[other.request_id] = 0.0
+                continue
+            if score > threshold or in_other_top:
+                kept[other.request_id] = (score, pair_reasons(own, other))
+                if score < threshold:
+                    lowered[other.request_id] = score
+        return scores
+
+    top = stream_top_k(
+        iter_candidate_chunks(buddy_request.event_id, exclude_request_id=own.request_id, exclude_user_id=own.user_id),
+        score_chunk, settings.MATCHING_PAIR_TOP_K,
+    )
+    for other in top:
+        if other.score >= settings.MATCHING_PAIR_MIN_SCORE and other.request_id not in kept:
+            kept[other.request_id] = (other.score, pair_reasons(own, other))
+    # 剩余的原有配对，对方已不在活动的公开请求中
+    lowered.update(dict.fromkeys(previous, 0.0))
+
+    pairs = []
+    for other_id, (score, reasons) in kept.items():
+        a, b = sorted((own.request_id, other_id))
+        pairs.append(RequestPairScore(
+            event_id=buddy_request.event_id, request_a_id=a, request_b_id=b,
+            score=round(score, 6), reasons=reasons,
+        ))
+    threshold = _kth_score([pair.score for pair in pairs], settings.MATCHING_PAIR_TOP_K)
+
+    with transaction.atomic():
+        _delete_pairs(buddy_request.id)
+        RequestPairScore.objects.bulk_create(pairs, batch_size=1000, ignore_conflicts=True)
+        if lowered:
+            BuddyRequest.objects.bulk_update(
+                [BuddyRequest(id=request_id, pair_threshold=value) for request_id, value in lowered.items()],
+                ['pair_threshold'], batch_size=1000,
+            )
+        BuddyRequest.objects.filter(pk=buddy_request.pk).update(pair_signature=signature, pair_threshold=threshold)
+    logger.info(f"请求 {buddy_request.id} 配对得分已更新，保存 {len(pairs)} 个配对")
+    return len(pairs)
+
+
+def top_pairs(request_id, limit, exclude_user_ids=()):
+    """
+    按得分读取请求的 top-k 配对（两次索引查询）
+    :param exclude_user_ids: 排除这些用户的请求（见 exclusions）
+    :return: [(对方请求ID, 得分, 理由)]，得分降序
+    """
+    from .models import RequestPairScore
+
+    as_a = RequestPairScore.objects.filter(request_a_id=request_id)
+    as_b = RequestPairScore.objects.filter(request_b_id=request_id)
+    if exclude_user_ids:
+        as_a = as_a.exclude(request_b__user_id__in=exclude_user_ids)
+        as_b = as_b.exclude(request_a__user_id__in=exclude_user_ids)
+    as_a = as_a.order_by('-score').values_list('request_b_id', 'score', 'reasons')[:limit]
+    as_b = as_b.order_by('-score').values_list('request_a_id', 'score', 'reasons')[:limit]
+    return sorted([*as_a, *as_b], key=lambda row: (-row[1], row[0]))[:limit]
+
+
+@receiver(post_save, sender='matchmaking.BuddyRequest')
+def _on_request_saved(sender, instance, created, update_fields=None, **kwargs):
+    # 请求转为不公开后立即移除配对；内容变化由匹配任务重新打分
+    if not created and not instance.is_public and (not update_fields or 'is_public' in update_fields):
+        delete_request_pairs(instance.id)
+
+
+@receiver(pre_delete, sender='matchmaking.BuddyRequest')
+def _on_request_deleting(sender, instance, **kwargs):
+    # 级联删除配对前降低对方的阈值
+    delete_request_pairs(instance.id)
+
+
+@receiver(post_save, sender='profiles.UserProfile')
+def _on_profile_saved(sender, instance, **kwargs):
+    if not instance.is_primary or not settings.MATCHING_PAIR_SCORES_ENABLED:
+        return
+    from .models import BuddyRequest
+    from .tasks import rescore_request_pairs
+
+    # 档案变化影响该用户所有公开请求的得分，内容摘要未变化时任务直接跳过
+    request_ids = list(
+        BuddyRequest.objects.filter(user_id=instance.user_id, is_public=True).values_list('id', flat=True)
+    )
+
+    def enqueue():
+        for request_id in request_ids:
+            rescore_request_pairs.delay(request_id)
+
+    if request_ids:
+        transaction.on_commit(enqueue)
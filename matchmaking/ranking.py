@@ -0,0 +1,332 @@
+"""
+候选人预排序
+
+在调用LLM之前对召回的全部候选人做一次向量化打分，只把得分最高的少数候选人放入推荐提示词；
+LLM关闭或不可用时，预排序结果直接作为推荐结果。得分为以下信号的加权和（均归一化到 0-1）：
+
+- tags：标签位集合的 Jaccard 相似度
+- text：描述、简介和标签的文本向量相似度（见 text_index）
+- mbti：MBTI 兼容度矩阵（16×16，按四个维度逐项打分）
+- distance：档案地址之间的球面距离，exp(-距离/MATCHING_DISTANCE_SCALE_KM)
+- rating：收到的平均反馈评分
+
+候选人都来自发起者所在的活动，搭子请求本身没有可用时间段，活动时间窗口对所有候选人相同，
+因此不作为打分信号。
+
+缺少数据的信号（未填写MBTI、地址没有经纬度、没有评价）取中性值 0.5。
+权重通过 MATCHING_PRERANK_WEIGHTS 配置。
+"""
+import heapq
+import logging
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SIGNALS = ('tags', 'text', 'mbti', 'distance', 'rating')
+NEUTRAL = 0.5
+EARTH_RADIUS_KM = 6371.0
+
+# 与 UserProfile.MBTI_CHOICES 顺序一致
+MBTI_TYPES = [
+    'ISTJ', 'ISFJ', 'INFJ', 'INTJ', 'ISTP', 'ISFP', 'INFP', 'INTP',
+    'ESTP', 'ESFP', 'ENFP', 'ENTP', 'ESTJ', 'ESFJ', 'ENFJ', 'ENTJ',
+]
+_MBTI_INDEX = {mbti: i for i, mbti in enumerate(MBTI_TYPES)}
+_MBTI_UNKNOWN = len(MBTI_TYPES)
+
+# 每个维度 (相同时得分, 不同时得分)：
+# 内外向互补略好，感知方式相同更容易沟通，判断方式各有所长，生活节奏相同更容易约时间
+_MBTI_DIMENSION_SCORES = [(0.7, 0.8), (1.0, 0.3), (0.8, 0.6), (0.8, 0.5)]
+
+
+def _build_mbti_matrix():
+    """17×17 兼容度矩阵，最后一行/列对应未知MBTI（中性值）"""
+    letters = np.array([list(mbti) for mbti in MBTI_TYPES])
+    same = letters[:, None, :] == letters[None, :, :]
+    same_scores = np.array([s for s, _ in _MBTI_DIMENSION_SCORES])
+    diff_scores = np.array([d for _, d in _MBTI_DIMENSION_SCORES])
+    known = np.where(same, same_scores, diff_scores).mean(axis=2)
+
+    matrix = np.full((_MBTI_UNKNOWN + 1, _MBTI_UNKNOWN + 1), NEUTRAL)
+    matrix[:_MBTI_UNKNOWN, :_MBTI_UNKNOWN] = known
+    return matrix
+
+
+MBTI_COMPATIBILITY = _build_mbti_matrix()
+
+# 0-255 每个字节中1的个数，用于位集合计数
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def get_weights():
+    """归一化后的信号权重"""
+    weights = np.array([settings.MATCHING_PRERANK_WEIGHTS.get(name, 0.0) for name in SIGNALS], dtype=float)
+    total = weights.sum()
+    return weights / total if total > 0 else np.full(len(SIGNALS), 1.0 / len(SIGNALS))
+
+
+class RequesterFeatures:
+    """发起者一侧的打分特征"""
+
+    __slots__ = ('user_id', 'tag_ids', 'mbti', 'bio', 'latitude', 'longitude')
+
+    def __init__(self, user_id, tag_ids, mbti=None, latitude=None, longitude=None, bio=None):
+        self.user_id = user_id
+        self.tag_ids = set(tag_ids)
+        self.mbti = mbti
+        self.bio = bio
+        self.latitude = latitude
+        self.longitude = longitude
+
+    @classmethod
+    def for_request(cls, buddy_request, tag_ids):
+        """从搭子请求和主档案构建（一次查询）"""
+        from profiles.models import UserProfile
+
+        profile = UserProfile.objects.filter(
+            user_id=buddy_request.user_id, is_primary=True
+        ).values_list('mbti', 'address__latitude', 'address__longitude', 'bio').first()
+        mbti, latitude, longitude, bio = profile or (None, None, None, None)
+        return cls(buddy_request.user_id, tag_ids, mbti, latitude, longitude, bio)
+
+
+class CandidateColumns:
+    """候选人特征按列存放，一次遍历候选人记录得到，之后的打分全部是数组运算"""
+
+    __slots__ = (
+        'user_ids', 'tag_rows', 'tag_ids', 'similarity', 'mbti', 'latitudes', 'longitudes'
+    )
+
+    def __init__(self, candidates):
+        nan = np.nan
+        user_ids, tag_rows, tag_ids, similarity, mbti = [], [], [], [], []
+        latitudes, longitudes = [], []
+        for i, c in enumerate(candidates):
+            user_ids.append(c.user_id)
+            for tag_id, _ in c.tags:
+                if tag_id is not None:
+                    tag_rows.append(i)
+                    tag_ids.append(tag_id)
+            similarity.append(c.similarity)
+            mbti.append(_MBTI_INDEX.get(c.mbti, _MBTI_UNKNOWN))
+            latitudes.append(nan if c.latitude is None else float(c.latitude))
+            longitudes.append(nan if c.longitude is None else float(c.longitude))
+
+        self.user_ids = np.array(user_ids, dtype=np.int64)
+        self.tag_rows = np.array(tag_rows, dtype=np.intp)
+        self.tag_ids = np.array(tag_ids, dtype=np.int64)
+        self.similarity = np.array(similarity, dtype=float)
+        self.mbti = np.array(mbti, dtype=np.intp)
+        self.latitudes = np.array(latitudes, dtype=float)
+        self.longitudes = np.array(longitudes, dtype=float)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+def tag_jaccard(requester_tag_ids, n, tag_rows, tag_ids):
+    """
+    标签位集合的 Jaccard 相似度
+    :param n: 候选人数量
+    :param tag_rows, tag_ids: 每条 (候选人下标, 标签ID)
+    """
+    own_ids = np.array(sorted(requester_tag_ids), dtype=np.int64)
+    vocabulary, cols = np.unique(np.concatenate([own_ids, tag_ids]), return_inverse=True)
+    if not len(vocabulary):
+        return np.zeros(n)
+
+    # 每个候选人一行位集合（按字节打包），交集/并集的大小由按位与/或后的1的个数得出
+    dense = np.zeros((n, len(vocabulary)), dtype=bool)
+    dense[tag_rows, cols[len(own_ids):]] = True
+    bits = np.packbits(dense, axis=1)
+
+    own = np.zeros(len(vocabulary), dtype=bool)
+    own[cols[:len(own_ids)]] = True
+    own_bits = np.packbits(own)
+
+    intersection = _POPCOUNT[bits & own_bits].sum(axis=1, dtype=np.int64)
+    union = _POPCOUNT[bits | own_bits].sum(axis=1, dtype=np.int64)
+    return np.divide(intersection, union, out=np.zeros(n), where=union > 0)
+
+
+def mbti_compatibility(requester_mbti, candidate_indices):
+    """:param candidate_indices: 候选人MBTI在 MBTI_TYPES 中的下标，未知为 16"""
+    return MBTI_COMPATIBILITY[_MBTI_INDEX.get(requester_mbti, _MBTI_UNKNOWN), candidate_indices]
+
+
+def haversine_km(lat, lon, lats, lons):
+    """一点到多点的球面距离（公里），坐标缺失时为 NaN"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distance_score(requester, latitudes, longitudes):
+    if requester.latitude is None or requester.longitude is None:
+        return np.full(len(latitudes), NEUTRAL)
+    distances = haversine_km(float(requester.latitude), float(requester.longitude), latitudes, longitudes)
+    scores = np.exp(-distances / settings.MATCHING_DISTANCE_SCALE_KM)
+    return np.where(np.isnan(scores), NEUTRAL, scores)
+
+
+def feedback_ratings(user_ids):
+    """候选人收到的平均评分（从 UserReputation 一次查询），没有评价的用户不在结果中"""
+    from .models import UserReputation
+
+    return UserReputation.get_average_ratings(user_ids)
+
+
+def rating_score(ratings):
+    """1-5星映射到 0-1，没有评价为中性值"""
+    return np.where(np.isnan(ratings), NEUTRAL, (ratings - 1) / 4)
+
+
+def display_score(score):
+    """0-1 的预排序得分映射到与LLM一致的 0-10 匹配分数（5.0-9.5）"""
+    return round(5.0 + 4.5 * (score or 0.0), 1)
+
+
+def score_candidates(requester, candidates, ratings=None):
+    """
+    向量化计算候选人得分
+    :param ratings: {user_id: 平均评分}，为 None 时从数据库读取
+    :return: (总得分数组, {信号名称: 得分数组})
+    """
+    columns = candidates if isinstance(candidates, CandidateColumns) else CandidateColumns(candidates)
+    if ratings is None:
+        ratings = feedback_ratings(columns.user_ids.tolist())
+
+    signals = {
+        'tags': tag_jaccard(requester.tag_ids, len(columns), columns.tag_rows, columns.tag_ids),
+        'text': np.clip(columns.similarity, 0.0, 1.0),
+        'mbti': mbti_compatibility(requester.mbti, columns.mbti),
+        'distance': distance_score(requester, columns.latitudes, columns.longitudes),
+        'rating': rating_score(np.array(
+            [ratings.get(user_id, np.nan) for user_id in columns.user_ids.tolist()], dtype=float
+        )),
+    }
+    scores = get_weights() @ np.vstack([signals[name] for name in SIGNALS])
+    return scores, signals
+
+
+def prerank(requester, candidates, limit=None, ratings=None):
+    """
+    按预排序得分降序返回候选人（得分写入 candidate.score），得分相同按用户ID升序
+    :param limit: 返回数量，None 表示全部
+    """
+    if not candidates:
+        return []
+    columns = CandidateColumns(candidates)
+    scores, _ = score_candidates(requester, columns, ratings)
+    order = np.lexsort((columns.user_ids, -scores))
+    if limit is not None:
+        order = order[:limit]
+
+    ranked = []
+    for i in order:
+        candidate = candidates[i]
+        candidate.score = float(scores[i])
+        ranked.append(candidate)
+    logger.info(f"预排序候选人 {len(candidates)} -> {len(ranked)}")
+    return ranked
+
+
+def stream_top_k(chunks, score_chunk, k):
+    """
+    流式 top-k：逐块打分，用大小为 k 的最小堆保留得分最高的候选人，
+    内存占用只与块大小和 k 有关，与候选人总数无关
+    :param chunks: 可迭代的候选人块（[CandidateRecord]）
+    :param score_chunk: 候选人块 -> 得分数组
+    :return: 按得分降序（得分相同按用户ID、请求ID升序）的 [CandidateRecord]，得分写入 candidate.score
+    """
+    if k <= 0:
+        return []
+    heap = []
+    total = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        total += len(chunk)
+        scores = np.asarray(score_chunk(chunk), dtype=float)
+        # 块内先按完整的排序键取前 k 个，减少堆操作
+        order = np.lexsort((
+            np.fromiter((c.request_id for c in chunk), dtype=np.int64, count=len(chunk)),
+            np.fromiter((c.user_id for c in chunk), dtype=np.int64, count=len(chunk)),
+            -scores,
+        ))[:k]
+        for i in order.tolist():
+            candidate = chunk[i]
+            key = (float(scores[i]), -candidate.user_id, -candidate.request_id)
+            if len(heap) < k:
+                heapq.heappush(heap, (key, candidate))
+            elif key > heap[0][0]:
+                heapq.heapreplace(heap, (key, candidate))
+            else:
+                # 块内已有序，后面的候选人不会再进入堆
+                break
+
+    ranked = []
+    for (score, _, _), candidate in sorted(heap, key=lambda item: item[0], reverse=True):
+        candidate.score = score
+        ranked.append(candidate)
+    logger.info(f"流式 top-k 候选人 {total} -> {len(ranked)}")
+    return ranked
+
+
+def stream_prerank(requester, chunks, limit, ratings=None):
+    """
+    prerank 的流式版本，排序结果与 prerank 一致
+    只用于 bench_stream_topk 对比：请求匹配只对召回的有限候选池预排序，直接用 prerank；
+    需要扫描整个活动的配对得分表重新打分时直接使用 stream_top_k
+    :param ratings: {user_id: 平均评分}，为 None 时每块各读取一次
+    """
+    return stream_top_k(chunks, lambda chunk: score_candidates(requester, chunk, ratings)[0], limit)
+
+
+def pair_scores(columns, rows, ratings):
+    """
+    rows 中的候选人与全部候选人两两之间的对称得分（全局匹配使用）
+    没有单一的发起者，评分取双方的平均值；全局匹配不做文本检索，不使用 text 信号
+    同一用户之间的得分为 -inf
+    :param columns: 全部候选人的 CandidateColumns
+    :param rows: 行下标数组
+    :param ratings: {user_id: 平均评分}
+    :return: len(rows) × len(columns) 的得分矩阵
+    """
+    n = len(columns)
+    weights = dict(zip(SIGNALS, get_weights()))
+    weights.pop('text')
+    total = sum(weights.values()) or 1.0
+
+    # 标签：交集 = 位集合按行相乘，并集 = 两者标签数之和 - 交集
+    vocabulary, cols = np.unique(columns.tag_ids, return_inverse=True)
+    dense = np.zeros((n, len(vocabulary)), dtype=np.float32)
+    dense[columns.tag_rows, cols] = 1.0
+    counts = dense.sum(axis=1)
+    intersection = dense[rows] @ dense.T
+    union = counts[rows][:, None] + counts[None, :] - intersection
+    tags = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+    mbti = MBTI_COMPATIBILITY[columns.mbti[rows][:, None], columns.mbti[None, :]]
+
+    distances = haversine_km(
+        columns.latitudes[rows][:, None], columns.longitudes[rows][:, None],
+        columns.latitudes[None, :], columns.longitudes[None, :],
+    )
+    distance = np.exp(-distances / settings.MATCHING_DISTANCE_SCALE_KM)
+    distance = np.where(np.isnan(distance), NEUTRAL, distance)
+
+    user_ratings = rating_score(np.array(
+        [ratings.get(user_id, np.nan) for user_id in columns.user_ids.tolist()], dtype=float
+    ))
+    rating = (user_ratings[rows][:, None] + user_ratings[None, :]) / 2
+
+    scores = (
+        weights['tags'] * tags + weights['mbti'] * mbti + weights['distance'] * distance
+        + weights['rating'] * rating
+    ) / total
+    scores[columns.user_ids[rows][:, None] == columns.user_ids[None, :]] = -np.inf
+    return scores
@@ -0,0 +1,96 @@
+"""
+用户信誉汇总的维护
+
+评价新增时对 UserReputation 的总和、数量和对应星级做 F() 自增，与评价的写入在同一事务中；
+删除时做对应的自减。评分或被评价用户被修改（管理后台）时从 UserFeedback 重新统计相关用户，
+rebuild 也用于初始回填和数据修复。
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+RATINGS = range(1, 6)
+
+
+def record_rating(user_id, rating, delta=1):
+    """
+    用户收到（delta=1）或失去（delta=-1）一条评分
+    失去评分时只更新已有的汇总：删除用户时级联会先删除其 UserReputation 再删除收到的评价，
+    这时不能重新创建汇总行
+    """
+    from .models import UserReputation
+
+    column = f'rating_{rating}'
+    reputation = UserReputation.objects.filter(user_id=user_id)
+    with transaction.atomic():
+        if delta > 0:
+            UserReputation.objects.get_or_create(user_id=user_id)
+        else:
+            reputation = reputation.filter(rating_count__gte=-delta, **{f'{column}__gte': -delta})
+        reputation.update(
+            rating_sum=F('rating_sum') + delta * rating,
+            rating_count=F('rating_count') + delta,
+            updated_at=timezone.now(),
+            **{column: F(column) + delta},
+        )
+
+
+def rebuild(user_ids=None):
+    """
+    从 UserFeedback 重新统计信誉（一次聚合查询 + 批量写入）
+    :param user_ids: 只重新统计这些用户，None 表示全部
+    :return: 更新的用户数
+    """
+    from .models import UserFeedback, UserReputation
+
+    feedback = UserFeedback.objects.all()
+    if user_ids is not None:
+        feedback = feedback.filter(to_user_id__in=set(user_ids))
+    rows = feedback.values('to_user_id').annotate(
+        rating_sum=Sum('rating'),
+        rating_count=Count('id'),
+        **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in RATINGS},
+    )
+    reputations = [
+        UserReputation(
+            user_id=row['to_user_id'], rating_sum=row['rating_sum'], rating_count=row['rating_count'],
+            **{f'rating_{rating}': row[f'rating_{rating}'] for rating in RATINGS},
+        )
+        for row in rows
+    ]
+    fields = ['rating_sum', 'rating_count', *(f'rating_{rating}' for rating in RATINGS), 'updated_at']
+    with transaction.atomic():
+        stale = UserReputation.objects.all()
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=set(user_ids))
+        stale.exclude(user_id__in=[reputation.user_id for reputation in reputations]).delete()
+        UserReputation.objects.bulk_create(
+            reputations, batch_size=1000,
+            update_conflicts=True, unique_fields=['user'], update_fields=fields,
+        )
+    return len(reputations)
+
+
+@receiver(pre_save, sender='matchmaking.UserFeedback')
+def _on_feedback_saving(sender, instance, **kwargs):
+    # 记录修改前的被评价用户和评分，用于判断是否需要重新统计
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = sender.objects.filter(pk=instance.pk).values_list('to_user_id', 'rating').first()
+
+
+@receiver(post_save, sender='matchmaking.UserFeedback')
+def _on_feedback_saved(sender, instance, created, **kwargs):
+    if created:
+        record_rating(instance.to_user_id, instance.rating)
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if previous != (instance.to_user_id, instance.rating):
+        rebuild({instance.to_user_id, previous[0]} if previous else [instance.to_user_id])
+
+
+@receiver(post_delete, sender='matchmaking.UserFeedback')
+def _on_feedback_deleted(sender, instance, **kwargs):
+    record_rating(instance.to_user_id, instance.rating, delta=-1)
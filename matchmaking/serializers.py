@@ -125,16 +125,25 @@ class BuddyRequestListSerializer(serializers.ModelSerializer):
 
 class BuddyMatchSerializer(serializers.ModelSerializer):
     matched_user_name = serializers.CharField(source='matched_user.username', read_only=True)
+    # 查询时 select_related('matched_user__reputation')，不会逐条聚合评价
+    matched_user_rating = serializers.FloatField(
+        source='matched_user.reputation.average_rating', read_only=True, allow_null=True,
+        help_text='匹配用户的平均评分，没有评价时为空'
+    )
+    matched_user_feedback_count = serializers.IntegerField(
+        source='matched_user.reputation.rating_count', read_only=True, allow_null=True,
+        help_text='匹配用户收到的评价数，没有评价时为空'
+    )
     request_description = serializers.CharField(source='request.description', read_only=True)
     
     class Meta:
         model = BuddyMatch
         fields = [
             'id', 'request', 'request_description',
-            'matched_user', 'matched_user_name',
-            'status', 'matched_at', 'updated_at'
+            'matched_user', 'matched_user_name', 'matched_user_rating', 'matched_user_feedback_count',
+            'status', 'match_score', 'reasons', 'matched_at', 'updated_at'
         ]
-        read_only_fields = ['matched_at', 'updated_at']
+        read_only_fields = ['match_score', 'reasons', 'matched_at', 'updated_at']
         extra_kwargs = {
             'id': {'help_text': '匹配ID'},
             'request': {'help_text': '搭子请求ID'},
@@ -187,4 +196,10 @@ class MatchStatusSerializer(serializers.Serializer):
     message = serializers.CharField(help_text='状态消息', required=False)
     matches = BuddyMatchSerializer(many=True, help_text='匹配结果列表', required=False)
     created_at = serializers.DateTimeField(help_text='创建时间')
-    updated_at = serializers.DateTimeField(help_text='更新时间')
\ No newline at end of file
+    updated_at = serializers.DateTimeField(help_text='更新时间')
+
+class BuddyMatchCursorPageSerializer(serializers.Serializer):
+    """匹配结果游标分页的响应结构（MatchCursorPagination）"""
+    next = serializers.URLField(allow_null=True, help_text='下一页链接，没有下一页时为 null')
+    previous = serializers.URLField(allow_null=True, help_text='上一页链接，没有上一页时为 null')
+    results = BuddyMatchSerializer(many=True, help_text='当前页的匹配结果')
@@ -0,0 +1,323 @@
+"""
+按活动维护的标签倒排索引
+
+候选召回原本要加载活动下全部公开请求，再逐个比较标签。这里为每个活动维护
+标签ID -> 公开请求的倒排表（Redis set，成员为 "request_id:user_id"），
+召回时只读取发起者标签对应的倒排表并计数，复杂度与命中的倒排项数量成正比。
+
+Redis 键：
+- match:tagidx:{event_id}:t:{tag_id}  标签的倒排表
+- match:tagidx:{event_id}:untagged    没有标签的公开请求（与任何请求都可匹配）
+- match:tagidx:{event_id}:req:{request_id}  请求当前所在的倒排表标签ID，用于增量更新
+- match:tagidx:{event_id}:built       索引已构建的标记
+- match:tagidx:{event_id}:pending     构建期间修改的请求，构建完成后补写
+- match:tagidx:{event_id}:lock        构建锁
+
+索引在首次查询时从数据库构建（同一活动同时只有一个进程构建，其余查询退回数据库）；
+保存标签、请求公开状态变化或请求删除时增量更新。Redis 不可用时退回数据库查询。构建索引和数据库查询都分块流式读取活动下的请求，
+内存占用与活动规模无关。
+"""
+import heapq
+import logging
+from collections import Counter
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from utils.redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+# 索引长期不更新时自动过期，下次查询时重建；构建标记先于倒排表过期
+_INDEX_TTL = 7 * 24 * 3600
+_BUILT_TTL = _INDEX_TTL - 3600
+_BUILD_LOCK_TIMEOUT = 600
+_UNTAGGED = 'untagged'
+
+
+def _prefix(event_id):
+    return f'match:tagidx:{event_id}'
+
+
+def _posting_key(event_id, tag_id):
+    return f'{_prefix(event_id)}:t:{tag_id}'
+
+
+def _request_key(event_id, request_id):
+    return f'{_prefix(event_id)}:req:{request_id}'
+
+
+def _built_key(event_id):
+    return f'{_prefix(event_id)}:built'
+
+
+def _pending_key(event_id):
+    return f'{_prefix(event_id)}:pending'
+
+
+def _lock_key(event_id):
+    return f'{_prefix(event_id)}:lock'
+
+
+def _member(request_id, user_id):
+    return f'{request_id}:{user_id}'
+
+
+def _parse_member(member):
+    if isinstance(member, bytes):
+        member = member.decode()
+    request_id, user_id = member.split(':', 1)
+    return int(request_id), int(user_id)
+
+
+def _iter_postings(event_id, exclude_user_id=None):
+    """分块读取活动下所有公开请求的标签，每次产出 {request_id: (user_id, [tag_id, ...])}"""
+    from .candidates import iter_event_request_chunks
+    from .models import BuddyRequestTag
+
+    for chunk in iter_event_request_chunks(event_id, exclude_user_id=exclude_user_id):
+        requests = {request_id: (user_id, []) for request_id, user_id in chunk}
+        for request_id, tag_id in BuddyRequestTag.objects.filter(
+            request_id__in=requests.keys(), tag__isnull=False
+        ).values_list('request_id', 'tag_id'):
+            requests[request_id][1].append(tag_id)
+        yield requests
+
+
+def _write_request(pipe, event_id, request_id, user_id, tag_ids, old_tag_ids=()):
+    member = _member(request_id, user_id)
+    keys = [_posting_key(event_id, tag_id) for tag_id in tag_ids] or [f'{_prefix(event_id)}:{_UNTAGGED}']
+    for tag_id in set(old_tag_ids) - set(tag_ids):
+        pipe.srem(_posting_key(event_id, tag_id), member)
+    if tag_ids:
+        pipe.srem(f'{_prefix(event_id)}:{_UNTAGGED}', member)
+    for key in keys:
+        pipe.sadd(key, member)
+        pipe.expire(key, _INDEX_TTL)
+    request_key = _request_key(event_id, request_id)
+    pipe.delete(request_key)
+    pipe.rpush(request_key, user_id, *tag_ids)
+    pipe.expire(request_key, _INDEX_TTL)
+
+
+def _remove_request(pipe, event_id, request_id, user_id, old_tag_ids):
+    member = _member(request_id, user_id)
+    for tag_id in old_tag_ids:
+        pipe.srem(_posting_key(event_id, tag_id), member)
+    pipe.srem(f'{_prefix(event_id)}:{_UNTAGGED}', member)
+    pipe.delete(_request_key(event_id, request_id))
+
+
+def _refresh(r, event_id, request_ids):
+    """按数据库当前状态重写一批请求：公开请求写入，已删除、非公开或换了活动的请求移除"""
+    from .models import BuddyRequest, BuddyRequestTag
+
+    current = dict(BuddyRequest.objects.filter(
+        id__in=request_ids, event_id=event_id, is_public=True
+    ).values_list('id', 'user_id'))
+    tags = {request_id: [] for request_id in current}
+    for request_id, tag_id in BuddyRequestTag.objects.filter(
+        request_id__in=current.keys(), tag__isnull=False
+    ).values_list('request_id', 'tag_id'):
+        tags[request_id].append(tag_id)
+
+    pipe = r.pipeline()
+    for request_id in request_ids:
+        pipe.lrange(_request_key(event_id, request_id), 0, -1)
+    previous = pipe.execute()
+
+    pipe = r.pipeline()
+    for request_id, stored in zip(request_ids, previous):
+        old_tag_ids = [int(tag_id) for tag_id in stored[1:]]
+        if request_id in current:
+            _write_request(pipe, event_id, request_id, current[request_id], sorted(set(tags[request_id])), old_tag_ids)
+        elif stored:
+            _remove_request(pipe, event_id, request_id, int(stored[0]), old_tag_ids)
+    pipe.execute()
+
+
+def _build(r, event_id):
+    # 清掉失效期间残留的倒排表，否则已删除的标签或请求会留在索引中
+    keep = {_lock_key(event_id), _pending_key(event_id)}
+    stale = [key for key in r.scan_iter(match=f'{_prefix(event_id)}:*', count=1000)
+             if (key.decode() if isinstance(key, bytes) else key) not in keep]
+    for start in range(0, len(stale), 1000):
+        r.delete(*stale[start:start + 1000])
+    total = 0
+    for requests in _iter_postings(event_id):
+        pipe = r.pipeline()
+        for request_id, (user_id, tag_ids) in requests.items():
+            _write_request(pipe, event_id, request_id, user_id, tag_ids)
+        pipe.execute()
+        total += len(requests)
+    r.set(_built_key(event_id), total, ex=_BUILT_TTL)
+
+    # 补写构建期间修改的请求
+    while True:
+        pending = r.spop(_pending_key(event_id), 1000)
+        if not pending:
+            break
+        _refresh(r, event_id, [int(request_id) for request_id in pending])
+    logger.info(f"活动 {event_id} 标签倒排索引已构建，公开请求 {total} 个")
+
+
+def _ensure_built(r, event_id):
+    """索引未构建时构建；其他进程正在构建时返回 False"""
+    if r.exists(_built_key(event_id)):
+        return True
+    lock = r.lock(_lock_key(event_id), timeout=_BUILD_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        if not r.exists(_built_key(event_id)):
+            _build(r, event_id)
+    finally:
+        lock.release()
+    return True
+
+
+def _rank(counts, get_untagged, excluded, limit):
+    ranked = sorted(
+        ((request_id, overlap) for (request_id, user_id), overlap in counts.items() if user_id not in excluded),
+        key=lambda item: (-item[1], item[0]),
+    )[:limit]
+    if len(ranked) < limit:
+        # 没有标签的请求与任何请求都可匹配，重叠度记为0，只在候选不足时读取
+        ranked.extend(
+            (request_id, 0) for request_id, user_id in sorted(get_untagged())
+            if user_id not in excluded
+        )
+    return ranked[:limit]
+
+
+def _find_in_db(event_id, tag_ids, exclude_user_id, excluded, limit):
+    if limit <= 0:
+        return []
+    # 只保留重叠度最高的 limit 个请求，以及请求ID最小的 limit 个无标签请求（按请求ID升序读取）
+    top = []
+    untagged = []
+    for requests in _iter_postings(event_id, exclude_user_id=exclude_user_id):
+        for request_id, (user_id, request_tags) in requests.items():
+            if user_id in excluded:
+                continue
+            if not request_tags:
+                if len(untagged) < limit:
+                    untagged.append((request_id, user_id))
+                continue
+            overlap = len(tag_ids.intersection(request_tags))
+            if not overlap:
+                continue
+            item = (overlap, -request_id, user_id)
+            if len(top) < limit:
+                heapq.heappush(top, item)
+            elif item > top[0]:
+                heapq.heapreplace(top, item)
+    counts = {(-request_id, user_id): overlap for overlap, request_id, user_id in top}
+    return _rank(counts, lambda: untagged, excluded, limit)
+
+
+def find_candidates(event_id, tag_ids, exclude_user_id, limit, exclude_user_ids=()):
+    """
+    合并发起者各标签的倒排表，按重叠标签数排序召回候选请求
+    :param tag_ids: 发起者的规范标签ID集合
+    :param exclude_user_ids: 其他需要排除的用户（见 exclusions）
+    :return: [(request_id, overlap)]，重叠数相同时按请求ID升序
+    """
+    tag_ids = set(tag_ids)
+    excluded = {exclude_user_id, *exclude_user_ids}
+    try:
+        r = get_redis()
+        if not _ensure_built(r, event_id):
+            logger.info(f"活动 {event_id} 标签倒排索引正在构建，改为数据库查询")
+            return _find_in_db(event_id, tag_ids, exclude_user_id, excluded, limit)
+        pipe = r.pipeline()
+        for tag_id in sorted(tag_ids):
+            pipe.smembers(_posting_key(event_id, tag_id))
+        postings = pipe.execute()
+
+        counts = Counter()
+        for members in postings:
+            counts.update(_parse_member(member) for member in members)
+        return _rank(
+            counts,
+            lambda: [_parse_member(m) for m in r.smembers(f'{_prefix(event_id)}:{_UNTAGGED}')],
+            excluded,
+            limit,
+        )
+    except Exception as e:
+        logger.warning(f"标签倒排索引不可用，改为数据库查询: {e}")
+        return _find_in_db(event_id, tag_ids, exclude_user_id, excluded, limit)
+
+
+def _update(event_id, request_id, user_id, tag_ids, only_if_missing=False):
+    """
+    增量更新单个请求
+    :param tag_ids: 标签ID列表，或返回标签ID列表的函数（只在需要写入时调用）；None 表示从索引中移除
+    :param only_if_missing: 请求已在索引中时不做修改（标签未变化，只需补上公开状态）
+    """
+    try:
+        r = get_redis()
+        if not r.exists(_built_key(event_id)):
+            # 正在构建时记下请求，构建完成后补写；否则下次查询时会从数据库完整构建
+            if r.exists(_lock_key(event_id)):
+                r.sadd(_pending_key(event_id), request_id)
+                r.expire(_pending_key(event_id), _INDEX_TTL)
+            return
+        request_key = _request_key(event_id, request_id)
+        previous = r.lrange(request_key, 0, -1)
+        if only_if_missing and previous:
+            return
+        old_tag_ids = [int(tag_id) for tag_id in previous[1:]]
+        if callable(tag_ids):
+            tag_ids = tag_ids()
+        pipe = r.pipeline()
+        if tag_ids is None:
+            _remove_request(pipe, event_id, request_id, user_id, old_tag_ids)
+        else:
+            _write_request(pipe, event_id, request_id, user_id, sorted(set(tag_ids)), old_tag_ids)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"标签倒排索引更新失败，活动 {event_id} 索引将重建: {e}")
+        invalidate(event_id)
+
+
+def update_request_tags(buddy_request, tag_ids):
+    """保存请求标签后调用，更新请求在倒排表中的位置"""
+    if buddy_request.is_public:
+        _update(buddy_request.event_id, buddy_request.id, buddy_request.user_id, tag_ids)
+    else:
+        _update(buddy_request.event_id, buddy_request.id, buddy_request.user_id, None)
+
+
+def invalidate(event_id):
+    """丢弃活动的索引标记，下次查询时重建"""
+    try:
+        get_redis().delete(_built_key(event_id))
+    except Exception as e:
+        logger.warning(f"删除标签倒排索引标记失败: {e}")
+
+
+@receiver(post_save, sender='matchmaking.BuddyRequest')
+def _on_request_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created and not instance.is_public:
+        return
+    if update_fields and 'is_public' not in update_fields and 'event' not in update_fields:
+        # 只更新了任务ID等字段，倒排表不受影响
+        return
+    if not instance.is_public:
+        _update(instance.event_id, instance.id, instance.user_id, None)
+    elif created:
+        # 新请求还没有标签，保存标签时会再次更新
+        _update(instance.event_id, instance.id, instance.user_id, [])
+    else:
+        # 标签由 update_request_tags 维护，这里只补上刚变为公开的请求，已在索引中时不查询标签
+        _update(
+            instance.event_id, instance.id, instance.user_id,
+            lambda: list(instance.tags.filter(tag__isnull=False).values_list('tag_id', flat=True)),
+            only_if_missing=True,
+        )
+
+
+@receiver(post_delete, sender='matchmaking.BuddyRequest')
+def _on_request_deleted(sender, instance, **kwargs):
+    _update(instance.event_id, instance.id, instance.user_id, None)
@@ -0,0 +1,181 @@
+"""
+标签规范化
+
+LLM生成的标签是自由文本，同义写法（夜猫子/熬夜）逐字比较永远不会重叠。
+保存标签前先归一化写法，再经同义词表折叠为规范标签，每个规范标签对应 Tag 表中的整数ID，
+候选人打分和标签过滤都基于整数ID（或由ID构成的位集合）进行。
+
+同义词来源：
+1. 内置的 TAG_SYNONYMS
+2. 后台维护的 TagAlias
+"""
+import time
+import logging
+import threading
+import unicodedata
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from utils.redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+# 内置同义词：同义写法 -> 规范标签
+TAG_SYNONYMS = {
+    '熬夜': '夜猫子', '晚睡': '夜猫子', '夜猫': '夜猫子', '修仙': '夜猫子', '深夜党': '夜猫子',
+    '早睡早起': '早起', '晨型人': '早起', '早鸟': '早起',
+    '写代码': '编程', '敲代码': '编程', '程序员': '编程', 'coding': '编程', '开发': '编程',
+    '健身': '运动', '锻炼': '运动', '体育': '运动',
+    '吃饭': '约饭', '干饭': '约饭', '聚餐': '约饭', '饭搭子': '约饭',
+    'hackathon': '黑客松', '骇客松': '黑客松',
+    '小白': '新手', '入门': '新手', '萌新': '新手', '初学者': '新手',
+    '大佬': '专家', '高手': '专家', '资深': '专家',
+    '中级': '进阶',
+    'i人': '内向', '社恐': '内向',
+    'e人': '外向', '社牛': '外向',
+    '双休': '周末', '周末党': '周末',
+    '组队': '团队合作', '团队': '团队合作', '协作': '团队合作',
+    '1对1': '一对一', '单人': '一对一',
+    '小组': '小团体', '小圈子': '小团体',
+    '大型聚会': '大聚会', '派对': '大聚会',
+}
+
+_VERSION_KEY = 'match:tags:version'
+# Redis 不可用时进程内缓存的最长保留时间（秒）
+_LOCAL_TTL = 60
+
+_STRIP_CHARS = ' \t\r\n#＃【】[]「」"\'“”'
+_MAX_LENGTH = 50
+
+
+def normalize_tag(name):
+    """归一化标签写法：全角转半角、去掉括号和空白、英文小写"""
+    if not isinstance(name, str):
+        return ''
+    name = unicodedata.normalize('NFKC', name).strip(_STRIP_CHARS)
+    return ''.join(name.split()).lower()[:_MAX_LENGTH]
+
+
+_SYNONYMS = {normalize_tag(alias): canonical for alias, canonical in TAG_SYNONYMS.items()}
+
+
+def canonical_name(name):
+    """归一化后经内置同义词表折叠的标签名称，空标签返回空字符串"""
+    normalized = normalize_tag(name)
+    return _SYNONYMS.get(normalized, normalized)
+
+
+class TagDictionary:
+    """
+    进程内的 标签写法 -> (tag_id, 规范名称) 缓存
+    Tag/TagAlias 修改时递增 Redis 中的版本号，各进程在下次解析时发现版本变化后清空；
+    Redis 不可用时缓存最多保留 _LOCAL_TTL 秒
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._version = None
+        self._loaded_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loaded_at = time.monotonic()
+
+    def _check_version(self):
+        try:
+            version = int(get_redis().get(_VERSION_KEY) or 0)
+        except Exception as e:
+            logger.warning(f"读取标签版本失败: {e}")
+            version = None
+        with self._lock:
+            if version is None:
+                stale = time.monotonic() - self._loaded_at > _LOCAL_TTL
+            else:
+                stale = version != self._version
+            if stale:
+                self._entries.clear()
+                self._version = version
+                self._loaded_at = time.monotonic()
+
+    def _load(self, names):
+        from .models import Tag, TagAlias
+
+        found = {}
+        for alias, tag_id, tag_name in TagAlias.objects.filter(alias__in=names).values_list(
+            'alias', 'tag_id', 'tag__name'
+        ):
+            found[alias] = (tag_id, tag_name)
+        missing = [name for name in names if name not in found]
+        if missing:
+            for tag_id, tag_name in Tag.objects.filter(name__in=missing).values_list('id', 'name'):
+                found[tag_name] = (tag_id, tag_name)
+        return found
+
+    def resolve(self, names, create=False):
+        """
+        将标签名称解析为规范标签
+        :param names: 原始标签名称
+        :param create: 是否为不存在的规范标签创建 Tag
+        :return: 去重后的 [(tag_id, 规范名称)]，保持原顺序；create=False 时跳过未知标签
+        """
+        from .models import Tag
+
+        canonical = []
+        for name in names:
+            name = canonical_name(name)
+            if name and name not in canonical:
+                canonical.append(name)
+
+        self._check_version()
+        with self._lock:
+            missing = [name for name in canonical if name not in self._entries]
+        if missing:
+            found = self._load(missing)
+            unknown = [name for name in missing if name not in found]
+            if unknown and create:
+                Tag.objects.bulk_create([Tag(name=name) for name in unknown], ignore_conflicts=True)
+                found.update(self._load(unknown))
+            with self._lock:
+                self._entries.update(found)
+
+        resolved = []
+        seen = set()
+        with self._lock:
+            for name in canonical:
+                entry = self._entries.get(name)
+                if entry and entry[0] not in seen:
+                    seen.add(entry[0])
+                    resolved.append(entry)
+        return resolved
+
+
+_dictionary = TagDictionary()
+
+
+def resolve_tags(names, create=True):
+    """将标签名称解析为 [(tag_id, 规范名称)]，默认创建不存在的规范标签"""
+    return _dictionary.resolve(names, create=create)
+
+
+def tag_ids(names):
+    """已知标签名称对应的规范标签ID集合，不创建新标签"""
+    return {tag_id for tag_id, _ in _dictionary.resolve(names, create=False)}
+
+
+def _bump_version():
+    try:
+        get_redis().incr(_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"更新标签版本失败: {e}")
+
+
+@receiver([post_save, post_delete], sender='matchmaking.Tag')
+@receiver([post_save, post_delete], sender='matchmaking.TagAlias')
+def _clear_tag_cache(**kwargs):
+    _dictionary.clear()
+    # 提交后再通知其他进程，否则它们可能在提交前按新版本重新读到旧的同义词
+    transaction.on_commit(_bump_version)
@@ -1,3 +1,1243 @@
-from django.test import TestCase
+import json
+from contextlib import ExitStack
+from fnmatch import fnmatch
+from io import StringIO
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from authentication.models import Address
+from events.models import Event
+from profiles.models import UserProfile
+from ai.management.commands.llm_stub_server import TAG_POOL, build_stub_reply
+from ai.metrics import llm_stage, record_llm_call
+from utils.json_utils import extract_json
+from .models import (
+    BuddyMatch, BuddyRequest, BuddyRequestTag, MatchExclusion, RequestPairScore, Tag, TagAlias, UserFeedback,
+    UserReputation,
+)
+from .candidates import CandidateRecord
+from .tagging import TagDictionary, canonical_name, normalize_tag, resolve_tags
+from .global_matching import greedy_assignment, match_event
+from . import batching, dispatch, exclusions, pair_table, prompts, ranking, tag_index, tagging, tasks, text_index
+
+User = get_user_model()
+
+TAGS = ['夜猫子', '编程', '黑客松']
+
+
+class FakeRedis:
+    """
+    内存中的 Redis 替身，只实现调度、排除、批处理和文本索引用到的命令
+    过期时间按自己的时钟计算：BLPOP 在列表为空时不阻塞，而是把时钟推进 timeout 秒
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.now = 0.0
+
+    def _alive(self, key):
+        if key in self.expires and self.expires[key] <= self.now:
+            self.data.pop(key, None)
+            del self.expires[key]
+        return key in self.data
+
+    def get(self, key):
+        return self.data.get(key) if self._alive(key) else None
+
+    def exists(self, key):
+        return int(self._alive(key))
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and self._alive(key):
+            return None
+        self.data[key] = str(value)
+        self.expires.pop(key, None)
+        if ex is not None:
+            self.expires[key] = self.now + ex
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def expire(self, key, seconds):
+        if self._alive(key):
+            self.expires[key] = self.now + seconds
+
+    def incr(self, key, amount=1):
+        self.data[key] = str(int(self.get(key) or 0) + amount)
+        return int(self.data[key])
+
+    def decr(self, key):
+        return self.incr(key, -1)
+
+    def scan_iter(self, match='*', count=None):
+        return [key for key in list(self.data) if self._alive(key) and fnmatch(key, match)]
+
+    def lock(self, name, timeout=None, **kwargs):
+        return _FakeLock(self, name, timeout)
+
+    def eval(self, script, numkeys, key, value, *args):
+        # 只用于"持有者才能续期/删除"的脚本
+        if self.get(key) != value:
+            return 0
+        if 'expire' in script:
+            self.expire(key, int(args[0]))
+        else:
+            self.delete(key)
+        return 1
+
+    def _container(self, key, factory):
+        self._alive(key)
+        return self.data.setdefault(key, factory())
+
+    def _list(self, key):
+        return self._container(key, list)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        mapping = dict(mapping or {}, **({} if field is None else {field: value}))
+        self._container(key, dict).update((str(k), str(v)) for k, v in mapping.items())
+
+    def hincrby(self, key, field, amount=1):
+        fields = self._container(key, dict)
+        fields[str(field)] = str(int(fields.get(str(field), 0)) + amount)
+        return int(fields[str(field)])
+
+    def hmget(self, key, fields):
+        values = self.data.get(key, {}) if self._alive(key) else {}
+        return [values.get(str(field)) for field in fields]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {})) if self._alive(key) else {}
+
+    def zadd(self, key, mapping):
+        self._container(key, dict).update((str(member), float(score)) for member, score in mapping.items())
+
+    def zrem(self, key, *members):
+        scores = self._container(key, dict)
+        for member in members:
+            scores.pop(str(member), None)
+
+    def zrevrange(self, key, start, end, withscores=False):
+        items = sorted(self._container(key, dict).items(), key=lambda item: (item[1], item[0]), reverse=True)
+        items = items[start:None if end == -1 else end + 1]
+        return items if withscores else [member for member, _ in items]
+
+    def sadd(self, key, *members):
+        self._container(key, set).update(str(member) for member in members)
+
+    def smembers(self, key):
+        return set(self.data.get(key, ())) if self._alive(key) else set()
+
+    def spop(self, key, count=1):
+        members = self._container(key, set)
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+    def rpush(self, key, *values):
+        self._list(key).extend(str(value) for value in values)
+
+    def lpop(self, key):
+        items = self._list(key)
+        return items.pop(0) if items else None
+
+    def blpop(self, key, timeout=0):
+        items = self._list(key)
+        if items:
+            return key, items.pop(0)
+        self.now += timeout
+        return None
+
+    def llen(self, key):
+        return len(self._list(key))
+
+    def lindex(self, key, index):
+        items = self._list(key)
+        return items[index] if -len(items) <= index < len(items) else None
+
+    def lrange(self, key, start, end):
+        items = self._list(key)
+        return items[start:None if end == -1 else end + 1]
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.lrange(key, start, end)
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakeLock:
+    def __init__(self, redis, name, timeout):
+        self.redis = redis
+        self.name = name
+        self.timeout = timeout
+
+    def acquire(self, blocking=True):
+        return bool(self.redis.set(self.name, 'locked', nx=True, ex=self.timeout))
+
+    def release(self):
+        self.redis.delete(self.name)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+def _fake_llm_response(system_content, user_content, temperature=0.7, stage=None):
+    if stage == 'profile_summary':
+        return json.dumps({"user_traits": ["夜猫子"], "social_style": "内向", "profile_points": []})
+    if stage == 'profile_summary_and_tag':
+        return json.dumps({"user_traits": ["夜猫子"], "social_style": "内向", "profile_points": [], "tags": TAGS},
+                          ensure_ascii=False)
+    if stage == 'integrate':
+        return json.dumps({"user_traits": ["夜猫子"], "key_points": []}, ensure_ascii=False)
+    if stage == 'integrate_and_tag':
+        return json.dumps({"user_traits": ["夜猫子"], "key_points": [], "tags": TAGS}, ensure_ascii=False)
+    if stage == 'tags':
+        return json.dumps(TAGS, ensure_ascii=False)
+    if stage == 'recommend':
+        # 推荐数量固定，匹配记录的创建不影响候选人加载的查询数
+        lines = [json.loads(line) for line in user_content.splitlines() if line.startswith('{')]
+        user_ids = [info['user_id'] for info in lines if 'user_id' in info]
+        return json.dumps([{"user_id": user_id, "match_score": 8.0, "reasons": ["共同标签"]}
+                           for user_id in user_ids[:2]])
+    raise AssertionError(f"unexpected stage {stage}")
+
+
+class ExtractJsonTest(SimpleTestCase):
+    def test_stray_brace_in_prose_before_json(self):
+        self.assertEqual(extract_json('He said "hi {" then {"a": 1}'), {'a': 1})
+        self.assertEqual(extract_json('see {oops, then ```json\n["编程"]\n```', expected_type=list), ['编程'])
+
+    def test_truncated_string_is_dropped(self):
+        details = {}
+        self.assertEqual(extract_json('{"tags": ["早起", "夜猫', details=details), {'tags': ['早起']})
+        self.assertEqual(details['method'], 'truncated')
+        self.assertEqual(extract_json('["编程", "夜猫'), ['编程'])
+        self.assertEqual(extract_json('{"a": 1, "b": "xy'), {'a': 1})
+
+    def test_trailing_commas_and_failure(self):
+        self.assertEqual(extract_json('结果：{"a": [1, 2,],}'), {'a': [1, 2]})
+        with self.assertRaises(json.JSONDecodeError):
+            extract_json('没有JSON')
+
+
+@override_settings(
+    MATCHING_PROFILE_SUMMARY_ENABLED=True,
+    MATCHING_BATCH_ENABLED=False,
+    LLM_RATE_LIMIT_ENABLED=False,
+)
+class MatchingQueryCountTest(TestCase):
+    """匹配任务的查询数不随候选人数量增长"""
+
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        cls.creator = User.objects.create_user(username='creator', email='creator@example.com', password='x')
+        start = timezone.now() + timedelta(days=1)
+        cls.event = Event.objects.create(
+            name='黑客松', start_time=start, end_time=start + timedelta(hours=8),
+            location=address, creator=cls.creator
+        )
+        cls.tag_ids = [tag_id for tag_id, _ in resolve_tags(TAGS)]
+        cls.address = address
+
+    def _create_request(self, username, is_public=True):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='x')
+        profile = UserProfile.objects.create(user=user, name=username, mbti='INTP', bio='喜欢写代码',
+                                             address=self.address)
+        request = BuddyRequest.objects.create(user=user, profile=profile, event=self.event,
+                                              description='找人一起组队', is_public=is_public)
+        return request
+
+    def _create_candidates(self, count, offset=0):
+        for i in range(offset, offset + count):
+            request = self._create_request(f'candidate{i}')
+            BuddyRequestTag.objects.bulk_create([
+                BuddyRequestTag(request=request, tag_id=tag_id, tag_name=name)
+                for tag_id, name in zip(self.tag_ids, TAGS)
+            ])
+
+    def _patched(self, llm_response):
+        stack = ExitStack()
+        stack.enter_context(mock.patch.object(tasks, 'get_llm_response', side_effect=llm_response))
+        stack.enter_context(mock.patch.object(tasks.process_buddy_request_matching, 'update_state'))
+        stack.enter_context(mock.patch.object(tasks.send_buddy_match_notification, 'delay'))
+        for module in ('tag_index', 'text_index', 'dispatch', 'exclusions'):
+            stack.enter_context(mock.patch(f'matchmaking.{module}.get_redis', side_effect=ConnectionError))
+        return stack
+
+    def _run_matching(self, request, stages=None, recommend=None, expected_matches=2, llm_response=None):
+        def fake_llm_response(*args, stage=None, **kwargs):
+            if stages is not None:
+                stages.append(stage)
+            with llm_stage(stage):
+                record_llm_call('model', wall_ms=10.0, prompt_tokens=100, completion_tokens=20)
+            if stage == 'recommend' and recommend is not None:
+                return json.dumps(recommend)
+            return (llm_response or _fake_llm_response)(*args, stage=stage, **kwargs)
+
+        with self._patched(fake_llm_response), CaptureQueriesContext(connection) as queries:
+            result = tasks.process_buddy_request_matching(request.id)
+        self.assertEqual(result['status'], 'success')
+        if expected_matches is not None:
+            self.assertEqual(result['matches_count'], expected_matches)
+        self.result = result
+        return len(queries)
+
+    def test_query_count_independent_of_candidate_count(self):
+        self._create_candidates(3)
+        baseline = self._run_matching(self._create_request('requester1'))
+
+        self._create_candidates(12, offset=3)
+        self.assertEqual(self._run_matching(self._create_request('requester2')), baseline)
+
+    def test_recommendations_outside_the_candidates_are_dropped(self):
+        self._create_candidates(2)
+        request = self._create_request('requester1')
+        rejected = self._create_request('rejected')
+        BuddyRequestTag.objects.bulk_create([
+            BuddyRequestTag(request=rejected, tag_id=tag_id, tag_name=name) for tag_id, name in zip(self.tag_ids, TAGS)
+        ])
+        MatchExclusion.objects.create(user_a_id=min(request.user_id, rejected.user_id),
+                                      user_b_id=max(request.user_id, rejected.user_id))
+        candidate = BuddyRequest.objects.get(user__username='candidate0')
+        # LLM 返回了被排除的用户和不在候选中的真实用户
+        self._run_matching(request, recommend=[
+            {'user_id': rejected.user_id, 'match_score': 9},
+            {'user_id': self.creator.id, 'match_score': 9},
+            {'user_id': candidate.user_id, 'match_score': 8},
+        ], expected_matches=1)
+        self.assertEqual(list(BuddyMatch.objects.filter(request=request).values_list('matched_user_id', flat=True)),
+                         [candidate.user_id])
+
+    @override_settings(MATCHING_PAIR_SCORES_ENABLED=True)
+    def test_pair_table_feeds_the_tag_recall_and_prerank(self):
+        self._create_candidates(3)
+        request = self._create_request('requester1')
+        with mock.patch('matchmaking.tag_index.find_candidates', wraps=tag_index.find_candidates) as recall, \
+                mock.patch('matchmaking.ranking.prerank', wraps=ranking.prerank) as ranked:
+            self._run_matching(request)
+        recall.assert_called_once()
+        ranked.assert_called_once()
+
+    @override_settings(MATCHING_FUSED_INTEGRATE_TAGS=True, MATCHING_LLM_RECOMMEND_ENABLED=True)
+    def test_summary_miss_generates_tags_in_the_same_call(self):
+        self._create_candidates(3)
+        request = self._create_request('requester1')
+
+        stages = []
+        self._run_matching(request, stages)
+        self.assertEqual(stages, ['profile_summary_and_tag', 'recommend'])
+        summary = UserProfile.objects.get(pk=request.profile_id).integrated_summary
+        self.assertIsNotNone(summary)
+        self.assertNotIn('tags', summary)
+
+        # 档案未修改：摘要命中缓存，只单独生成标签
+        second = BuddyRequest.objects.create(user=request.user, profile=request.profile, event=self.event,
+                                             description='再找一个人', is_public=True)
+        stages = []
+        self._run_matching(second, stages)
+        self.assertEqual(stages, ['tags', 'recommend'])
+
+    @override_settings(MATCHING_LLM_RECOMMEND_ENABLED=True)
+    def test_task_result_carries_llm_metrics(self):
+        self._create_candidates(3)
+        self._run_matching(self._create_request('requester1'))
+        metrics = self.result['llm_metrics']
+        self.assertEqual(set(metrics['stages']), {'profile_summary_and_tag', 'recommend'})
+        self.assertEqual((metrics['calls'], metrics['prompt_tokens']), (2, 200))
+        self.assertEqual(metrics['stages']['recommend']['calls'], 1)
+
+    @override_settings(MATCHING_LLM_RECOMMEND_ENABLED=True)
+    def test_stub_server_recognises_every_stage(self):
+        # 模拟服务随机生成标签，候选人带上全部标签才能保证被召回
+        self._create_candidates(3)
+        stub_tags = resolve_tags(TAG_POOL)
+        BuddyRequestTag.objects.bulk_create([
+            BuddyRequestTag(request=request, tag_id=tag_id, tag_name=name)
+            for request in BuddyRequest.objects.filter(user__username__startswith='candidate')
+            for tag_id, name in stub_tags
+        ], ignore_conflicts=True)
+        replies = []
+
+        def stub_response(system_content, user_content, temperature=0.7, stage=None):
+            prompt_type, content = build_stub_reply(system_content, user_content)
+            replies.append((stage, prompt_type))
+            return content
+
+        flows = [(True, True), (True, False), (False, True), (False, False)]
+        for summary, fused in flows:
+            with override_settings(MATCHING_PROFILE_SUMMARY_ENABLED=summary, MATCHING_FUSED_INTEGRATE_TAGS=fused):
+                self._run_matching(self._create_request(f'requester_{summary}_{fused}'), expected_matches=None,
+                                   llm_response=stub_response)
+                self.assertGreater(self.result['matches_count'], 0)
+
+        entries = [
+            {'request_id': self._create_request(f'batch{i}').id, 'integrated_info': {'user_traits': ['夜猫子']},
+             'tags': TAGS}
+            for i in range(2)
+        ]
+        with self._patched(stub_response):
+            results = batching.run_batch(entries)
+        for entry in entries:
+            recommendations = results[entry['request_id']]['recommendations']
+            self.assertTrue(recommendations)
+            self.assertLessEqual({rec['user_id'] for rec in recommendations},
+                                 set(results[entry['request_id']]['allowed']))
+
+        self.assertEqual({stage for stage, _ in replies}, {
+            'profile_summary_and_tag', 'profile_summary', 'tags', 'integrate_and_tag', 'integrate', 'recommend',
+            'batch_recommend',
+        })
+        self.assertEqual([stage for stage, prompt_type in replies if stage != prompt_type], [])
+
+    @override_settings(MATCHING_PROFILE_SUMMARY_ENABLED=False, MATCHING_LLM_RECOMMEND_ENABLED=True)
+    def test_fused_integration_without_profile_summary(self):
+        self._create_candidates(3)
+        for fused, expected in ((True, ['integrate_and_tag', 'recommend']),
+                                (False, ['integrate', 'tags', 'recommend'])):
+            with self.subTest(fused=fused), override_settings(MATCHING_FUSED_INTEGRATE_TAGS=fused):
+                request = self._create_request(f'requester_{fused}')
+                stages = []
+                self._run_matching(request, stages)
+                self.assertEqual(stages, expected)
+                self.assertEqual(sorted(BuddyRequestTag.objects.filter(request=request)
+                                        .values_list('tag_name', flat=True)), sorted(TAGS))
+
+
+class UserReputationTest(TestCase):
+    """评价增删时信誉汇总保持一致"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='x')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='x')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com', password='x')
+
+    def test_feedback_updates_aggregates(self):
+        UserFeedback.objects.create(from_user=self.alice, to_user=self.bob, rating=5)
+        feedback = UserFeedback.objects.create(from_user=self.carol, to_user=self.bob, rating=2)
+        reputation = UserReputation.objects.get(user=self.bob)
+        self.assertEqual((reputation.rating_sum, reputation.rating_count, reputation.rating_2), (7, 2, 1))
+
+        feedback.delete()
+        reputation.refresh_from_db()
+        self.assertEqual((reputation.rating_sum, reputation.rating_count, reputation.rating_2), (5, 1, 0))
+
+    def test_delete_user_with_received_feedback(self):
+        UserFeedback.objects.create(from_user=self.alice, to_user=self.bob, rating=4)
+        UserFeedback.objects.create(from_user=self.bob, to_user=self.carol, rating=3)
+
+        self.bob.delete()
+
+        self.assertFalse(UserReputation.objects.filter(user_id=self.bob.id).exists())
+        reputation = UserReputation.objects.get(user=self.carol)
+        self.assertEqual((reputation.rating_sum, reputation.rating_count), (0, 0))
+
+
+@override_settings(MATCHING_TEXT_INDEX_ENABLED=False, MATCHING_PAIR_MIN_SCORE=0.0)
+class RequestPairScoreTest(TestCase):
+    """逐个请求增量打分后，每个请求仍保存着自己真正的 top-k 配对"""
+
+    TAG_POOL = ['夜猫子', '编程', '黑客松', '摄影', '徒步', '咖啡', '桌游', '音乐']
+    MBTI = ['INTP', 'ENFP', 'ISTJ', 'ESFJ', 'INTJ', 'ENTP', 'ISFP', 'ESTP']
+
+    @classmethod
+    def setUpTestData(cls):
+        creator = User.objects.create_user(username='creator', email='creator@example.com', password='x')
+        cls.address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        start = timezone.now() + timedelta(days=1)
+        cls.event = Event.objects.create(
+            name='黑客松', start_time=start, end_time=start + timedelta(hours=8), location=cls.address, creator=creator
+        )
+        cls.tags = {name: Tag.objects.get_or_create(name=name)[0].id for name in cls.TAG_POOL}
+
+    def _create_request(self, i):
+        user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+        profile = UserProfile.objects.create(user=user, name=f'user{i}', mbti=self.MBTI[i % len(self.MBTI)],
+                                             bio='', address=self.address)
+        request = BuddyRequest.objects.create(user=user, profile=profile, event=self.event,
+                                              description='找人一起组队', is_public=True)
+        names = [name for bit, name in enumerate(self.TAG_POOL) if (i * 37 + 11) >> bit & 1]
+        BuddyRequestTag.objects.bulk_create([
+            BuddyRequestTag(request=request, tag_id=self.tags[name], tag_name=name) for name in names
+        ])
+        return request
+
+    def _stored(self):
+        stored = {}
+        for a, b, score in RequestPairScore.objects.values_list('request_a_id', 'request_b_id', 'score'):
+            stored.setdefault(a, {})[b] = score
+            stored.setdefault(b, {})[a] = score
+        return stored
+
+    def _rescore(self, request):
+        request.refresh_from_db()
+        pair_table.rescore_request(request, force=True)
+
+    def test_incremental_rescoring_keeps_top_k_of_both_sides(self):
+        requests = [self._create_request(i) for i in range(8)]
+        with override_settings(MATCHING_PAIR_TOP_K=100):
+            for request in requests:
+                self._rescore(request)
+        truth = self._stored()
+        RequestPairScore.objects.all().delete()
+        BuddyRequest.objects.update(pair_threshold=0.0)
+
+        k = 2
+        with override_settings(MATCHING_PAIR_TOP_K=k):
+            # 请求依次加入，只为新请求打分；之后再为前几个请求重新打分
+            for request in requests:
+                self._rescore(request)
+            for request in requests[:3]:
+                self._rescore(request)
+        stored = self._stored()
+
+        for request in requests:
+            expected = sorted(truth[request.id].values(), reverse=True)[:k]
+            actual = sorted(stored.get(request.id, {}).values(), reverse=True)[:k]
+            self.assertEqual(actual, expected, f'request {request.id}')
+
+    def test_deleting_partner_resets_threshold(self):
+        requests = [self._create_request(i) for i in range(4)]
+        with override_settings(MATCHING_PAIR_TOP_K=1):
+            for request in requests:
+                self._rescore(request)
+            best = max(self._stored()[requests[0].id].items(), key=lambda item: item[1])[0]
+            BuddyRequest.objects.get(pk=best).delete()
+
+        requests[0].refresh_from_db()
+        self.assertEqual(requests[0].pair_threshold, 0.0)
+
+
+class CreateMatchRecordsTest(TestCase):
+    """匹配记录批量创建，每次只发一封汇总通知，重复推荐不重复计数"""
+
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        cls.requester = User.objects.create_user(username='requester', email='requester@example.com', password='x')
+        start = timezone.now() + timedelta(days=1)
+        event = Event.objects.create(name='黑客松', start_time=start, end_time=start + timedelta(hours=8),
+                                     location=address, creator=cls.requester)
+        cls.request = BuddyRequest.objects.create(user=cls.requester, event=event, description='找人组队',
+                                                  is_public=True)
+        cls.users = [
+            User.objects.create_user(username=f'buddy{i}', email=f'buddy{i}@example.com', password='x')
+            for i in range(3)
+        ]
+
+    def _create(self, recommendations):
+        with mock.patch.object(tasks.send_buddy_match_notification, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            allowed = {user.id for user in self.users} | {self.requester.id, 999999}
+            created = tasks._create_match_records(self.request, recommendations, allowed)
+        return created, delay
+
+    def test_bulk_create_and_grouped_notification(self):
+        recommendations = [
+            {'user_id': self.users[0].id, 'match_score': 9, 'reasons': ['共同标签']},
+            {'user_id': self.users[1].id, 'match_score': 7},
+            {'user_id': self.users[0].id, 'match_score': 5},
+            {'user_id': self.requester.id, 'match_score': 10},
+            {'user_id': 'abc'},
+            {'user_id': 999999},
+        ]
+        created, delay = self._create(recommendations)
+
+        self.assertEqual([match.matched_user_id for match in created], [self.users[0].id, self.users[1].id])
+        self.assertTrue(all(match.pk for match in created))
+        self.assertEqual(created[0].reasons, ['共同标签'])
+        delay.assert_called_once()
+        email, details = delay.call_args.args
+        self.assertEqual(email, 'requester@example.com')
+        self.assertIn('2 位搭子', details)
+        self.assertIn('buddy0', details)
+        self.assertIn('buddy1', details)
+
+    def test_users_outside_the_candidates_are_ignored(self):
+        with mock.patch.object(tasks.send_buddy_match_notification, 'delay'):
+            created = tasks._create_match_records(self.request, [
+                {'user_id': self.users[0].id}, {'user_id': self.users[1].id},
+            ], allowed_user_ids={self.users[1].id})
+        self.assertEqual([match.matched_user_id for match in created], [self.users[1].id])
+
+    def test_rerun_does_not_double_count(self):
+        self._create([{'user_id': self.users[0].id, 'match_score': 8}])
+
+        created, delay = self._create([
+            {'user_id': self.users[0].id, 'match_score': 8},
+            {'user_id': self.users[2].id, 'match_score': 6},
+        ])
+        self.assertEqual([match.matched_user_id for match in created], [self.users[2].id])
+        delay.assert_called_once()
+        self.assertIn('1 位搭子', delay.call_args.args[1])
+
+        created, delay = self._create([{'user_id': self.users[0].id}, {'user_id': self.users[2].id}])
+        self.assertEqual(created, [])
+        delay.assert_not_called()
+        self.assertEqual(BuddyMatch.objects.filter(request=self.request).count(), 2)
+
+
+class TaggingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        user = User.objects.create_user(username='requester', email='requester@example.com', password='x')
+        profile = UserProfile.objects.create(user=user, name='requester', address=address)
+        start = timezone.now() + timedelta(days=1)
+        event = Event.objects.create(name='黑客松', start_time=start, end_time=start + timedelta(hours=8),
+                                     location=address, creator=user)
+        cls.request = BuddyRequest.objects.create(user=user, profile=profile, event=event,
+                                                  description='找人一起组队', is_public=True)
+
+    def setUp(self):
+        for target in ('matchmaking.tagging.get_redis', 'matchmaking.tag_index.get_redis',
+                       'matchmaking.text_index.get_redis'):
+            patcher = mock.patch(target, side_effect=ConnectionError)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # 其他测试缓存的标签ID可能已随事务回滚失效
+        tagging._dictionary.clear()
+
+    def test_normalize_folds_width_case_and_brackets(self):
+        self.assertEqual(normalize_tag(' ＃Coding '), 'coding')
+        self.assertEqual(normalize_tag('【夜猫 子】'), '夜猫子')
+        self.assertEqual(normalize_tag('ＨＡＣＫＡＴＨＯＮ'), 'hackathon')
+        self.assertEqual(normalize_tag(None), '')
+
+    def test_synonyms_fold_to_the_canonical_tag(self):
+        self.assertEqual(canonical_name('熬夜'), '夜猫子')
+        self.assertEqual(canonical_name('  HackAthon '), '黑客松')
+        self.assertEqual(canonical_name('I人'), '内向')
+        self.assertEqual(canonical_name('攀岩'), '攀岩')
+
+    def test_dictionary_resolves_aliases_and_dedupes(self):
+        sport = Tag.objects.create(name='运动')
+        TagAlias.objects.create(alias='跑步', tag=sport)
+        dictionary = TagDictionary()
+        self.assertEqual(dictionary.resolve(['跑步', '健身', '运动', '攀岩']), [(sport.id, '运动')])
+        resolved = dictionary.resolve(['攀岩', 'Coding'], create=True)
+        self.assertEqual([name for _, name in resolved], ['攀岩', '编程'])
+        self.assertEqual(set(Tag.objects.filter(name__in=['攀岩', '编程']).values_list('id', flat=True)),
+                         {tag_id for tag_id, _ in resolved})
+
+    def test_backfill_links_legacy_rows_and_merges_synonyms(self):
+        BuddyRequestTag.objects.bulk_create([
+            BuddyRequestTag(request=self.request, tag_name=name) for name in ('熬夜', '夜猫子', 'Coding', '#')
+        ])
+        call_command('backfill_tags', '--dry-run', stdout=StringIO())
+        self.assertEqual(BuddyRequestTag.objects.filter(request=self.request, tag__isnull=True).count(), 4)
+
+        output = StringIO()
+        call_command('backfill_tags', stdout=output)
+        rows = BuddyRequestTag.objects.filter(request=self.request).select_related('tag')
+        self.assertEqual(sorted((row.tag_name, row.tag.name) for row in rows),
+                         [('夜猫子', '夜猫子'), ('编程', '编程')])
+        self.assertIn('合并重复 2', output.getvalue())
+
+
+class TextIndexTest(TestCase):
+    DESCRIPTIONS = ['周末一起去爬山徒步看日出', '找人一起写代码参加黑客松', '一起去爬山露营', '喜欢摄影想找人一起扫街拍照',
+                    '黑客松组队写前端代码', '看电影', '喝咖啡聊天', '打羽毛球', '桌游之夜', '听音乐会', '学做饭']
+
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        creator = User.objects.create_user(username='creator', email='creator@example.com', password='x')
+        start = timezone.now() + timedelta(days=1)
+        cls.event = Event.objects.create(name='黑客松', start_time=start, end_time=start + timedelta(hours=8),
+                                         location=address, creator=creator)
+        cls.requests = []
+        for i, description in enumerate(cls.DESCRIPTIONS):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+            profile = UserProfile.objects.create(user=user, name=f'user{i}', bio='', address=address)
+            cls.requests.append(BuddyRequest.objects.create(user=user, profile=profile, event=cls.event,
+                                                            description=description, is_public=True))
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patchers = [mock.patch('matchmaking.text_index.get_redis', return_value=self.redis)] + [
+            mock.patch(target, side_effect=ConnectionError)
+            for target in ('matchmaking.tag_index.get_redis', 'matchmaking.dispatch.get_redis')
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _search(self, text, k=5, **kwargs):
+        return [request_id for request_id, _ in text_index.search(self.event.id, text, k, min_score=0.0, **kwargs)]
+
+    def _index_state(self):
+        prefix = f'match:textidx:{self.event.id}'
+        df = {dim: count for dim, count in self.redis.hgetall(f'{prefix}:df').items() if int(count)}
+        return df, self.redis.get(f'{prefix}:count')
+
+    def test_search_ranks_similar_descriptions_first(self):
+        climbing = {self.requests[0].id, self.requests[2].id}
+        self.assertEqual(set(self._search('想去爬山', k=2)), climbing)
+        excluded = self._search('想去爬山', exclude_user_id=self.requests[2].user_id)
+        self.assertNotIn(self.requests[2].id, excluded)
+        self.assertEqual(excluded[0], self.requests[0].id)
+
+    def test_updates_and_deletes_match_a_full_rebuild(self):
+        self._search('想去爬山')
+        changed, private, deleted = self.requests[3], self.requests[0], self.requests[1]
+        changed.description = '爬山爬山徒步'
+        changed.save()
+        private.is_public = False
+        private.save(update_fields=['is_public'])
+        deleted.delete()
+
+        results = self._search('想去爬山')
+        self.assertIn(changed.id, results[:2])
+        self.assertNotIn(private.id, results)
+        self.assertNotIn(deleted.id, results)
+
+        incremental = self._index_state()
+        text_index.invalidate(self.event.id)
+        self._search('任意')
+        self.assertEqual(self._index_state(), incremental)
+        self.assertEqual(incremental[1], str(len(self.DESCRIPTIONS) - 2))
+
+    def test_update_during_a_build_is_deferred(self):
+        lock = self.redis.lock(f'match:textidx:{self.event.id}:lock', timeout=600)
+        lock.acquire()
+        # 其他进程正在构建：跳过文本召回，修改记入待补写集合
+        self.assertEqual(self._search('露营爬山'), [])
+        updated = self.requests[4]
+        updated.description = '露营爬山'
+        updated.save()
+        self.assertEqual(self.redis.smembers(f'match:textidx:{self.event.id}:pending'), {str(updated.id)})
+        lock.release()
+        self.assertEqual(self._search('露营爬山')[0], updated.id)
+
+    def test_redis_unavailable_skips_text_recall(self):
+        with mock.patch('matchmaking.text_index.get_redis', side_effect=ConnectionError):
+            self.assertEqual(self._search('想去爬山'), [])
+
+
+class TagIndexSignalTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        user = User.objects.create_user(username='requester', email='requester@example.com', password='x')
+        profile = UserProfile.objects.create(user=user, name='requester', address=address)
+        start = timezone.now() + timedelta(days=1)
+        event = Event.objects.create(name='黑客松', start_time=start, end_time=start + timedelta(hours=8),
+                                     location=address, creator=user)
+        cls.request = BuddyRequest.objects.create(user=user, profile=profile, event=event,
+                                                  description='找人一起组队', is_public=True)
+
+    def test_saving_an_indexed_request_does_not_query_tags(self):
+        redis = mock.MagicMock()
+        redis.exists.return_value = True
+        redis.lrange.return_value = [str(self.request.user_id), '1']
+        with mock.patch('matchmaking.tag_index.get_redis', return_value=redis), \
+                CaptureQueriesContext(connection) as queries:
+            tag_index._on_request_saved(BuddyRequest, self.request, created=False)
+        self.assertEqual(len(queries), 0)
+        redis.pipeline.assert_not_called()
+
+    def test_update_during_a_build_is_deferred(self):
+        redis = mock.MagicMock()
+        # 索引未构建，但另一个进程持有构建锁
+        redis.exists.side_effect = lambda key: key.endswith(':lock')
+        with mock.patch('matchmaking.tag_index.get_redis', return_value=redis):
+            tag_index.update_request_tags(self.request, [1])
+        redis.sadd.assert_called_once_with(f'match:tagidx:{self.request.event_id}:pending', self.request.id)
+        redis.pipeline.assert_not_called()
+
+
+class DispatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        user = User.objects.create_user(username='requester', email='requester@example.com', password='x')
+        profile = UserProfile.objects.create(user=user, name='requester', address=address)
+        start = timezone.now() + timedelta(days=1)
+        event = Event.objects.create(name='黑客松', start_time=start, end_time=start + timedelta(hours=8),
+                                     location=address, creator=user)
+        cls.request = BuddyRequest.objects.create(user=user, profile=profile, event=event,
+                                                  description='找人一起组队', is_public=True)
+
+    def _patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self._patch('matchmaking.dispatch.get_redis', return_value=self.redis)
+        self.revoke = self._patch('matchmaking.dispatch._revoke')
+        self.apply_async = self._patch('matchmaking.tasks.process_buddy_request_matching.apply_async')
+        # 旧任务尚未执行完
+        self._patch('celery.result.AsyncResult').return_value.ready.return_value = False
+
+    @override_settings(MATCHING_DISPATCH_DEBOUNCE_SECONDS=3)
+    def test_repeated_trigger_reuses_the_pending_task(self):
+        first = dispatch.dispatch_matching(self.request)
+        self.assertEqual(dispatch.dispatch_matching(self.request), first)
+        self.apply_async.assert_called_once()
+        self.assertEqual(self.apply_async.call_args.kwargs['countdown'], 3)
+        self.assertEqual(self.apply_async.call_args.kwargs['task_id'], first)
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.celery_task_id, first)
+
+    def test_changed_content_supersedes_and_revokes_the_old_task(self):
+        first = dispatch.dispatch_matching(self.request)
+        self.request.description = '找人一起爬山'
+        second = dispatch.dispatch_matching(self.request)
+        self.assertNotEqual(first, second)
+        self.revoke.assert_called_once_with(first)
+        self.assertFalse(dispatch.is_latest(self.request.id, first))
+        self.assertTrue(dispatch.is_latest(self.request.id, second))
+        with self.assertRaises(dispatch.MatchingSuperseded):
+            dispatch.check_latest(self.request.id, first)
+
+    def test_unchanged_content_is_not_dispatched(self):
+        BuddyRequest.objects.filter(pk=self.request.pk).update(
+            matching_signature=dispatch.matching_signature(self.request)
+        )
+        self.request.refresh_from_db()
+        self.assertIsNone(dispatch.dispatch_matching(self.request))
+        self.apply_async.assert_not_called()
+        # 强制匹配时忽略内容摘要
+        self.assertIsNotNone(dispatch.dispatch_matching(self.request, force=True))
+
+    def test_visibility_change_is_dispatched(self):
+        BuddyRequest.objects.filter(pk=self.request.pk).update(
+            matching_signature=dispatch.matching_signature(self.request)
+        )
+        self.request.refresh_from_db()
+        self.request.is_public = False
+        self.assertIsNotNone(dispatch.dispatch_matching(self.request))
+        self.apply_async.assert_called_once()
+
+    def test_superseded_task_exits_before_running(self):
+        dispatch.dispatch_matching(self.request)
+        with mock.patch.object(tasks, 'get_llm_response') as llm:
+            result = tasks.process_buddy_request_matching.apply(args=[self.request.id], task_id='stale').result
+        self.assertEqual(result['status'], 'superseded')
+        llm.assert_not_called()
+
+    def test_run_lock_is_held_by_one_task(self):
+        self.assertTrue(dispatch.acquire_run(self.request.id, 'a'))
+        self.assertFalse(dispatch.acquire_run(self.request.id, 'b'))
+        dispatch.release_run(self.request.id, 'b')
+        self.assertFalse(dispatch.acquire_run(self.request.id, 'b'))
+        dispatch.release_run(self.request.id, 'a')
+        self.assertTrue(dispatch.acquire_run(self.request.id, 'b'))
+
+
+class ExclusionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+                     for i in range(3)]
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        for patcher in (mock.patch('matchmaking.exclusions.get_redis', return_value=self.redis),
+                        mock.patch.object(exclusions, '_cached', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_bloom_miss_skips_the_database(self):
+        a, b, c = self.users
+        with self.captureOnCommitCallbacks(execute=True):
+            exclusions.exclude_pairs([(a.id, b.id)])
+        self.assertEqual(exclusions.paired_exclusions(a.id), {b.id})
+        # 过滤器已按当前版本构建，没有排除记录的用户不再查询数据库
+        with self.assertNumQueries(0):
+            self.assertEqual(exclusions.paired_exclusions(c.id), set())
+        with self.assertNumQueries(1):
+            self.assertEqual(exclusions.paired_exclusions(b.id), {a.id})
+
+    def test_new_exclusion_rebuilds_the_filter(self):
+        a, b, c = self.users
+        self.assertEqual(exclusions.paired_exclusions(c.id), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            exclusions.exclude_pairs([(c.id, a.id), (a.id, a.id)])
+        self.assertEqual(exclusions.paired_exclusions(c.id), {a.id})
+        self.assertEqual(MatchExclusion.objects.count(), 1)
+
+    def test_redis_down_always_queries_the_database(self):
+        a, b, c = self.users
+        MatchExclusion.objects.create(user_a=b, user_b=c)
+        with mock.patch('matchmaking.exclusions.get_redis', side_effect=ConnectionError):
+            with self.assertNumQueries(1):
+                self.assertEqual(exclusions.paired_exclusions(c.id), {b.id})
+
+
+class MatchPaginationTest(TestCase):
+    SCORES = [7.0, 9.5, 7.0, 3.0, 9.5, 7.0, 0.0]
+
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        cls.user = User.objects.create_user(username='requester', email='requester@example.com', password='x')
+        profile = UserProfile.objects.create(user=cls.user, name='requester', address=address)
+        start = timezone.now() + timedelta(days=1)
+        event = Event.objects.create(name='黑客松', start_time=start, end_time=start + timedelta(hours=8),
+                                     location=address, creator=cls.user)
+        cls.request = BuddyRequest.objects.create(user=cls.user, profile=profile, event=event,
+                                                  description='找人一起组队', is_public=True)
+        BuddyMatch.objects.bulk_create([
+            BuddyMatch(request=cls.request, match_score=score,
+                       matched_user=User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com',
+                                                             password='x'))
+            for i, score in enumerate(cls.SCORES)
+        ])
+
+    def test_cursor_pages_follow_score_order_without_gaps(self):
+        self.client.force_login(self.user)
+        url = reverse('buddy-request-matches', args=[self.request.id]) + '?page_size=3'
+        seen = []
+        page_queries = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page_queries.append(len(queries))
+            seen.extend(match['id'] for match in response.json()['results'])
+            url = response.json()['next']
+
+        expected = list(BuddyMatch.objects.filter(request=self.request).order_by('-match_score', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(page_queries), 3)
+        # 翻页深度不影响查询数
+        self.assertEqual(len(set(page_queries)), 1)
+
+    def test_schema_declares_the_cursor_envelope(self):
+        from drf_spectacular.generators import SchemaGenerator
+
+        schema = SchemaGenerator().get_schema(request=None, public=True)
+        operation = schema['paths']['/api/requests/{id}/matches/']['get']
+        response = operation['responses']['200']['content']['application/json']['schema']
+        self.assertEqual(response['$ref'], '#/components/schemas/BuddyMatchCursorPage')
+        self.assertEqual(set(schema['components']['schemas']['BuddyMatchCursorPage']['properties']),
+                         {'next', 'previous', 'results'})
+        self.assertLessEqual({'cursor', 'page_size'}, {p['name'] for p in operation['parameters']})
+
+
+class PromptsTest(SimpleTestCase):
+    def _request(self, description='找人一起组队'):
+        event = SimpleNamespace(name='黑客松', start_time='2026-10-18 09:00', end_time='2026-10-18 18:00',
+                                location='北京市海淀区')
+        user = SimpleNamespace(username='requester')
+        return SimpleNamespace(event=event, user=user, description=description)
+
+    def _profile(self):
+        return SimpleNamespace(name='requester', mbti='INTP', bio='喜欢写代码', contact_info='微信 secret-id',
+                               get_location_display=lambda: '北京市海淀区')
+
+    def test_system_prompts_are_byte_identical_across_calls(self):
+        candidates = [{'user_id': 1, 'tags': ['编程']}]
+        with mock.patch('matchmaking.prompts.timezone.now', return_value=timezone.now()):
+            first = prompts.build_recommend_prompt({'user_traits': ['夜猫子']}, candidates)
+        with mock.patch('matchmaking.prompts.timezone.now', return_value=timezone.now() + timedelta(hours=1)):
+            second = prompts.build_recommend_prompt({'user_traits': ['早起']}, candidates * 2)
+        self.assertEqual(first[0], second[0])
+        self.assertNotEqual(first[1], second[1])
+        tags = [prompts.build_tags_prompt({}, self._request(description))[0] for description in ('爬山', '组队')]
+        self.assertEqual(tags[0], tags[1])
+        # 时间戳只出现在用户输入中，系统提示词可被服务商前缀缓存
+        self.assertNotIn('当前时间', first[0] + tags[0])
+
+    def test_fit_candidates_respects_the_token_budget(self):
+        candidates = [{'user_id': i, 'description': '喜欢写代码' * 4} for i in range(10)]
+        cost = prompts.estimate_tokens(prompts.compact_json(candidates[0])) + 1
+        self.assertEqual(prompts.fit_candidates(candidates, 100, budget=100 + cost * 3, max_candidates=10), 3)
+        self.assertEqual(prompts.fit_candidates(candidates, 100, budget=100 + cost * 3 - 1, max_candidates=10), 2)
+        self.assertEqual(prompts.fit_candidates(candidates, 100, budget=10 ** 6, max_candidates=4), 4)
+        # 预算不足时至少放入一个候选人
+        self.assertEqual(prompts.fit_candidates(candidates, 100, budget=50, max_candidates=10), 1)
+
+    def test_contact_info_is_not_sent_to_the_llm(self):
+        _, user_content = prompts.build_integrate_prompt(self._request(), self._profile(), with_tags=True)
+        self.assertIn('喜欢写代码', user_content)
+        self.assertNotIn('secret-id', user_content)
+
+
+class PrerankTest(SimpleTestCase):
+    def _candidate(self, user_id, tag_ids=(), mbti=None, latitude=None, longitude=None):
+        return CandidateRecord(
+            request_id=user_id, user_id=user_id, username=f'user{user_id}', event_name='黑客松',
+            event_start=None, event_end=None, description='',
+            tags=tuple((tag_id, str(tag_id)) for tag_id in tag_ids),
+            mbti=mbti, latitude=latitude, longitude=longitude,
+        )
+
+    def test_mbti_matrix_is_symmetric_with_neutral_unknown(self):
+        matrix = ranking.MBTI_COMPATIBILITY
+        self.assertTrue((matrix == matrix.T).all())
+        self.assertTrue((matrix[-1] == ranking.NEUTRAL).all())
+        self.assertTrue(((matrix >= 0) & (matrix <= 1)).all())
+
+    def test_haversine(self):
+        # 北京 -> 上海约 1068 公里
+        distance = ranking.haversine_km(39.9042, 116.4074, [31.2304], [121.4737])[0]
+        self.assertAlmostEqual(distance, 1068, delta=5)
+        self.assertEqual(ranking.haversine_km(10, 20, [10], [20])[0], 0)
+
+    @override_settings(MATCHING_PRERANK_WEIGHTS={'tags': 3, 'distance': 1})
+    def test_weights_and_ordering(self):
+        requester = ranking.RequesterFeatures(user_id=1, tag_ids={1, 2}, latitude=39.9, longitude=116.4)
+        candidates = [
+            self._candidate(5, tag_ids=[3], latitude=39.9, longitude=116.4),
+            self._candidate(4, tag_ids=[1, 2], latitude=31.2, longitude=121.5),
+            self._candidate(3, tag_ids=[1, 2], latitude=39.9, longitude=116.4),
+            self._candidate(2, tag_ids=[1, 2], latitude=39.9, longitude=116.4),
+        ]
+        ranked = ranking.prerank(requester, candidates, ratings={})
+        # 标签和距离都相同的候选人按用户ID升序；标签权重高于距离
+        self.assertEqual([c.user_id for c in ranked], [2, 3, 4, 5])
+        self.assertAlmostEqual(ranked[0].score, 1.0)
+        self.assertAlmostEqual(ranked[2].score, 0.75, places=3)
+        self.assertAlmostEqual(ranked[3].score, 0.25)
+        self.assertEqual([c.user_id for c in ranking.prerank(requester, candidates, limit=2, ratings={})], [2, 3])
+
+    @override_settings(MATCHING_PRERANK_WEIGHTS={'mbti': 1})
+    def test_missing_data_is_neutral(self):
+        requester = ranking.RequesterFeatures(user_id=1, tag_ids=(), mbti=None)
+        ranked = ranking.prerank(requester, [self._candidate(2, mbti='INTP')], ratings={})
+        self.assertEqual(ranked[0].score, ranking.NEUTRAL)
+
+    def test_stream_top_k_matches_prerank(self):
+        rng = np.random.default_rng(7)
+        mbti = ranking.MBTI_TYPES + [None]
+
+        def candidates():
+            # 只有少量标签组合、MBTI 和坐标，制造大量同分；顺序打乱
+            return [
+                self._candidate(user_id, tag_ids=[1, 2] if user_id % 3 else [2, 3], mbti=mbti[user_id % 5],
+                                latitude=30 + user_id % 4, longitude=120.0)
+                for user_id in rng.permutation(np.arange(1, 101)).tolist()
+            ]
+
+        requester = ranking.RequesterFeatures(user_id=0, tag_ids={1, 2}, mbti='INTP', latitude=31, longitude=120)
+        for k in (1, 10, 100, 150):
+            with self.subTest(k=k):
+                pool = candidates()
+                expected = ranking.prerank(requester, list(pool), limit=k, ratings={})
+                chunks = [pool[i:i + 7] for i in range(0, len(pool), 7)]
+                streamed = ranking.stream_prerank(requester, chunks, k, ratings={})
+                self.assertEqual([c.user_id for c in streamed], [c.user_id for c in expected])
+                self.assertEqual([c.score for c in streamed], [c.score for c in expected])
+
+
+@override_settings(
+    MATCHING_BATCH_WINDOW_MS=0,
+    MATCHING_BATCH_MAX_SIZE=10,
+    MATCHING_BATCH_LEADER_LEASE=15,
+    MATCHING_BATCH_LEADER_MAX_BATCHES=3,
+    MATCHING_BATCH_RESULT_TIMEOUT=180,
+)
+class BatchingTest(SimpleTestCase):
+    EVENT_ID = 1
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('matchmaking.batching.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _request(self, request_id):
+        return SimpleNamespace(id=request_id, event_id=self.EVENT_ID)
+
+    def _queue(self, *request_ids):
+        self.redis.rpush(batching._queue_key(self.EVENT_ID), *(
+            json.dumps({'request_id': request_id, 'integrated_info': {}, 'tags': []}) for request_id in request_ids
+        ))
+
+    @staticmethod
+    def _results(entries):
+        return {entry['request_id']: {'recommendations': [{'user_id': entry['request_id'] * 10}],
+                                      'allowed': [entry['request_id'] * 10]}
+                for entry in entries}
+
+    def _run_batch(self):
+        return mock.patch('matchmaking.batching.run_batch', side_effect=self._results)
+
+    def _batched_ids(self, run):
+        return [[entry['request_id'] for entry in call.args[0]] for call in run.call_args_list]
+
+    def test_leader_runs_queued_requests_in_one_batch(self):
+        self._queue(2, 3)
+        with self._run_batch() as run:
+            result = batching._submit_and_wait(self._request(1), {}, [])
+        self.assertEqual(self._batched_ids(run), [[2, 3, 1]])
+        self.assertEqual(result, {'recommendations': [{'user_id': 10}], 'allowed': [10]})
+        self.assertEqual(json.loads(self.redis.lpop(batching._result_key(3)))['allowed'], [30])
+        self.assertIsNone(self.redis.get(batching._leader_key(self.EVENT_ID)))
+
+    @override_settings(MATCHING_BATCH_MAX_SIZE=1, MATCHING_BATCH_LEADER_MAX_BATCHES=2)
+    def test_leader_hands_off_after_max_batches(self):
+        self._queue(2, 3, 4)
+        self.redis.set(batching._leader_key(self.EVENT_ID), 'leader')
+        with self._run_batch() as run:
+            batching._drain_batches(self.redis, self.EVENT_ID, 0, 'leader')
+        self.assertEqual(self._batched_ids(run), [[2], [3]])
+        self.assertIsNone(self.redis.get(batching._leader_key(self.EVENT_ID)))
+        self.assertEqual(self.redis.lrange(batching._result_key(4), 0, -1), [batching._HANDOFF])
+
+    def test_follower_leads_when_handed_off(self):
+        leader_key = batching._leader_key(self.EVENT_ID)
+        self.redis.set(leader_key, 'leader', ex=15)
+        blpop = self.redis.blpop
+
+        def handed_off(key, timeout=0):
+            # 旧 leader 释放租约并通知本请求接任
+            if self.redis.get(leader_key) == 'leader':
+                self.redis.delete(leader_key)
+                return key, batching._HANDOFF
+            return blpop(key, timeout)
+
+        with mock.patch.object(self.redis, 'blpop', side_effect=handed_off), self._run_batch() as run:
+            result = batching._submit_and_wait(self._request(5), {}, [])
+        self.assertEqual(self._batched_ids(run), [[5]])
+        self.assertEqual(result['allowed'], [50])
+        self.assertEqual(self.redis.now, 0)
+
+    def test_crashed_leader_is_taken_over_after_the_lease(self):
+        self.redis.set(batching._leader_key(self.EVENT_ID), 'crashed', ex=15)
+        with self._run_batch() as run:
+            result = batching._submit_and_wait(self._request(1), {}, [])
+        self.assertEqual(self._batched_ids(run), [[1]])
+        self.assertEqual(result['allowed'], [10])
+        # 只等待了一个租约周期，而不是整个结果超时
+        self.assertEqual(self.redis.now, 15)
+
+    @override_settings(MATCHING_LLM_RECOMMEND_ENABLED=True)
+    def test_failed_batch_falls_back_to_single_recommendation(self):
+        single = ([{'user_id': 7}], frozenset({7}))
+        with mock.patch('matchmaking.batching.run_batch', side_effect=RuntimeError('llm down')), \
+                mock.patch('ai.resilience.llm_available', return_value=True), \
+                mock.patch('matchmaking.tasks._find_and_recommend_matches', return_value=single) as fallback:
+            self.assertEqual(batching.recommend_with_batching(self._request(1), {}, []), single)
+        fallback.assert_called_once()
+
+
+class GreedyAssignmentTest(SimpleTestCase):
+    """带容量的贪心分配"""
+
+    def test_respects_capacity_in_score_order(self):
+        edges = [(0.9, 0, 1), (0.8, 0, 2), (0.7, 0, 3), (0.6, 1, 2)]
+        self.assertEqual(greedy_assignment(edges, [2, 1, 1, 1]), [(0, 1, 0.9), (0, 2, 0.8)])
+
+    def test_skips_matched_pairs(self):
+        edges = [(0.9, 0, 1), (0.5, 0, 2)]
+        self.assertEqual(greedy_assignment(edges, [1, 1, 1], matched_pairs={(0, 1)}), [(0, 2, 0.5)])
+
+    def test_owners_prevent_self_pairs_and_duplicate_users(self):
+        # 节点 1、2 属于同一用户
+        edges = [(0.9, 1, 2), (0.8, 0, 1), (0.7, 0, 2), (0.6, 2, 3)]
+        self.assertEqual(
+            greedy_assignment(edges, [2, 2, 2, 2], owners=['a', 'b', 'b', 'c']),
+            [(0, 1, 0.8), (2, 3, 0.6)],
+        )
+
+
+@override_settings(MATCHING_GLOBAL_TOP_K=20)
+class GlobalMatchingTest(TestCase):
+    """活动级全局匹配：名额、已有匹配、同一用户和互相排除的用户对"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.address = Address.objects.create(province='北京市', city='北京市', district='海淀区')
+        creator = User.objects.create_user(username='creator', email='creator@example.com', password='x')
+        start = timezone.now() + timedelta(days=1)
+        cls.event = Event.objects.create(name='黑客松', start_time=start, end_time=start + timedelta(hours=8),
+                                         location=cls.address, creator=creator)
+        cls.users = {
+            name: User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ['alice', 'bob', 'carol', 'dave']
+        }
+        cls.requests = {}
+        for key, name in [('alice1', 'alice'), ('alice2', 'alice'), ('bob', 'bob'), ('carol', 'carol'),
+                          ('dave', 'dave')]:
+            cls.requests[key] = BuddyRequest.objects.create(
+                user=cls.users[name], event=cls.event, description='找人组队', is_public=True
+            )
+
+    def _matches(self):
+        return set(BuddyMatch.objects.filter(request__event=self.event).values_list('request_id', 'matched_user_id'))
+
+    def test_assignment_constraints(self):
+        bob, carol = self.users['bob'], self.users['carol']
+        MatchExclusion.objects.create(user_a_id=min(bob.id, carol.id), user_b_id=max(bob.id, carol.id))
+        BuddyMatch.objects.create(request=self.requests['dave'], matched_user=bob, status='pending')
+
+        stats = match_event(self.event.id, capacity=2, min_score=0.0)
+        matches = self._matches()
+        owners = {request.id: request.user_id for request in self.requests.values()}
+
+        self.assertEqual(stats['matches_created'], len(matches) - 1)
+        self.assertFalse(any(owners[request_id] == user_id for request_id, user_id in matches))
+        self.assertNotIn((self.requests['bob'].id, carol.id), matches)
+        self.assertNotIn((self.requests['carol'].id, bob.id), matches)
+        for request in self.requests.values():
+            self.assertLessEqual(sum(1 for request_id, _ in matches if request_id == request.id), 2)
+        # dave 已有一条匹配，只剩一个名额，且不会再与 bob 匹配
+        dave_matches = [user_id for request_id, user_id in matches if request_id == self.requests['dave'].id]
+        self.assertLessEqual(len(dave_matches), 2)
+        self.assertEqual(dave_matches.count(bob.id), 1)
+
+        self.assertEqual(match_event(self.event.id, capacity=2, min_score=0.0)['matches_created'], 0)
+        self.assertEqual(self._matches(), matches)
+
+    @override_settings(MATCHING_STREAM_CHUNK_SIZE=2)
+    def test_chunked_loading_and_one_notification_per_request(self):
+        with mock.patch.object(tasks.send_buddy_match_notification, 'delay') as notify:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                stats = match_event(self.event.id, capacity=2, min_score=0.0)
+                # 提交前不发送
+                notify.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(stats['requests'], len(self.requests))
+
+        matched = {}
+        for request_id, user_id in self._matches():
+            matched.setdefault(request_id, []).append(user_id)
+        requests = {request.id: request for request in self.requests.values()}
+        usernames = {user.id: user.username for user in self.users.values()}
+        expected = sorted((requests[request_id].user.email, sorted(usernames[user_id] for user_id in user_ids))
+                          for request_id, user_ids in matched.items())
+        # 通知内容："我们为您找到了 N 位搭子：a、b，活动：..."
+        sent = sorted((email, sorted(details.split('：', 1)[1].split('，')[0].split('、')))
+                      for (email, details), _ in notify.call_args_list)
+        self.assertEqual(sent, expected)
+        self.assertEqual(stats['notifications'], len(matched))
+
+        with mock.patch.object(tasks.send_buddy_match_notification, 'delay') as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                match_event(self.event.id, capacity=2, min_score=0.0)
+        notify.assert_not_called()
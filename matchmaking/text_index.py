@@ -0,0 +1,374 @@
+"""
+按活动维护的文本向量索引
+
+标签倒排索引只能召回与发起者有共同标签的请求，描述语义相近但标签不同的候选人会被漏掉。
+这里把每个公开请求的描述、发起人主档案简介和已生成的标签拼成一篇文档，
+按字符 1-gram/2-gram 哈希到固定维度后计算 TF-IDF 向量（L2 归一化），
+不需要分词服务也能处理中文。检索时只使用查询中权重最高的若干维度、跳过过于常见的维度，
+在倒排表上累加余弦相似度后取 top-k，是近似结果。
+
+索引保存在 Redis 中由所有进程共享，请求、标签或档案简介修改时只更新对应请求的文档：
+- match:textidx:{event_id}:p:{dim}           维度的倒排表（zset，成员为 "request_id:user_id"，分值为文档向量在该维度的权重）
+- match:textidx:{event_id}:df                维度 -> 文档频率
+- match:textidx:{event_id}:count             文档数
+- match:textidx:{event_id}:doc:{request_id}  [用户ID, 写入倒排表的维度数, 维度...]，用于增量更新
+- match:textidx:{event_id}:built             索引已构建的标记
+- match:textidx:{event_id}:pending           构建期间修改的请求，构建完成后补写
+- match:textidx:{event_id}:lock              构建锁
+
+文档向量的 IDF 按写入时的文档频率计算，其他文档不随之改写；索引过期后完整重建。
+每篇文档只把权重最高的 MATCHING_TEXT_DOC_TERMS 个维度写入倒排表，
+检索时每个维度只读取权重最高的 MATCHING_TEXT_POSTINGS_LIMIT 个文档，读取量和内存占用与活动规模无关。
+Redis 不可用时跳过文本召回。
+"""
+import re
+import zlib
+import logging
+import unicodedata
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from utils.redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+_DIMENSIONS = 1 << 18
+_WORD_RE = re.compile(r'\w+')
+# 出现在超过该比例文档中的维度区分度太低，检索时跳过
+_MAX_DF_RATIO = 0.5
+# 索引长期不更新时自动过期，下次查询时重建；构建标记先于倒排表过期
+_INDEX_TTL = 7 * 24 * 3600
+_BUILT_TTL = _INDEX_TTL - 3600
+_BUILD_LOCK_TIMEOUT = 600
+
+
+def _grams(text):
+    """归一化后的字符 1-gram 和 2-gram（只在连续的文字/数字片段内取）"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    for run in _WORD_RE.findall(text):
+        yield from run
+        for i in range(len(run) - 1):
+            yield run[i:i + 2]
+
+
+def hash_features(text):
+    """文本 -> {维度: 词频}，用 crc32 保证不同进程的哈希结果一致"""
+    return Counter(zlib.crc32(gram.encode('utf-8')) & (_DIMENSIONS - 1) for gram in _grams(text))
+
+
+def document_text(description, bio, tag_names):
+    return '\n'.join(filter(None, [description, bio, ' '.join(tag_names)]))
+
+
+def _prefix(event_id):
+    return f'match:textidx:{event_id}'
+
+
+def _posting_key(event_id, dim):
+    return f'{_prefix(event_id)}:p:{dim}'
+
+
+def _doc_key(event_id, request_id):
+    return f'{_prefix(event_id)}:doc:{request_id}'
+
+
+def _member(request_id, user_id):
+    return f'{request_id}:{user_id}'
+
+
+def _parse_member(member):
+    if isinstance(member, bytes):
+        member = member.decode()
+    request_id, user_id = member.split(':', 1)
+    return int(request_id), int(user_id)
+
+
+def _idf(df, count):
+    return np.log((1 + count) / (1 + np.asarray(df, dtype=float))) + 1
+
+
+def _document_vector(features, df, count):
+    """
+    文档的 TF-IDF 向量（L2 归一化）
+    :param df: 与 features 的维度一一对应的文档频率
+    :return: [(维度, 权重)]，按权重降序
+    """
+    dims = list(features)
+    weights = (1 + np.log(np.fromiter(features.values(), dtype=float, count=len(features)))) * _idf(df, count)
+    weights /= np.sqrt((weights * weights).sum()) or 1.0
+    order = np.argsort(-weights, kind='stable')
+    return [(dims[i], float(weights[i])) for i in order.tolist()]
+
+
+def _load_documents(event_id, request_ids):
+    """
+    读取请求的文档（请求、标签、主档案简介各一次查询），只包含活动下仍然公开的请求
+    :return: [(request_id, user_id, text)]
+    """
+    from profiles.models import UserProfile
+    from .models import BuddyRequest, BuddyRequestTag
+
+    requests = list(
+        BuddyRequest.objects.filter(id__in=request_ids, event_id=event_id, is_public=True)
+        .order_by('id').values_list('id', 'user_id', 'description')
+    )
+    if not requests:
+        return []
+    tags = {}
+    for request_id, tag_name in BuddyRequestTag.objects.filter(
+        request_id__in=[request_id for request_id, _, _ in requests]
+    ).values_list('request_id', 'tag_name'):
+        tags.setdefault(request_id, []).append(tag_name)
+    bios = dict(
+        UserProfile.objects.filter(
+            user_id__in={user_id for _, user_id, _ in requests}, is_primary=True
+        ).values_list('user_id', 'bio')
+    )
+    return [
+        (request_id, user_id, document_text(description, bios.get(user_id), tags.get(request_id, [])))
+        for request_id, user_id, description in requests
+    ]
+
+
+def _iter_documents(event_id):
+    """分块读取活动下所有公开请求的文档"""
+    from .candidates import iter_event_request_chunks
+
+    for chunk in iter_event_request_chunks(event_id):
+        yield _load_documents(event_id, [request_id for request_id, _ in chunk])
+
+
+def _write_document(pipe, event_id, request_id, user_id, vector):
+    member = _member(request_id, user_id)
+    posted = vector[:settings.MATCHING_TEXT_DOC_TERMS]
+    for dim, weight in posted:
+        key = _posting_key(event_id, dim)
+        pipe.zadd(key, {member: weight})
+        pipe.expire(key, _INDEX_TTL)
+    doc_key = _doc_key(event_id, request_id)
+    pipe.delete(doc_key)
+    pipe.rpush(doc_key, user_id, len(posted), *(dim for dim, _ in vector))
+    pipe.expire(doc_key, _INDEX_TTL)
+
+
+def _remove_document(pipe, event_id, request_id, previous):
+    """:param previous: 文档记录 [用户ID, 写入倒排表的维度数, 维度...]"""
+    user_id, posted, dims = int(previous[0]), int(previous[1]), [int(dim) for dim in previous[2:]]
+    member = _member(request_id, user_id)
+    for dim in dims[:posted]:
+        pipe.zrem(_posting_key(event_id, dim), member)
+    for dim in dims:
+        pipe.hincrby(f'{_prefix(event_id)}:df', dim, -1)
+    pipe.decr(f'{_prefix(event_id)}:count')
+    pipe.delete(_doc_key(event_id, request_id))
+
+
+def _refresh(r, event_id, request_ids):
+    """重新写入请求的文档，请求已不公开或不在该活动时从索引中移除"""
+    request_ids = list(request_ids)
+    documents = {request_id: (user_id, hash_features(text))
+                 for request_id, user_id, text in _load_documents(event_id, request_ids)}
+
+    pipe = r.pipeline()
+    for request_id in request_ids:
+        pipe.lrange(_doc_key(event_id, request_id), 0, -1)
+    previous = pipe.execute()
+
+    pipe = r.pipeline()
+    for request_id, record in zip(request_ids, previous):
+        if record:
+            _remove_document(pipe, event_id, request_id, record)
+    for _, features in documents.values():
+        for dim in features:
+            pipe.hincrby(f'{_prefix(event_id)}:df', dim, 1)
+        pipe.incr(f'{_prefix(event_id)}:count')
+    pipe.execute()
+    if not documents:
+        return
+
+    dims = sorted({dim for _, features in documents.values() for dim in features})
+    pipe = r.pipeline()
+    pipe.get(f'{_prefix(event_id)}:count')
+    pipe.hmget(f'{_prefix(event_id)}:df', dims)
+    count, dfs = pipe.execute()
+    df = dict(zip(dims, (int(value or 0) for value in dfs)))
+
+    pipe = r.pipeline()
+    for request_id, (user_id, features) in documents.items():
+        vector = _document_vector(features, [df[dim] for dim in features], int(count or 0))
+        _write_document(pipe, event_id, request_id, user_id, vector)
+    pipe.execute()
+
+
+def _build(r, event_id):
+    # 第一遍统计文档频率（按维度计数，内存与活动规模无关），第二遍写入文档向量
+    df = np.zeros(_DIMENSIONS, dtype=np.int64)
+    count = 0
+    for documents in _iter_documents(event_id):
+        for _, _, text in documents:
+            df[list(hash_features(text))] += 1
+            count += 1
+
+    # 清掉失效期间残留的倒排表；构建锁和构建期间记录的修改保留
+    keep = {f'{_prefix(event_id)}:lock', f'{_prefix(event_id)}:pending'}
+    stale = [key for key in r.scan_iter(match=f'{_prefix(event_id)}:*', count=1000)
+             if (key.decode() if isinstance(key, bytes) else key) not in keep]
+    for start in range(0, len(stale), 1000):
+        r.delete(*stale[start:start + 1000])
+
+    dims = np.flatnonzero(df)
+    for start in range(0, len(dims), 10000):
+        batch = dims[start:start + 10000]
+        r.hset(f'{_prefix(event_id)}:df', mapping=dict(zip(batch.tolist(), df[batch].tolist())))
+    r.expire(f'{_prefix(event_id)}:df', _INDEX_TTL)
+    r.set(f'{_prefix(event_id)}:count', count, ex=_INDEX_TTL)
+
+    for documents in _iter_documents(event_id):
+        pipe = r.pipeline()
+        for request_id, user_id, text in documents:
+            features = hash_features(text)
+            vector = _document_vector(features, df[list(features)], count)
+            _write_document(pipe, event_id, request_id, user_id, vector)
+        pipe.execute()
+    r.set(f'{_prefix(event_id)}:built', count, ex=_BUILT_TTL)
+
+    # 补写构建期间修改的请求
+    while True:
+        pending = r.spop(f'{_prefix(event_id)}:pending', 1000)
+        if not pending:
+            break
+        _refresh(r, event_id, [int(request_id) for request_id in pending])
+    logger.info(f"活动 {event_id} 文本索引已构建，文档 {count} 个")
+
+
+def _ensure_built(r, event_id):
+    """索引未构建时构建；其他进程正在构建时返回 False"""
+    if r.exists(f'{_prefix(event_id)}:built'):
+        return True
+    lock = r.lock(f'{_prefix(event_id)}:lock', timeout=_BUILD_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        if not r.exists(f'{_prefix(event_id)}:built'):
+            _build(r, event_id)
+    finally:
+        lock.release()
+    return True
+
+
+def _query_terms(features, dfs, count, max_terms):
+    """查询向量中权重最高的 max_terms 个维度：[(维度, 权重)]，跳过索引中没有或过于常见的维度"""
+    dims = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+    tfs = np.fromiter(features.values(), dtype=float, count=len(features))
+    df = np.array([int(value or 0) for value in dfs], dtype=float)
+    keep = (df > 0) & (df <= max(_MAX_DF_RATIO * count, 1))
+    weights = (1 + np.log(tfs[keep])) * _idf(df[keep], count)
+    norm = np.sqrt((weights * weights).sum()) or 1.0
+    top = np.argsort(-weights, kind='stable')[:max_terms]
+    return list(zip(dims[keep][top].tolist(), (weights[top] / norm).tolist()))
+
+
+def search(event_id, text, k, exclude_user_id=None, exclude_user_ids=(), min_score=None):
+    """
+    在活动的公开请求中检索与 text 语义相近的请求（近似 top-k）
+    :param exclude_user_ids: 其他需要排除的用户
+    :param min_score: 相似度下限，默认为 MATCHING_TEXT_MIN_SCORE
+    :return: [(request_id, 相似度)]，按相似度降序
+    """
+    features = hash_features(text)
+    if k <= 0 or not features:
+        return []
+    if min_score is None:
+        min_score = settings.MATCHING_TEXT_MIN_SCORE
+    try:
+        r = get_redis()
+        if not _ensure_built(r, event_id):
+            logger.info(f"活动 {event_id} 文本索引正在构建，跳过文本召回")
+            return []
+        pipe = r.pipeline(transaction=False)
+        pipe.get(f'{_prefix(event_id)}:count')
+        pipe.hmget(f'{_prefix(event_id)}:df', list(features))
+        count, dfs = pipe.execute()
+        terms = _query_terms(features, dfs, int(count or 0), settings.MATCHING_TEXT_QUERY_TERMS)
+        pipe = r.pipeline(transaction=False)
+        for dim, _ in terms:
+            pipe.zrevrange(_posting_key(event_id, dim), 0, settings.MATCHING_TEXT_POSTINGS_LIMIT - 1, withscores=True)
+        postings = pipe.execute()
+    except Exception as e:
+        logger.warning(f"文本索引不可用，跳过文本召回: {e}")
+        return []
+
+    scores = Counter()
+    for (_, q_weight), members in zip(terms, postings):
+        for member, weight in members:
+            scores[_parse_member(member)] += q_weight * weight
+    excluded = {exclude_user_id, *exclude_user_ids}
+    return sorted(
+        ((request_id, score) for (request_id, user_id), score in scores.items()
+         if user_id not in excluded and score > min_score),
+        key=lambda item: (-item[1], item[0]),
+    )[:k]
+
+
+def _update(event_id, request_ids):
+    try:
+        r = get_redis()
+        if not r.exists(f'{_prefix(event_id)}:built'):
+            # 正在构建时记下请求，构建完成后补写；否则下次查询时会从数据库完整构建
+            if r.exists(f'{_prefix(event_id)}:lock'):
+                r.sadd(f'{_prefix(event_id)}:pending', *request_ids)
+                r.expire(f'{_prefix(event_id)}:pending', _INDEX_TTL)
+            return
+        _refresh(r, event_id, request_ids)
+    except Exception as e:
+        logger.warning(f"文本索引更新失败，活动 {event_id} 索引将重建: {e}")
+        invalidate(event_id)
+
+
+def update_request(buddy_request):
+    """请求的描述、标签或公开状态变化后调用，更新请求在索引中的文档"""
+    _update(buddy_request.event_id, [buddy_request.id])
+
+
+def invalidate(event_id):
+    """丢弃活动的索引标记，下次查询时重建"""
+    try:
+        get_redis().delete(f'{_prefix(event_id)}:built')
+    except Exception as e:
+        logger.warning(f"删除文本索引标记失败: {e}")
+
+
+@receiver(post_save, sender='matchmaking.BuddyRequest')
+def _on_request_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created and not instance.is_public:
+        return
+    if update_fields and not {'is_public', 'event', 'description'} & set(update_fields):
+        return
+    update_request(instance)
+
+
+@receiver(post_delete, sender='matchmaking.BuddyRequest')
+def _on_request_deleted(sender, instance, **kwargs):
+    if instance.is_public:
+        update_request(instance)
+
+
+@receiver(post_save, sender='profiles.UserProfile')
+def _on_profile_saved(sender, instance, update_fields=None, **kwargs):
+    if not instance.is_primary:
+        return
+    if update_fields and 'bio' not in update_fields and 'is_primary' not in update_fields:
+        return
+    from .models import BuddyRequest
+
+    requests = {}
+    for request_id, event_id in BuddyRequest.objects.filter(
+        user_id=instance.user_id, is_public=True
+    ).values_list('id', 'event_id'):
+        requests.setdefault(event_id, []).append(request_id)
+    for event_id, request_ids in requests.items():
+        _update(event_id, request_ids)
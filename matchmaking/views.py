@@ -19,12 +19,13 @@ from .serializers import (
     BuddyRequestListSerializer,
     BuddyRequestCreateSerializer,
     BuddyMatchSerializer,
+    BuddyMatchCursorPageSerializer,
     UserFeedbackSerializer,
     MatchStatusSerializer,
     BuddyRequestTagSerializer
 )
 from .filters import BuddyRequestFilter
-# from .tasks import process_buddy_request_matching  # Celery任务，暂时注释
+from .pagination import MatchCursorPagination
 
 
 @extend_schema_view(
@@ -206,20 +207,25 @@ class BuddyRequestViewSet(viewsets.ModelViewSet):
             return self.queryset.filter(user=self.request.user)
         return self.queryset
     
-    def perform_create(self, serializer):
-        buddy_request = serializer.save()
-        
-        from .tasks import process_buddy_request_matching
+    def _start_matching(self, buddy_request):
+        # 防抖、去重，内容未变化时不启动
+        from .dispatch import dispatch_matching
         try:
-            task_result = process_buddy_request_matching.delay(buddy_request.id)
-            buddy_request.celery_task_id = task_result.id
-            buddy_request.save(update_fields=['celery_task_id'])
-            logger.info(f"为搭子请求 {buddy_request.id} 启动智能匹配任务: {task_result.id}")
+            task_id = dispatch_matching(buddy_request)
+            if task_id:
+                logger.info(f"为搭子请求 {buddy_request.id} 启动智能匹配任务: {task_id}")
         except Exception as e:
             logger.error(f"启动匹配任务失败: {e}")
-        
+    
+    def perform_create(self, serializer):
+        buddy_request = serializer.save()
+        self._start_matching(buddy_request)
         return buddy_request
     
+    def perform_update(self, serializer):
+        buddy_request = serializer.save()
+        self._start_matching(buddy_request)
+    
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -308,7 +314,9 @@ class BuddyRequestViewSet(viewsets.ModelViewSet):
             response_data['message'] = '匹配尚未开始'
         
         if response_data['status'] == 'done':
-            matches = BuddyMatch.objects.filter(buddy_request=buddy_request)
+            matches = BuddyMatch.objects.filter(request=buddy_request).select_related(
+                'request', 'matched_user', 'matched_user__reputation'
+            ).order_by('-match_score', '-id')
             response_data['matches'] = BuddyMatchSerializer(matches, many=True).data
         
         serializer = MatchStatusSerializer(response_data)
@@ -321,29 +329,44 @@ class BuddyRequestViewSet(viewsets.ModelViewSet):
         活动功能说明：活动
         - 返回该搭子请求的所有匹配记录
         - 包含匹配用户信息和匹配分数
-        - 按匹配分数降序排列
+        - 按匹配分数降序排列，使用游标分页（page_size 默认20，最大100；通过返回的 next/previous 链接翻页）
         
         活动权限要求：活动 需要登录
         活动返回数据：活动 匹配用户列表，包含用户信息、匹配分数、匹配状态等
         """,
+        parameters=[
+            OpenApiParameter(
+                name='cursor',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='分页游标，取自上一次响应的 next/previous 链接'
+            ),
+            OpenApiParameter(
+                name='page_size',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='每页数量（默认20，最大100）'
+            ),
+        ],
         responses={
             200: OpenApiResponse(
-                response=BuddyMatchSerializer(many=True),
-                description="成功返回匹配结果列表"
+                response=BuddyMatchCursorPageSerializer,
+                description="成功返回匹配结果列表（游标分页）"
             ),
             404: OpenApiResponse(description="搭子请求不存在")
         },
         tags=['搭子匹配']
     )
-    @action(detail=True, methods=['get'], url_path='matches')
+    @action(detail=True, methods=['get'], url_path='matches', pagination_class=MatchCursorPagination)
     def matches(self, request, pk=None):
         buddy_request = self.get_object()
         matches = BuddyMatch.objects.filter(
-            buddy_request=buddy_request
-        ).select_related('requester', 'matched_user')
+            request=buddy_request
+        ).select_related('request', 'matched_user', 'matched_user__reputation')
         
-        serializer = BuddyMatchSerializer(matches, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(matches)
+        serializer = BuddyMatchSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 @extend_schema_view(
@@ -379,7 +402,7 @@ class BuddyMatchViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['status', 'request']
-    ordering_fields = ['matched_at']
+    ordering_fields = ['matched_at', 'match_score']
     ordering = ['-matched_at']
     
     def get_queryset(self):
@@ -387,7 +410,7 @@ class BuddyMatchViewSet(viewsets.ReadOnlyModelViewSet):
             return BuddyMatch.objects.none()
         return BuddyMatch.objects.filter(
             Q(request__user=self.request.user) | Q(matched_user=self.request.user)
-        ).select_related('matched_user', 'request')
+        ).select_related('matched_user', 'matched_user__reputation', 'request')
 
 
 @extend_schema_view(
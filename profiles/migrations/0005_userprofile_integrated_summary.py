@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0004_alter_userprofile_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='integrated_summary',
+            field=models.JSONField(blank=True, editable=False, help_text='档案摘要（匹配用，自动生成）', null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='integrated_summary_version',
+            field=models.CharField(blank=True, default='', editable=False, help_text='档案摘要对应的档案版本', max_length=80),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from authentication.models import Address
+from utils.geo import nearby
 
 User = get_user_model()
 
@@ -27,6 +28,10 @@ class UserProfile(models.Model):
     is_active = models.BooleanField(default=True, help_text='是否激活')
     is_primary = models.BooleanField(default=False, help_text='是否为主档案')
     
+    # 匹配流程使用的档案摘要（由LLM生成），版本与当前档案版本不一致时视为过期
+    integrated_summary = models.JSONField(blank=True, null=True, editable=False, help_text='档案摘要（匹配用，自动生成）')
+    integrated_summary_version = models.CharField(max_length=80, blank=True, default='', editable=False, help_text='档案摘要对应的档案版本')
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -64,6 +69,29 @@ class UserProfile(models.Model):
             return False
         return self.address.is_same_district(other_profile.address)
     
+    def get_summary_version(self):
+        """档案版本：档案本身或其地址修改后都会变化"""
+        parts = [self.updated_at.isoformat() if self.updated_at else '']
+        if self.address_id:
+            parts.append(self.address.updated_at.isoformat())
+        return '|'.join(parts)
+    
+    def get_integrated_summary(self):
+        """获取未过期的档案摘要，档案修改后返回 None"""
+        if self.integrated_summary is None or self.integrated_summary_version != self.get_summary_version():
+            return None
+        return self.integrated_summary
+    
+    def store_integrated_summary(self, summary):
+        """保存档案摘要，不更新 updated_at（否则摘要会立即过期）"""
+        version = self.get_summary_version()
+        UserProfile.objects.filter(pk=self.pk).update(
+            integrated_summary=summary,
+            integrated_summary_version=version
+        )
+        self.integrated_summary = summary
+        self.integrated_summary_version = version
+    
     def save(self, *args, **kwargs):
         if not self.pk and not self.user.profiles.exists():
             self.is_primary = True
@@ -97,3 +125,19 @@ class UserProfile(models.Model):
         if exclude_self:
             queryset = queryset.exclude(id=user_profile.id)
         return queryset
+    
+    @classmethod
+    def get_nearby_users(cls, user_profile, radius_km, exclude_self=True):
+        """
+        地址在半径内的用户档案，按距离升序
+        :return: [(档案, 距离km)]
+        """
+        if not user_profile.address or not user_profile.address.has_coordinates():
+            return []
+        
+        queryset = cls.objects.filter(is_active=True).select_related('address')
+        if exclude_self:
+            queryset = queryset.exclude(id=user_profile.id)
+        return nearby(
+            queryset, user_profile.address.latitude, user_profile.address.longitude, radius_km, prefix='address__'
+        )
@@ -0,0 +1,184 @@
+"""
+地理位置工具：geohash 编码、球面距离和"附近"查询
+
+附近查询分两步：
+1. 粗筛：把查询圆的外接经纬度矩形覆盖为若干个 geohash 单元格，按 geohash 前缀
+   （Address.geohash 上的索引）和经纬度范围过滤
+2. 精筛：对粗筛结果计算球面距离，去掉半径以外的记录并按距离排序
+
+指定 limit 时在数据库中按近似距离（等距圆柱投影）排序并只取前 limit 条再精筛，
+避免大半径查询把范围内的全部记录读入内存
+"""
+import math
+
+from django.db.models import Case, F, FloatField, Q, When
+from django.db.models.functions import Cast
+
+EARTH_RADIUS_KM = 6371.0
+GEOHASH_PRECISION = 9
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# 覆盖查询范围时最多使用的单元格数，超过时改用更短（更大）的单元格
+_MAX_CELLS = 16
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """经纬度 -> geohash 字符串"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        current, target = (lng_range, longitude) if even else (lat_range, latitude)
+        middle = (current[0] + current[1]) / 2
+        value <<= 1
+        if target >= middle:
+            value |= 1
+            current[0] = middle
+        else:
+            current[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """geohash 单元格的 (纬度跨度, 经度跨度)，单位为度"""
+    lat_bits = 5 * precision // 2
+    lng_bits = 5 * precision - lat_bits
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """两点之间的球面距离（km）"""
+    lat1, lng1, lat2, lng2 = (math.radians(float(value)) for value in (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    查询圆的外接经纬度矩形
+    :return: (最小纬度, 最大纬度, 最小经度, 最大经度)；经度跨越 ±180° 时最小经度大于最大经度，
+             包含极点时经度范围为整个 [-180, 180]
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+
+    delta_lng = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    if delta_lng >= 180:
+        return min_lat, max_lat, -180.0, 180.0
+    min_lng, max_lng = longitude - delta_lng, longitude + delta_lng
+    if min_lng < -180:
+        min_lng += 360
+    if max_lng > 180:
+        max_lng -= 360
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def covering_cells(min_lat, max_lat, min_lng, max_lng, max_cells=_MAX_CELLS):
+    """
+    覆盖经纬度矩形的 geohash 单元格（尽量长的前缀，数量不超过 max_cells）
+    :return: geohash 前缀集合，范围太大无法覆盖时返回 None
+    """
+    lng_span = max_lng - min_lng if min_lng <= max_lng else max_lng + 360 - min_lng
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lng_step = cell_size(precision)
+        first_row = math.floor((min_lat + 90) / lat_step)
+        last_row = min(math.floor((max_lat + 90) / lat_step), (1 << (5 * precision // 2)) - 1)
+        first_col = math.floor((min_lng + 180) / lng_step)
+        col_count = math.floor((min_lng + lng_span + 180) / lng_step) - first_col + 1
+        if (last_row - first_row + 1) * col_count > max_cells:
+            continue
+        cells = set()
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, first_col + col_count):
+                center_lng = (col + 0.5) * lng_step - 180
+                if center_lng >= 180:
+                    center_lng -= 360
+                cells.add(encode_geohash((row + 0.5) * lat_step - 90, center_lng, precision))
+        return cells
+    return None
+
+
+def within_radius(queryset, latitude, longitude, radius_km, prefix=''):
+    """
+    按 geohash 前缀和经纬度范围粗筛（都可以走索引），结果可能包含半径以外的记录
+    :param prefix: 地址字段的查询前缀，例如 'location__'；为空时 queryset 本身是地址
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+    queryset = queryset.filter(**{
+        f'{prefix}latitude__gte': min_lat,
+        f'{prefix}latitude__lte': max_lat,
+        f'{prefix}longitude__isnull': False,
+    })
+    if min_lng <= max_lng:
+        queryset = queryset.filter(**{f'{prefix}longitude__gte': min_lng, f'{prefix}longitude__lte': max_lng})
+    else:
+        queryset = queryset.filter(
+            Q(**{f'{prefix}longitude__gte': min_lng}) | Q(**{f'{prefix}longitude__lte': max_lng})
+        )
+
+    cells = covering_cells(min_lat, max_lat, min_lng, max_lng)
+    if cells is not None:
+        condition = Q()
+        for cell in sorted(cells):
+            condition |= Q(**{f'{prefix}geohash__startswith': cell})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def _approx_distance(latitude, longitude, radius_km, prefix=''):
+    """
+    近似距离的平方（度²，纬度方向按查询点纬度缩放经度差），可在数据库中排序；
+    查询范围跨越 ±180° 经线时把另一侧的经度平移 360°
+    """
+    lat = Cast(F(f'{prefix}latitude'), FloatField())
+    lng = Cast(F(f'{prefix}longitude'), FloatField())
+    min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+    if min_lng > max_lng:
+        shift = 360.0 if longitude > 0 else -360.0
+        lng = Case(
+            When(**{f'{prefix}longitude__lt' if shift > 0 else f'{prefix}longitude__gt': 0}, then=lng + shift),
+            default=lng,
+            output_field=FloatField(),
+        )
+    scale = math.cos(math.radians(float(latitude)))
+    d_lat = lat - float(latitude)
+    d_lng = (lng - float(longitude)) * scale
+    return d_lat * d_lat + d_lng * d_lng
+
+
+def nearby(queryset, latitude, longitude, radius_km, prefix='', limit=None):
+    """
+    半径内的记录，按距离升序
+    :param prefix: 地址字段的查询前缀，例如 'location__'（queryset 应 select_related 对应关联）
+    :param limit: 最多返回的记录数；按近似距离在数据库中截取，边界附近的取舍可能与精确距离略有出入
+    :return: [(记录, 距离km)]
+    """
+    path = [part for part in prefix.split('__') if part]
+    candidates = within_radius(queryset, latitude, longitude, radius_km, prefix)
+    if limit is not None:
+        candidates = candidates.annotate(
+            approx_distance=_approx_distance(latitude, longitude, radius_km, prefix)
+        ).order_by('approx_distance', 'pk')[:limit]
+    results = []
+    for obj in candidates:
+        address = obj
+        for part in path:
+            address = getattr(address, part)
+        distance = haversine_km(latitude, longitude, address.latitude, address.longitude)
+        if distance <= radius_km:
+            results.append((obj, distance))
+    results.sort(key=lambda item: (item[1], item[0].pk))
+    return results
@@ -0,0 +1,226 @@
+import re
+import json
+
+# 扫描时只关心括号、引号和转义符，其余字符由正则引擎整体跳过
+_STRUCTURAL = re.compile(r'[{}\[\]"\\]')
+_OPENERS = re.compile(r'[{\[]')
+_TRAILING_COMMA = re.compile(r',\s*[}\]]')
+_CLOSERS = {'{': '}', '[': ']'}
+_MISSING = object()
+
+
+def _scan(text, start):
+    """
+    从 start 处的左括号开始扫描，直到该括号闭合
+
+    Returns:
+        tuple: (end, stack, in_string, strings)
+            end 为闭合后的位置，未闭合（文本被截断）时为 None；
+            stack 为截断时仍未闭合的左括号位置；
+            in_string 表示文本是否在字符串内部被截断；
+            strings 为最近两个字符串的起始引号位置，供截断修复回退使用。
+            括号不匹配时返回 None
+    """
+    stack = []
+    strings = []
+    in_string = False
+    skip = -1
+
+    for match in _STRUCTURAL.finditer(text, start):
+        i = match.start()
+        if i == skip:
+            continue
+        ch = text[i]
+
+        if in_string:
+            if ch == '\\':
+                skip = i + 1
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch in _CLOSERS:
+            stack.append(i)
+        elif ch == '}' or ch == ']':
+            if _CLOSERS[text[stack[-1]]] != ch:
+                return None
+            stack.pop()
+            if not stack:
+                return i + 1, stack, False, strings
+        elif ch == '"':
+            in_string = True
+            strings = strings[-1:] + [i]
+
+    return None, stack, in_string, strings
+
+
+def _strip_trailing_commas(candidate):
+    """去掉 } 或 ] 之前多余的逗号（忽略字符串内部）"""
+    out = []
+    in_string = False
+    escaped = False
+    pending_comma = None
+
+    for ch in candidate:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == ',':
+            if pending_comma is not None:
+                out.append(pending_comma)
+            pending_comma = ','
+            continue
+        if ch in ' \t\r\n':
+            if pending_comma is not None:
+                pending_comma += ch
+            else:
+                out.append(ch)
+            continue
+        if pending_comma is not None:
+            if ch not in '}]':
+                out.append(pending_comma)
+            else:
+                out.append(pending_comma[1:])
+            pending_comma = None
+        if ch == '"':
+            in_string = True
+        out.append(ch)
+
+    return ''.join(out)
+
+
+def _loads(candidate):
+    """
+    尝试解析候选片段，失败时修复多余逗号后再试一次
+    :return: (value, repaired)，解析失败时 value 为 _MISSING
+    """
+    try:
+        return json.loads(candidate, strict=False), False
+    except json.JSONDecodeError:
+        pass
+
+    if not _TRAILING_COMMA.search(candidate):
+        return _MISSING, False
+    fixed = _strip_trailing_commas(candidate)
+    if fixed != candidate:
+        try:
+            return json.loads(fixed, strict=False), True
+        except json.JSONDecodeError:
+            pass
+    return _MISSING, False
+
+
+def _close_truncated(text, start, stack, in_string, strings):
+    """
+    补全被截断的JSON（例如输出达到token上限），返回补全后的片段
+
+    截断在字符串内部时整个字符串被丢弃，避免返回"夜猫"这类残缺值；
+    若丢弃的是某个键的值，键本身也一并去掉
+    """
+    end = len(text)
+    if in_string:
+        end = strings[-1]
+        if text[start:end].rstrip().endswith(':') and len(strings) > 1:
+            end = strings[-2]
+    elif text[start:end].rstrip().endswith(':') and strings:
+        end = strings[-1]
+    body = text[start:end].rstrip()
+    if body.endswith(','):
+        body = body[:-1]
+    return body + ''.join(_CLOSERS[text[i]] for i in reversed(stack))
+
+
+def _found(details, method, attempts, value):
+    if details is not None:
+        details['method'] = method
+        details['attempts'] = attempts
+    return value
+
+
+def extract_json(text, expected_type=None, max_attempts=64, details=None):
+    """
+    从LLM响应中提取第一个有效的JSON对象或数组
+
+    逐个候选扫描括号并识别字符串，不依赖可能回溯的正则。
+    每个候选从其左括号扫描到闭合处，失败后从下一个左括号重新开始，
+    最坏情况为 O(max_attempts · n)；常见输入（第一个候选即有效）为一遍线性扫描。
+    支持纯JSON、markdown代码块包装、混合文本、多余逗号以及被截断的输出。
+
+    Args:
+        text (str): LLM原始响应
+        expected_type (type, optional): 期望的类型（dict 或 list），
+            优先返回该类型的第一个有效结果
+        max_attempts (int): 最多尝试解析的候选数量
+        details (dict, optional): 传入时写入提取方式 method
+            （direct/scan/repaired/truncated/failed）和尝试次数 attempts
+
+    Returns:
+        dict | list: 解析出的JSON数据
+
+    Raises:
+        ValueError: 响应为空或不是字符串
+        json.JSONDecodeError: 找不到有效的JSON
+    """
+    if not text or not isinstance(text, str):
+        _found(details, 'failed', 0, None)
+        raise ValueError("响应为空或不是字符串")
+
+    # 快速路径：响应本身就是JSON
+    stripped = text.strip()
+    if stripped[:1] in _CLOSERS:
+        try:
+            return _found(details, 'direct', 1, json.loads(stripped, strict=False))
+        except json.JSONDecodeError:
+            pass
+
+    fallback = _MISSING
+    attempts = 0
+    pos = 0
+
+    # 依次以每个左括号作为候选起点；候选失败时从其后的下一个左括号重新开始，
+    # 这样正文引号中的孤立括号不会吞掉后面真正的JSON
+    while attempts < max_attempts:
+        match = _OPENERS.search(text, pos)
+        if match is None:
+            break
+        start = match.start()
+        attempts += 1
+        scanned = _scan(text, start)
+        if scanned is None:
+            pos = start + 1
+            continue
+        end, stack, in_string, strings = scanned
+        truncated = end is None
+        if truncated:
+            candidate = _close_truncated(text, start, stack, in_string, strings)
+            end = len(text)
+        else:
+            candidate = text[start:end]
+
+        value, repaired = _loads(candidate)
+        if value is _MISSING:
+            pos = start + 1
+            continue
+        if truncated:
+            method = 'truncated'
+        else:
+            method = 'repaired' if repaired else 'scan'
+        if expected_type is None or isinstance(value, expected_type):
+            return _found(details, method, attempts, value)
+        if fallback is _MISSING:
+            fallback = (method, value)
+        # 已解析成功的JSON内部的子结构不作为独立候选
+        pos = end
+
+    if fallback is not _MISSING:
+        return _found(details, fallback[0], attempts, fallback[1])
+
+    _found(details, 'failed', attempts, None)
+    raise json.JSONDecodeError(f"无法从响应中提取有效JSON: {text[:200]}...", text, 0)
@@ -0,0 +1,33 @@
+import threading
+
+from django.conf import settings
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_redis(socket_timeout=None):
+    """
+    获取共享的Redis客户端
+    进程内复用同一个连接池，redis-py 会在 fork 后自动重建连接。
+    默认不设置读超时，以便使用 BLPOP 等阻塞命令；
+    在请求路径上只做短操作的调用方（如LLM限流）应传入较短的读超时，Redis卡住时尽快失败
+    
+    Args:
+        socket_timeout: 读超时（秒），不同超时各自使用一个客户端
+    
+    Returns:
+        redis.Redis: Redis客户端
+    """
+    client = _clients.get(socket_timeout)
+    if client is None:
+        with _lock:
+            client = _clients.get(socket_timeout)
+            if client is None:
+                import redis
+                client = _clients[socket_timeout] = redis.Redis.from_url(
+                    settings.REDIS_URL,
+                    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+                    socket_timeout=socket_timeout,
+                )
+    return client